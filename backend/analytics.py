@@ -0,0 +1,319 @@
+"""Motor de consultas estructuradas sobre las ventas.
+
+Responde directamente (sin LLM) las preguntas numéricas más habituales
+("¿Cuántas ventas hubo en marzo de 2023?", "¿Qué ciudad tiene más ventas?")
+con roll-ups del cubo de ventas precalculado (`cube.SalesCube`). Si la intención
+de la pregunta no se reconoce, `answer` devuelve None y la consulta sigue
+por el pipeline RAG.
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from cube import SalesCube
+from data_loader import load_sales_cube
+from text_utils import MESES, NOMBRES_MES, RAICES_NEGOCIO, normalize
+
+
+# Palabra clave -> columna por la que agrupar en preguntas de ranking
+DIMENSIONES = [
+    ("categoria", "Categoria"),
+    ("producto", "NombreProducto"),
+    ("ciudad", "Ciudad"),
+    ("cliente", "NombreCliente"),
+    ("mes", "MesAño"),
+    ("ano", "Año"),
+]
+
+ETIQUETAS = {
+    "Categoria": ("categoría", "categorías"),
+    "NombreProducto": ("producto", "productos"),
+    "Ciudad": ("ciudad", "ciudades"),
+    "NombreCliente": ("cliente", "clientes"),
+    "MesAño": ("mes", "meses"),
+    "Año": ("año", "años"),
+}
+
+# Medida -> columna del cubo
+MEASURE_COLUMNS = {
+    "count": "Ventas",
+    "revenue": "Total",
+    "units": "Cantidad",
+    "avg_ticket": "TicketPromedio",
+}
+
+# Columnas de texto que pueden aparecer como filtro en la pregunta
+COLUMNAS_FILTRO = ["NombreProducto", "Categoria", "Ciudad", "NombreCliente"]
+
+_RE_ANO = re.compile(r"\b(20\d{2})\b")
+_RE_TOP = re.compile(r"\btop\s*(\d+)\b|\b(\d+)\s+(?:mejores|primeros|principales)\b")
+# "por ciudad", "por canal", "por venta": desglose o cociente que no es un solo número
+# ("por ingresos" / "por ventas" sólo eligen la medida de un ranking)
+_RE_DESGLOSE = re.compile(r"\bpor\s+(?!favor\b|ingresos\b|ventas\b|unidades\b|facturacion\b)\w+")
+
+# Vocabulario que el parser entiende; cualquier otra palabra (fuera de años,
+# meses y valores del dataset) es una medida o dimensión desconocida
+_VOCABULARIO = frozenset(
+    "a al cual cuales cuanto cuanta cuantos cuantas de del decir dime el en es esta este favor fue fueron "
+    "hay hubo la las lo los me nos o para por podes podrias puedes que se sabes son su sus tuvimos tuvo tiene tienen "
+    "un una y con muestrame mostrame muestra dame decime indica quiero saber total totales general numero "
+    "cantidad hicieron hizo realizaron ha han sido mas menos mayor menor mejor mejores peor peores top "
+    "primeros principales mes meses ano anos media promedio".split()
+)
+_PREFIJOS_VOCABULARIO = RAICES_NEGOCIO + ("distint", "diferent", "gener", "registr")
+
+
+def _has(text: str, *words: str) -> bool:
+    return any(re.search(rf"\b{w}", text) for w in words)
+
+
+@dataclass
+class ParsedQuery:
+    """Pregunta descompuesta en intención, dimensión, filtros y medida."""
+    intent: str                      # count | measure | top | distinct
+    measure: str = "count"           # count | revenue | units | avg_ticket
+    dimension: Optional[str] = None  # columna de agrupación (top / distinct)
+    filters: Dict[str, object] = field(default_factory=dict)
+    top_n: int = 1
+    ascending: bool = False
+
+
+class SalesAnalytics:
+    """Mantiene el cubo de ventas en memoria y responde preguntas agregadas."""
+
+    def __init__(self, cube: SalesCube):
+        self.cube = cube
+        # Valores normalizados -> valor original, más largos primero para que
+        # "pedro fernandez" gane sobre coincidencias parciales.
+        self._valores: List[Tuple[str, str, str]] = []
+        for col in COLUMNAS_FILTRO:
+            for val in cube.values(col):
+                self._valores.append((normalize(str(val)), col, val))
+        self._valores.sort(key=lambda t: len(t[0]), reverse=True)
+
+    def entity_values(self) -> List[str]:
+        """Productos, categorías, ciudades y clientes del cubo (normalizados)."""
+        return [norm for norm, _, _ in self._valores]
+
+    @classmethod
+    def from_excel(cls, path: str) -> Optional["SalesAnalytics"]:
+        cube = load_sales_cube(path)
+        if cube is None:
+            return None
+        return cls(cube)
+
+    # ------------------------------------------------------------------
+    # Parsing
+    # ------------------------------------------------------------------
+    def _parse_filters(self, text: str) -> Dict[str, object]:
+        filters: Dict[str, object] = {}
+        m = _RE_ANO.search(text)
+        if m:
+            filters["Año"] = int(m.group(1))
+        for nombre, num in MESES.items():
+            if re.search(rf"\b{nombre}\b", text):
+                filters["Mes"] = num
+                break
+        for norm, col, val in self._valores:
+            if col not in filters and re.search(rf"\b{re.escape(norm)}\b", text):
+                filters[col] = val
+        return filters
+
+    def _unsupported(self, text: str) -> bool:
+        """True si la pregunta pide algo que no se responde con un número del cubo (va al RAG)."""
+        if _RE_DESGLOSE.search(text):
+            return True
+        # Un filtro con varios valores ("en 2023 y 2024", "entre enero y marzo")
+        if len(set(_RE_ANO.findall(text))) > 1:
+            return True
+        if len({num for nombre, num in MESES.items() if re.search(rf"\b{nombre}\b", text)}) > 1:
+            return True
+        rest = text
+        por_columna: Dict[str, int] = {}
+        for norm, col, _ in self._valores:
+            pattern = rf"\b{re.escape(norm)}\b"
+            if re.search(pattern, rest):
+                por_columna[col] = por_columna.get(col, 0) + 1
+                rest = re.sub(pattern, " ", rest)
+        if any(n > 1 for n in por_columna.values()):
+            return True
+        rest = _RE_TOP.sub(" ", _RE_ANO.sub(" ", rest))
+        return any(
+            w not in _VOCABULARIO and w not in MESES and not w.startswith(_PREFIJOS_VOCABULARIO)
+            for w in rest.split()
+        )
+
+    def extract_filters(self, question: str) -> Dict[str, object]:
+        """Filtros (año, mes, producto, cliente, ciudad, categoría) mencionados en la pregunta."""
+        return self._parse_filters(normalize(question))
+
+    def parse(self, question: str) -> Optional[ParsedQuery]:
+        text = normalize(question)
+        if not text or self._unsupported(text):
+            return None
+
+        filters = self._parse_filters(text)
+
+        if _has(text, "ticket promedio", "promedio", "media"):
+            measure = "avg_ticket"
+        elif _has(text, "ingres", "factur", "recaud", "monto", "dinero", "gananci"):
+            measure = "revenue"
+        elif _has(text, "unidades", "cantidad de productos", "mas vendid", "menos vendid"):
+            measure = "units"
+        else:
+            measure = "count"
+
+        dimension = None
+        for palabra, col in DIMENSIONES:
+            if re.search(rf"\b{palabra}(e?s)?\b", text) and col not in filters:
+                dimension = col
+                break
+
+        # Ranking: "¿Qué ciudad tiene más ventas?", "top 3 de productos"
+        top = _RE_TOP.search(text)
+        es_ranking = top is not None or _has(
+            text, "mas vendid", "menos vendid", "mas ventas", "menos ventas",
+            "mas compras", "menos compras", "mas ingresos", "menos ingresos",
+            "mayor", "menor", "mejor", "peor", "genero mas", "genero menos",
+            "tiene mas", "tiene menos", "vendio mas", "vendio menos", "compro mas",
+        )
+        if es_ranking and dimension is not None:
+            n = 1
+            if top is not None:
+                n = int(top.group(1) or top.group(2))
+            ascending = _has(text, "menos", "menor", "peor")
+            return ParsedQuery("top", measure, dimension, filters, top_n=max(n, 1), ascending=ascending)
+
+        # Conteo de entidades distintas: "¿Cuántos clientes diferentes compraron?"
+        if dimension in ("NombreCliente", "NombreProducto", "Ciudad", "Categoria") and _has(text, "cuant"):
+            # "¿Cuántos productos se vendieron?" pregunta unidades, no productos distintos
+            if dimension == "NombreProducto" and _has(text, "vend") and not _has(text, "distint", "diferent"):
+                return ParsedQuery("measure", "units", None, filters)
+            if not _has(text, "ventas", "transacciones"):
+                return ParsedQuery("distinct", "count", dimension, filters)
+
+        if measure in ("revenue", "units", "avg_ticket") and _has(text, "cuant", "total", "cual", "fue", "hubo", "promedio"):
+            return ParsedQuery("measure", measure, None, filters)
+
+        # Conteo de ventas: "¿Cuántas ventas hubo en marzo de 2023?"
+        if _has(text, "cuant", "numero de", "cantidad de") and _has(text, "ventas", "transacciones", "compras", "pedidos"):
+            return ParsedQuery("count", "count", None, filters)
+
+        return None
+
+    # ------------------------------------------------------------------
+    # Ejecución
+    # ------------------------------------------------------------------
+    def execute(self, parsed: ParsedQuery) -> Optional[str]:
+        alcance = _describe_filters(parsed.filters)
+
+        if parsed.intent in ("count", "measure"):
+            totales = self.cube.totals(parsed.filters)
+
+        if parsed.intent == "count":
+            n = int(totales["Ventas"])
+            return f"{_cap(alcance) if alcance else 'En total'} hubo {n} ventas."
+
+        if parsed.intent == "measure":
+            if totales["Ventas"] == 0:
+                return f"No hay ventas registradas {alcance}.".replace("  ", " ")
+            valor = totales[MEASURE_COLUMNS[parsed.measure]]
+            prefijo = _cap(alcance) if alcance else "En total"
+            if parsed.measure == "revenue":
+                return f"{prefijo} los ingresos fueron de {_money(valor)}."
+            if parsed.measure == "units":
+                return f"{prefijo} se vendieron {int(valor)} unidades."
+            return f"{prefijo} el ticket promedio fue de {_money(valor)}."
+
+        if parsed.intent == "distinct":
+            grupos = self.cube.rollup([parsed.dimension], parsed.filters)
+            n = int((grupos["Ventas"] > 0).sum())
+            singular, plural = ETIQUETAS[parsed.dimension]
+            sufijo = f" {alcance}" if alcance else ""
+            distintos = "distintas" if _article(parsed.dimension) == "la" else "distintos"
+            return f"Hay {n} {plural if n != 1 else singular} {distintos} con ventas registradas{sufijo}."
+
+        if parsed.intent == "top":
+            grupos = self.cube.rollup([parsed.dimension], parsed.filters)
+            if grupos.empty:
+                return f"No hay ventas registradas {alcance}.".replace("  ", " ")
+            serie = grupos[MEASURE_COLUMNS[parsed.measure]]
+            serie = serie.sort_values(ascending=parsed.ascending).head(parsed.top_n)
+            singular, plural = ETIQUETAS[parsed.dimension]
+            sufijo = f" {alcance}" if alcance else ""
+            if parsed.measure == "avg_ticket":
+                extremo = "menor" if parsed.ascending else "mayor"
+            else:
+                extremo = "menos" if parsed.ascending else "más"
+            if parsed.top_n == 1:
+                nombre, valor = serie.index[0], serie.iloc[0]
+                return (
+                    f"{_cap(_label(parsed.dimension, nombre))} es {_article(parsed.dimension)} "
+                    f"{singular} con {extremo} {_measure_label(parsed.measure)}{sufijo}, "
+                    f"con {_format_value(parsed.measure, valor)}."
+                )
+            partes = [f"{_label(parsed.dimension, k)} ({_format_value(parsed.measure, v)})" for k, v in serie.items()]
+            return (
+                f"El top {len(partes)} de {plural} por {_measure_label(parsed.measure)}{sufijo} es: "
+                + ", ".join(partes) + "."
+            )
+
+        return None
+
+    def answer(self, question: str) -> Optional[str]:
+        parsed = self.parse(question)
+        if parsed is None:
+            return None
+        return self.execute(parsed)
+
+
+def _cap(text: str) -> str:
+    # A diferencia de str.capitalize, no pasa a minúsculas el resto del texto
+    return text[:1].upper() + text[1:]
+
+
+def _money(value) -> str:
+    return f"${value:,.2f}"
+
+
+def _measure_label(measure: str) -> str:
+    return {"revenue": "ingresos", "units": "unidades vendidas", "avg_ticket": "ticket promedio"}.get(measure, "ventas")
+
+
+def _format_value(measure: str, value) -> str:
+    if measure in ("revenue", "avg_ticket"):
+        return _money(value)
+    if measure == "units":
+        return f"{int(value)} unidades"
+    return f"{int(value)} ventas"
+
+
+def _article(dimension: str) -> str:
+    return "la" if dimension in ("Categoria", "Ciudad") else "el"
+
+
+def _label(dimension: str, value) -> str:
+    if dimension == "MesAño":
+        anio, mes = str(value).split("-")
+        return f"{NOMBRES_MES[int(mes)]} de {anio}"
+    return str(value)
+
+
+def _describe_filters(filters: Dict[str, object]) -> str:
+    partes = []
+    if "Mes" in filters and "Año" in filters:
+        partes.append(f"en {NOMBRES_MES[int(filters['Mes'])]} de {filters['Año']}")
+    elif "Mes" in filters:
+        partes.append(f"en {NOMBRES_MES[int(filters['Mes'])]}")
+    elif "Año" in filters:
+        partes.append(f"en {filters['Año']}")
+    if "NombreProducto" in filters:
+        partes.append(f"para el producto {filters['NombreProducto']}")
+    if "Categoria" in filters:
+        partes.append(f"en la categoría {filters['Categoria']}")
+    if "Ciudad" in filters:
+        partes.append(f"en {filters['Ciudad']}")
+    if "NombreCliente" in filters:
+        partes.append(f"para el cliente {filters['NombreCliente']}")
+    return " ".join(partes)
@@ -0,0 +1,288 @@
+"""Índice ANN (aproximado) según el tamaño del corpus.
+
+`FAISS.from_documents` arma un índice plano: búsqueda exacta por fuerza bruta
+y vectores float32 completos. Con pocos miles de documentos es lo mejor, pero
+con documentos por entidad a lo largo de varios años deja de escalar. Al
+guardar cada versión, el builder elige:
+
+- `flat`  (menos de `ANN_FLAT_MAX_DOCS`): exacto, sin entrenamiento.
+- `hnsw`  (hasta `ANN_HNSW_MAX_DOCS`): grafo HNSW; búsqueda sub-lineal con
+  recall muy alto, a costa de algo más de memoria.
+- `ivfpq` (más grande): listas invertidas + product quantization (`m` bytes
+  por vector en lugar de 4·d), entrenado con una muestra del corpus. PQ solo
+  pierde demasiado recall, así que los candidatos se reordenan con los
+  vectores exactos (`RFlat`, `k_factor` candidatos por resultado). Con el
+  índice mapeado en memoria sólo se leen del disco los vectores candidatos.
+
+`ANN_INDEX` fuerza el tipo. Después de construirlo se mide el recall@k contra
+la búsqueda exacta, con una muestra de vectores del propio corpus como
+consultas, y se elige el menor `efSearch` (HNSW) o `nprobe` / `k_factor`
+(IVF-PQ) que alcanza `ANN_TARGET_RECALL`. Eso queda en el manifest y se
+aplica al cargar; `ANN_EF_SEARCH`, `ANN_NPROBE` y `ANN_K_FACTOR` (o los
+argumentos de `build_qa`) lo pisan.
+
+El builder incremental trabaja sobre un índice plano (HNSW no admite borrar),
+reconstruido desde los vectores exactos que guardan ambos tipos; el índice
+ANN se rehace en cada versión.
+"""
+
+import math
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+
+
+FLAT = "flat"
+HNSW = "hnsw"
+IVFPQ = "ivfpq"
+KINDS = (FLAT, HNSW, IVFPQ)
+
+# Debajo de esto no hay datos suficientes para entrenar IVF + PQ (256 centroides por subespacio)
+MIN_IVFPQ_DOCS = 10000
+
+EF_SEARCH_SWEEP = (16, 32, 64, 128, 256, 512)
+NPROBE_SWEEP = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+K_FACTOR_SWEEP = (1, 2, 4, 8, 16)
+
+
+@dataclass
+class AnnBuild:
+    index: object
+    kind: str
+    search_params: Dict[str, int] = field(default_factory=dict)
+    recall: Optional[float] = None                     # recall@k con los parámetros elegidos
+    sweep: List[dict] = field(default_factory=list)    # recall y latencia por combinación probada
+    build_seconds: float = 0.0
+
+    def report(self) -> dict:
+        """Resumen para el manifest."""
+        return {
+            "kind": self.kind,
+            "search_params": self.search_params,
+            "recall": self.recall,
+            "recall_k": _recall_k() if self.kind != FLAT else None,
+            "sweep": self.sweep,
+            "build_seconds": self.build_seconds,
+        }
+
+
+def _recall_k() -> int:
+    return int(os.getenv("ANN_RECALL_K", "10"))
+
+
+def choose_kind(n: int) -> str:
+    kind = os.getenv("ANN_INDEX", "auto").lower()
+    if kind not in KINDS:
+        if n < int(os.getenv("ANN_FLAT_MAX_DOCS", "20000")):
+            kind = FLAT
+        elif n < int(os.getenv("ANN_HNSW_MAX_DOCS", "1000000")):
+            kind = HNSW
+        else:
+            kind = IVFPQ
+    if kind == IVFPQ and n < MIN_IVFPQ_DOCS:
+        print(f"[WARN] {n} documentos no alcanzan para entrenar IVF-PQ (mínimo {MIN_IVFPQ_DOCS}); se usa HNSW.")
+        kind = HNSW
+    return kind
+
+
+def _pq_m(d: int) -> int:
+    # Subcuantizadores: divisor de d, por defecto uno cada 8 dimensiones
+    target = int(os.getenv("ANN_PQ_M", "0")) or max(1, d // 8)
+    for m in range(min(target, d), 0, -1):
+        if d % m == 0:
+            return m
+    return 1
+
+
+def _nlist(n: int) -> int:
+    nlist = int(os.getenv("ANN_NLIST", "0")) or int(4 * math.sqrt(n))
+    # Al menos ~39 puntos de entrenamiento por centroide
+    return max(1, min(nlist, n // 39))
+
+
+def _ivf(index):
+    try:
+        return faiss.extract_index_ivf(index)
+    except Exception:
+        return None
+
+
+def _is_refine(index) -> bool:
+    return hasattr(index, "refine_index")
+
+
+def is_flat(index) -> bool:
+    return isinstance(index, faiss.IndexFlat)
+
+
+# ----------------------------------------------------------------------
+# Parámetros de búsqueda
+# ----------------------------------------------------------------------
+def set_search_params(
+    index, ef_search: Optional[int] = None, nprobe: Optional[int] = None, k_factor: Optional[int] = None
+) -> None:
+    if ef_search and hasattr(index, "hnsw"):
+        index.hnsw.efSearch = int(ef_search)
+    if nprobe:
+        ivf = _ivf(index)
+        if ivf is not None:
+            ivf.nprobe = int(nprobe)
+    if k_factor and _is_refine(index):
+        index.k_factor = float(k_factor)
+
+
+def search_params(index) -> Dict[str, int]:
+    if hasattr(index, "hnsw"):
+        return {"ef_search": int(index.hnsw.efSearch)}
+    params = {}
+    ivf = _ivf(index)
+    if ivf is not None:
+        params["nprobe"] = int(ivf.nprobe)
+    if _is_refine(index):
+        params["k_factor"] = int(index.k_factor)
+    return params
+
+
+def configure(
+    index,
+    tuned: Optional[dict] = None,
+    ef_search: Optional[int] = None,
+    nprobe: Optional[int] = None,
+    k_factor: Optional[int] = None,
+) -> Dict[str, int]:
+    """Aplica los parámetros calibrados al construir, pisados por argumentos o variables de entorno."""
+    params = dict(tuned or {})
+    overrides = {
+        "ef_search": ef_search or int(os.getenv("ANN_EF_SEARCH", "0") or 0),
+        "nprobe": nprobe or int(os.getenv("ANN_NPROBE", "0") or 0),
+        "k_factor": k_factor or int(os.getenv("ANN_K_FACTOR", "0") or 0),
+    }
+    params.update({name: value for name, value in overrides.items() if value})
+    set_search_params(index, params.get("ef_search"), params.get("nprobe"), params.get("k_factor"))
+    return search_params(index)
+
+
+def filtered_search_params(index, selector):
+    """`SearchParameters` con un selector de ids, del tipo que espera `index`.
+
+    HNSW, IVF y el reordenamiento exigen sus propias clases de parámetros (y
+    toman `efSearch` / `nprobe` / `k_factor` de ellas, no del índice), así
+    que se copian los valores actuales.
+    """
+    if hasattr(index, "hnsw"):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    ivf = _ivf(index)
+    if ivf is None:
+        return faiss.SearchParameters(sel=selector)
+    params = faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    if _is_refine(index):
+        params = faiss.IndexRefineSearchParameters(k_factor=index.k_factor, base_index_params=params)
+    return params
+
+
+# ----------------------------------------------------------------------
+# Construcción
+# ----------------------------------------------------------------------
+def to_flat(index):
+    """Índice plano equivalente (para que el builder pueda agregar y borrar)."""
+    if is_flat(index):
+        return index
+    if not (hasattr(index, "hnsw") or _is_refine(index)):
+        raise ValueError(f"No se pueden recuperar los vectores exactos de {type(index).__name__}")
+    # HNSWFlat y RFlat guardan los vectores completos
+    flat = faiss.IndexFlat(index.d, index.metric_type)
+    flat.add(index.reconstruct_n(0, index.ntotal))
+    return flat
+
+
+def _train_sample(vectors: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    size = int(os.getenv("ANN_TRAIN_SAMPLE", "100000"))
+    if len(vectors) <= size:
+        return vectors
+    return vectors[np.sort(rng.choice(len(vectors), size, replace=False))]
+
+
+def _build(kind: str, vectors: np.ndarray, metric: int, rng: np.random.Generator):
+    n, d = vectors.shape
+    if kind == HNSW:
+        index = faiss.index_factory(d, f"HNSW{int(os.getenv('ANN_HNSW_M', '32'))}", metric)
+        index.hnsw.efConstruction = int(os.getenv("ANN_EF_CONSTRUCTION", "80"))
+    else:
+        index = faiss.index_factory(d, f"IVF{_nlist(n)},PQ{_pq_m(d)},RFlat", metric)
+        index.train(_train_sample(vectors, rng))
+    for start in range(0, n, 65536):
+        index.add(vectors[start:start + 65536])
+    return index
+
+
+def _recall(index, queries: np.ndarray, exact: np.ndarray, k: int) -> float:
+    _, found = index.search(queries, k)
+    hits = sum(len(np.intersect1d(f[f >= 0], e[e >= 0])) for f, e in zip(found, exact))
+    return hits / max(1, int((exact >= 0).sum()))
+
+
+def _candidates(index, kind: str, k: int) -> List[Dict[str, int]]:
+    # Combinaciones en orden de costo creciente
+    if kind == HNSW:
+        return [{"ef_search": v} for v in EF_SEARCH_SWEEP if v >= k] or [{"ef_search": k}]
+    nlist = _ivf(index).nlist
+    nprobes = [v for v in NPROBE_SWEEP if v < nlist] + [nlist]
+    return [{"k_factor": kf, "nprobe": v} for kf in K_FACTOR_SWEEP for v in nprobes]
+
+
+def _tune(index, kind: str, queries: np.ndarray, exact: np.ndarray, k: int):
+    target = float(os.getenv("ANN_TARGET_RECALL", "0.95"))
+    sweep: List[dict] = []
+    chosen = None
+    previous = None
+    for params in _candidates(index, kind, k):
+        if previous is not None and previous.get("plateau") and previous.get("k_factor") == params.get("k_factor"):
+            continue
+        set_search_params(index, **params)
+        start = time.perf_counter()
+        recall = _recall(index, queries, exact, k)
+        ms = (time.perf_counter() - start) * 1000.0 / len(queries)
+        sweep.append(dict(params, recall=round(recall, 4), ms_per_query=round(ms, 4)))
+        if recall >= target:
+            chosen = sweep[-1]
+            break
+        # Con el mismo k_factor, más nprobe ya no mejora: pasar al siguiente
+        if previous is not None and previous.get("k_factor") == params.get("k_factor") and recall <= previous["recall"]:
+            sweep[-1]["plateau"] = True
+        previous = sweep[-1]
+    if chosen is None:
+        # Ninguno alcanzó el objetivo: el de mejor recall
+        chosen = max(sweep, key=lambda s: s["recall"])
+        print(f"[WARN] Recall objetivo {target} no alcanzado; mejor {chosen}.")
+    params = {name: chosen[name] for name in ("ef_search", "nprobe", "k_factor") if name in chosen}
+    set_search_params(index, **params)
+    return params, chosen["recall"], sweep
+
+
+def build_ann(flat_index) -> AnnBuild:
+    """Construye el índice que corresponde al tamaño de `flat_index` y calibra su búsqueda."""
+    n = flat_index.ntotal
+    kind = choose_kind(n)
+    if kind == FLAT or n == 0:
+        return AnnBuild(flat_index, FLAT)
+
+    start = time.perf_counter()
+    rng = np.random.default_rng(0)
+    vectors = flat_index.reconstruct_n(0, n)
+    index = _build(kind, vectors, flat_index.metric_type, rng)
+
+    # Consultas de prueba: vectores del corpus (el propio documento cuenta como vecino)
+    k = min(_recall_k(), n)
+    n_queries = min(int(os.getenv("ANN_RECALL_QUERIES", "200")), n)
+    queries = vectors[rng.choice(n, n_queries, replace=False)]
+    _, exact = flat_index.search(queries, k)
+    params, recall, sweep = _tune(index, kind, queries, exact, k)
+
+    build = AnnBuild(index, kind, params, recall, sweep, round(time.perf_counter() - start, 3))
+    print(f"[INFO] Índice ANN {kind} ({type(index).__name__}, {n} vectores) en {build.build_seconds}s: "
+          f"recall@{k} {recall:.3f} vs búsqueda exacta con {params}")
+    return build
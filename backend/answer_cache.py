@@ -0,0 +1,336 @@
+"""Caché semántico de respuestas delante de `/query`.
+
+1. Coincidencia exacta sobre la pregunta normalizada (`clean_question`).
+2. Vecino más cercano (coseno) entre los embeddings de preguntas anteriores,
+   usando el mismo modelo de embeddings que el vectorstore. Se acepta si la
+   similitud supera el umbral y los números, meses, comparativos (más /
+   menos, mayor / menor) y valores del dataset (productos, clientes,
+   ciudades, categorías) de ambas preguntas coinciden: "ventas en 2023" no
+   debe responder "ventas en 2024", ni "ventas en Asunción" a "ventas en Encarnación".
+
+Las entradas tienen tamaño acotado (LRU), expiran por TTL y se descartan
+todas cuando cambia la versión del dataset.
+
+Con un backend compartido (`shared_cache.py`, varios workers) cada respuesta
+se escribe también ahí, bajo la versión del dataset: una pregunta exacta se
+busca en el backend si no está en memoria, y las respuestas nuevas de los
+otros workers se traen cada `SHARED_CACHE_SYNC_SECONDS` para la búsqueda
+semántica.
+"""
+
+import base64
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+from text_utils import clean_question, normalize
+
+
+# Con \b: "mayor" no debe contar como el mes "mayo"
+_GUARD = re.compile(
+    r"\d+|\b(?:enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|setiembre|octubre|noviembre|diciembre"
+    r"|mas|menos|mayor(?:es)?|menor(?:es)?|mejor(?:es)?|peor(?:es)?)\b"
+)
+
+
+def _guard_tokens(text: str, entities: Optional[re.Pattern] = None) -> frozenset:
+    text = normalize(text)
+    tokens = set(_GUARD.findall(text))
+    if entities is not None:
+        tokens.update(entities.findall(text))
+    return frozenset(tokens)
+
+
+@dataclass
+class CacheEntry:
+    answer: str
+    vector: Optional[np.ndarray]
+    guard: frozenset
+    created: float
+
+
+@dataclass
+class CacheHit:
+    answer: str
+    kind: str          # "exact" | "semantic"
+    similarity: float
+    matched: str       # pregunta normalizada que produjo la respuesta
+
+
+class SemanticAnswerCache:
+    """Caché LRU + TTL de respuestas, con búsqueda por similitud de preguntas."""
+
+    def __init__(
+        self,
+        embeddings=None,
+        max_entries: int = 512,
+        ttl_seconds: float = 3600.0,
+        similarity_threshold: float = 0.92,
+        shared=None,
+        sync_seconds: float = 1.0,
+    ):
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.shared = shared
+        self.sync_seconds = sync_seconds
+        self.version: Optional[str] = None
+        # Valores del dataset que también tienen que coincidir (ver `set_entities`)
+        self._entities: Optional[re.Pattern] = None
+        # Hora de escritura de la última entrada traída del backend compartido
+        self._synced = 0.0
+        self._next_sync = 0.0
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        # Matriz de vectores (filas normalizadas) alineada con `_keys`;
+        # se reconstruye perezosamente cuando cambia el conjunto de entradas.
+        self._keys: List[str] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._dirty = False
+
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.shared_hits = 0
+        self.synced_entries = 0
+
+    @classmethod
+    def from_env(cls, embeddings=None, shared=None) -> "SemanticAnswerCache":
+        return cls(
+            embeddings=embeddings,
+            max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "512")),
+            ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+            similarity_threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92")),
+            shared=shared,
+            sync_seconds=float(os.getenv("SHARED_CACHE_SYNC_SECONDS", "1")),
+        )
+
+    # ------------------------------------------------------------------
+    def _embed(self, text: str) -> Optional[np.ndarray]:
+        if self.embeddings is None:
+            return None
+        try:
+            vec = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        except Exception as e:
+            print(f"[WARN] Caché: no se pudo calcular el embedding: {str(e)[:100]}")
+            return None
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    # ------------------------------------------------------------------
+    # Backend compartido
+    # ------------------------------------------------------------------
+    def _namespace(self) -> str:
+        return f"answers:{self.version}"
+
+    @staticmethod
+    def _encode(entry: CacheEntry) -> str:
+        vector = base64.b64encode(entry.vector.tobytes()).decode("ascii") if entry.vector is not None else None
+        return json.dumps({"answer": entry.answer, "vector": vector, "created": entry.created}, ensure_ascii=False)
+
+    def _decode(self, key: str, value: str) -> CacheEntry:
+        data = json.loads(value)
+        vector = np.frombuffer(base64.b64decode(data["vector"]), dtype=np.float32) if data.get("vector") else None
+        return CacheEntry(data["answer"], vector, _guard_tokens(key, self._entities), data["created"])
+
+    def _add_local(self, key: str, entry: CacheEntry) -> None:
+        # Con self._lock tomado
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._dirty = True
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _shared_get(self, key: str, now: float) -> Optional[CacheEntry]:
+        try:
+            found = self.shared.get(self._namespace(), key)
+        except Exception as e:
+            print(f"[WARN] Caché compartido no disponible: {str(e)[:100]}")
+            return None
+        if found is None:
+            return None
+        entry = self._decode(key, found[0])
+        return None if self._expired(entry, now) else entry
+
+    def _sync(self, now: float) -> None:
+        """Trae las respuestas que otros workers escribieron desde la última sincronización."""
+        if self.shared is None or now < self._next_sync:
+            return
+        self._next_sync = now + self.sync_seconds
+        namespace, version = self._namespace(), self.version
+        try:
+            rows = self.shared.since(namespace, self._synced)
+        except Exception as e:
+            print(f"[WARN] Caché compartido no disponible: {str(e)[:100]}")
+            return
+        with self._lock:
+            if version != self.version:
+                return
+            for key, value, updated in rows:
+                self._synced = max(self._synced, updated)
+                if key in self._entries:
+                    continue
+                entry = self._decode(key, value)
+                if not self._expired(entry, now):
+                    self._add_local(key, entry)
+                    self.synced_entries += 1
+
+    def _expired(self, entry: CacheEntry, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - entry.created > self.ttl_seconds
+
+    def _remove(self, key: str) -> None:
+        del self._entries[key]
+        self._dirty = True
+
+    def _purge_expired(self, now: float) -> None:
+        expired = [k for k, e in self._entries.items() if self._expired(e, now)]
+        for k in expired:
+            self._remove(k)
+        self.expirations += len(expired)
+
+    def _nearest(self, vec: np.ndarray):
+        if self._dirty or self._matrix is None:
+            self._keys = [k for k, e in self._entries.items() if e.vector is not None]
+            self._matrix = np.vstack([self._entries[k].vector for k in self._keys]) if self._keys else None
+            self._dirty = False
+        if self._matrix is None:
+            return None, 0.0
+        sims = self._matrix @ vec
+        i = int(np.argmax(sims))
+        return self._keys[i], float(sims[i])
+
+    # ------------------------------------------------------------------
+    def get(self, question: str) -> Optional[CacheHit]:
+        key = clean_question(question)
+        now = time.time()
+        self._sync(now)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry, now):
+                    self._entries.move_to_end(key)
+                    self.hits_exact += 1
+                    return CacheHit(entry.answer, "exact", 1.0, key)
+                self._remove(key)
+                self.expirations += 1
+
+        # Otro worker pudo haberla respondido después de la última sincronización
+        if self.shared is not None:
+            entry = self._shared_get(key, now)
+            if entry is not None:
+                with self._lock:
+                    self._add_local(key, entry)
+                    self.hits_exact += 1
+                    self.shared_hits += 1
+                return CacheHit(entry.answer, "exact", 1.0, key)
+
+        with self._lock:
+            if not self._entries or self.embeddings is None:
+                self.misses += 1
+                return None
+
+        # El embedding se calcula fuera del lock
+        vec = self._embed(key)
+
+        with self._lock:
+            self._purge_expired(now)
+            if vec is not None:
+                match, sim = self._nearest(vec)
+                if match is not None and sim >= self.similarity_threshold:
+                    entry = self._entries[match]
+                    if entry.guard == _guard_tokens(key, self._entities):
+                        self._entries.move_to_end(match)
+                        self.hits_semantic += 1
+                        return CacheHit(entry.answer, "semantic", sim, match)
+            self.misses += 1
+            return None
+
+    def put(self, question: str, answer: str, version: Optional[str] = None) -> None:
+        """Guarda una respuesta; si se pasa `version` y ya no es la vigente, se descarta."""
+        key = clean_question(question)
+        if not key:
+            return
+        vec = self._embed(key)
+        entry = CacheEntry(answer, vec, _guard_tokens(key, self._entities), time.time())
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._add_local(key, entry)
+            namespace = self._namespace()
+        if self.shared is not None:
+            try:
+                self.shared.put(namespace, key, self._encode(entry), max_entries=self.max_entries)
+            except Exception as e:
+                print(f"[WARN] Caché compartido no disponible: {str(e)[:100]}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._keys = []
+            self._matrix = None
+            self._dirty = False
+            self._synced = 0.0
+            self._next_sync = 0.0
+            self.invalidations += 1
+
+    def set_entities(self, values: Iterable[str]) -> None:
+        """Valores del dataset (productos, clientes, ciudades...) que distinguen dos preguntas parecidas."""
+        names = sorted({normalize(str(v)) for v in values} - {""}, key=len, reverse=True)
+        pattern = re.compile(r"\b(?:" + "|".join(re.escape(n) for n in names) + r")\b") if names else None
+        with self._lock:
+            self._entities = pattern
+            for key, entry in self._entries.items():
+                entry.guard = _guard_tokens(key, pattern)
+
+    def set_version(self, version: Optional[str]) -> None:
+        """Fija la versión del dataset; si cambia, invalida todo el caché."""
+        if version != self.version:
+            old, self.version = self.version, version
+            if old is not None:
+                print(f"[INFO] Caché invalidado: dataset {old} -> {version}")
+                self.clear()
+                # Las respuestas de la versión anterior tampoco sirven a los otros workers
+                if self.shared is not None:
+                    try:
+                        self.shared.clear(f"answers:{old}")
+                    except Exception as e:
+                        print(f"[WARN] Caché compartido no disponible: {str(e)[:100]}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.hits_exact + self.hits_semantic
+            total = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "similarity_threshold": self.similarity_threshold,
+                "dataset_version": self.version,
+                "hits": hits,
+                "hits_exact": self.hits_exact,
+                "hits_semantic": self.hits_semantic,
+                "misses": self.misses,
+                "hit_rate": round(hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "shared": self.shared.name if self.shared is not None else None,
+                "shared_hits": self.shared_hits,
+                "synced_entries": self.synced_entries,
+            }
@@ -1,11 +1,27 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, Field
-from typing import List
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from dataclasses import asdict
+import asyncio
+import json
 import os
-import re
+import threading
+import time
 from dotenv import load_dotenv
-from rag_pipeline import build_qa
+from answer_cache import CacheHit
+from dataset_registry import DEFAULT_DATASET, Dataset, DatasetConfig, DatasetRegistry
+from embedding_service import get_embeddings, warm_up
+from embedding_service import info as embedding_info
+from llm_gateway import LLMGateway
+from llm_scheduler import LLMScheduler, SchedulerSaturated
+from metrics import request_trace, span
+import metrics
+from shared_cache import get_backend
+from sessions import FollowUpRewriter, Session, SessionStore
+from text_utils import clean_question
 
 # Cargar variables de entorno desde `backend/env` (si existe)
 load_dotenv(os.path.join(os.path.dirname(__file__), "env"))
@@ -26,18 +42,105 @@ app.add_middleware(
 
 class QueryIn(BaseModel):
 	question: str
+	# Conversación a la que pertenece la pregunta (sin id, la consulta no tiene historial)
+	session_id: Optional[str] = None
+	# Dataset a consultar (ver dataset_registry.py); sin id, el de DATASET_PATH
+	dataset: Optional[str] = None
+
+
+class SourceOut(BaseModel):
+	id: str
+	# 1 = el documento más relevante del retrieval
+	rank: int
+	# None si el retriever no da puntajes; cómo leerlo lo indica `score_kind`
+	score: Optional[float] = None
+	# rrf (retriever híbrido, mayor = mejor) | distance (FAISS, menor = mejor) | vectorstore
+	score_kind: Optional[str] = None
+	# Posición del documento en el índice FAISS
+	position: Optional[int] = None
+	# Posición en cada ranking que fusiona el retriever híbrido (None = no apareció)
+	bm25_rank: Optional[int] = None
+	vector_rank: Optional[int] = None
+	metadata_rank: Optional[int] = None
+	metadata: Dict[str, Any] = Field(default_factory=dict)
+
+
+class CacheMatchOut(BaseModel):
+	# exact | semantic
+	kind: str
+	similarity: float
+	# Pregunta (normalizada) cuya respuesta se reutilizó
+	matched: str
 
 
 class QueryOut(BaseModel):
 	answer: str
 	sources: List[str] = Field(default_factory=list)
+	# Tokens del prompt enviado al LLM (None si no se llamó al LLM)
+	prompt_tokens: Optional[int] = None
+	session_id: Optional[str] = None
+	# Pregunta autónoma que se respondió (la repregunta reescrita con la sesión)
+	standalone_question: Optional[str] = None
+	# Cómo se respondió: greeting | canonical | analytics | cache | rag | fallback
+	engine: Optional[str] = None
+	# Detalle de `sources`: metadatos y puntajes de los documentos del contexto
+	documents: List[SourceOut] = Field(default_factory=list)
+	# Milisegundos por etapa (session, cache, retrieve, extract, prompt, llm...) y `total`
+	timings: Dict[str, float] = Field(default_factory=dict)
+	# Acierto del caché semántico (sólo con engine = cache)
+	cache_match: Optional[CacheMatchOut] = None
+	dataset: Optional[str] = None
+	index_version: Optional[str] = None
+
+
+class BatchQueryIn(BaseModel):
+	questions: List[str] = Field(..., min_length=1)
+	# true: cada respuesta sale como una línea NDJSON apenas está lista
+	stream: bool = False
+	dataset: Optional[str] = None
+
+
+class BatchItemOut(BaseModel):
+	question: str
+	answer: Optional[str] = None
+	sources: List[str] = Field(default_factory=list)
+	prompt_tokens: Optional[int] = None
+	# greeting | canonical | analytics | cache | rag | fallback | error
+	route: str
+	error: Optional[str] = None
+	documents: List[SourceOut] = Field(default_factory=list)
+
+
+class BatchQueryOut(BaseModel):
+	results: List[BatchItemOut]
+	# Preguntas distintas (las repetidas se responden una vez)
+	unique: int
+	seconds: float
+
+
+# LLM (uno o varios backends) compartido por todos los datasets
+llm = None
+# Datasets declarados y los cargados; cada uno con su índice, analítica y caché
+registry: Optional[DatasetRegistry] = None
+# Límite de generaciones concurrentes contra el LLM (ver llm_scheduler.py)
+llm_scheduler = LLMScheduler.from_env()
 
+# Historial de conversación por `session_id` (ver sessions.py); las
+# repreguntas se reescriben con los filtros del dataset de la consulta
+session_store = SessionStore.from_env(FollowUpRewriter(), get_backend())
 
-qa = None
+# Estado del arranque para /ready: índice, embeddings y LLM precalentados
+readiness = {"index": False, "embeddings": False, "llm": False}
+startup_timings = {}
+llm_warmup_error = None
+_llm_warmup_thread = None
+
+# Evitar que proxies (p. ej. el de Vite o nginx) acumulen el stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
 
 
 def is_greeting(text: str) -> bool:
-	text_clean = re.sub(r"[¡!¿?\.,;:]", "", text or "").strip().lower()
+	text_clean = clean_question(text)
 	if not text_clean:
 		return False
 
@@ -60,51 +163,613 @@ def is_greeting(text: str) -> bool:
 	)
 
 
+def _elapsed(start: float) -> float:
+	return round(time.perf_counter() - start, 3)
+
+
+def build_llm():
+	# Uno o varios servidores (LLM_BACKENDS / LLM_PROVIDER), con balanceo y
+	# failover. benchmark.py lo reemplaza por su LLM simulado.
+	return LLMGateway.from_env()
+
+
+def load_dataset(config: DatasetConfig) -> Dataset:
+	# Los datasets que no son el principal se cargan con la primera consulta
+	# y, si todavía no tienen índice, se construye en ese momento
+	return Dataset.load(config, llm=llm, embeddings=get_embeddings(), build_missing=config.id != DEFAULT_DATASET)
+
+
 @app.on_event("startup")
 def startup_event():
-	global qa
-	qa = build_qa()
+	global llm, registry
+	start = time.perf_counter()
 
+	# Un solo modelo de embeddings para índices, caché y reindex. La inferencia
+	# de prueba evita que la primera pregunta pague la inicialización.
+	t = time.perf_counter()
+	embeddings = get_embeddings()
+	startup_timings["embeddings_warmup_seconds"] = warm_up(embeddings)
+	startup_timings["embeddings_seconds"] = _elapsed(t)
+	readiness["embeddings"] = True
 
-@app.post("/query", response_model=QueryOut)
-def query(q: QueryIn):
-	global qa
+	llm = build_llm()
+	# Con varios backends del LLM, la concurrencia escala con el pool salvo que se fije a mano
+	backends = getattr(llm, "backends", None) or []
+	if len(backends) > 1 and not os.getenv("LLM_MAX_CONCURRENCY"):
+		llm_scheduler.max_concurrency = int(os.getenv("LLM_CONCURRENCY_PER_BACKEND", "2")) * len(backends)
+
+	# El dataset principal se carga ya; los demás, cuando se consultan
+	registry = DatasetRegistry.from_env(load_dataset)
+	ds = registry.get(DEFAULT_DATASET)
+	startup_timings.update(ds.timings)
+	readiness["index"] = True
+
+	startup_timings["startup_seconds"] = _elapsed(start)
+	print(
+		f"[OK] Backend iniciado en {startup_timings['startup_seconds']}s "
+		f"(embeddings {startup_timings['embeddings_seconds']}s, índice {startup_timings['index_seconds']}s, "
+		f"analítica {startup_timings['analytics_seconds']}s, {len(registry.ids())} dataset(s))"
+	)
+	# El modelo del LLM se carga en segundo plano; /ready lo refleja
+	start_llm_warmup()
+
+
+def warm_llm() -> None:
+	global llm_warmup_error
+	t = time.perf_counter()
+	try:
+		# Ollama carga el modelo en memoria con la primera generación; con
+		# varios backends (LLMGateway) se precalienta cada uno
+		warm = getattr(llm, "warm_up", None) or llm.invoke
+		warm("Responde sólo: ok")
+	except Exception as e:
+		llm_warmup_error = str(e)[:200]
+		print(f"[WARN] El LLM no respondió al precalentar: {llm_warmup_error}")
+		return
+	llm_warmup_error = None
+	startup_timings["llm_warmup_seconds"] = _elapsed(t)
+	readiness["llm"] = True
+	print(f"[OK] LLM precalentado en {startup_timings['llm_warmup_seconds']}s")
+
+
+def start_llm_warmup() -> None:
+	global _llm_warmup_thread
+	if os.getenv("LLM_WARMUP", "true").lower() not in ("1", "true", "yes"):
+		readiness["llm"] = True
+		return
+	if _llm_warmup_thread is not None and _llm_warmup_thread.is_alive():
+		return
+	_llm_warmup_thread = threading.Thread(target=warm_llm, name="llm-warmup", daemon=True)
+	_llm_warmup_thread.start()
+
+
+def note_first_query(start: float) -> None:
+	# Latencia de la primera consulta que llega al LLM (costo del arranque en frío)
+	if "first_query_seconds" not in startup_timings:
+		startup_timings["first_query_seconds"] = _elapsed(start)
+
+
+GREETING_ANSWER = (
+	"¡Hola! Soy tu asistente de análisis de ventas. "
+	"Puedes preguntarme cosas como \"¿Cuántas ventas hubo en 2023?\" "
+	"o \"¿Cuál es el producto más vendido?\""
+)
 
+
+def direct_answer(ds: Dataset, question: str) -> Optional[Tuple[str, str]]:
+	"""Respuestas que no necesitan retrieval ni LLM: saludo, respuestas canónicas y analítica directa.
+
+	Devuelve `(ruta, respuesta)`; la ruta (`greeting` / `canonical` / `analytics`) etiqueta las métricas.
+	"""
 	# Respuesta especial para saludos sencillos (sin usar RAG ni datos del Excel)
-	if is_greeting(q.question):
-		return {
-			"answer": (
-				"¡Hola! Soy tu asistente de análisis de ventas. "
-				"Puedes preguntarme cosas como \"¿Cuántas ventas hubo en 2023?\" "
-				"o \"¿Cuál es el producto más vendido?\""
-			),
-			"sources": [],
-		}
-
-	if qa is None:
+	with span("greeting"):
+		greeting = is_greeting(question)
+	if greeting:
+		return "greeting", GREETING_ANSWER
+
+	# Preguntas canónicas: respuesta precalculada en el reindex
+	canonical = ds.canonical
+	if canonical is not None:
+		with span("canonical"):
+			answer = canonical.answer(question)
+		if answer is not None:
+			return "canonical", answer
+
+	# Preguntas de filtro + agregación: se calculan directamente sobre los datos
+	analytics = ds.analytics
+	if analytics is not None:
+		try:
+			with span("analytics"):
+				answer = analytics.answer(question)
+			if answer is not None:
+				return "analytics", answer
+		except Exception as e:
+			print(f"[WARN] Analítica directa falló (se usa RAG): {str(e)[:200]}")
+	return None
+
+
+def cached_answer(ds: Dataset, question: str) -> Optional[CacheHit]:
+	if ds.answer_cache is None:
+		return None
+	with span("cache"):
+		return ds.answer_cache.get(question)
+
+
+def cache_version(ds: Dataset):
+	return ds.answer_cache.version if ds.answer_cache is not None else None
+
+
+def remember_answer(ds: Dataset, question: str, res, version) -> None:
+	# Las respuestas en modo demo (LLM caído) no se cachean
+	if ds.answer_cache is not None and not res.fallback:
+		ds.answer_cache.put(question, res.answer, version)
+
+
+async def get_dataset(dataset_id: Optional[str]) -> Dataset:
+	"""Dataset de la consulta; si no está cargado se carga en un hilo (puede tardar)."""
+	if registry is None:
 		raise HTTPException(status_code=500, detail="QA pipeline no inicializado")
+	try:
+		ds = registry.get_loaded(dataset_id)
+		if ds is None:
+			ds = await asyncio.to_thread(registry.get, dataset_id)
+	except KeyError:
+		raise HTTPException(
+			status_code=404, detail=f"Dataset desconocido: {dataset_id}. Disponibles: {', '.join(registry.ids())}"
+		)
+	except Exception as e:
+		print(f"[ERROR] No se pudo cargar el dataset {dataset_id}: {str(e)}")
+		raise HTTPException(status_code=503, detail=f"No se pudo cargar el dataset {dataset_id}: {str(e)[:200]}")
+	return ds
+
+
+def peek_dataset(dataset_id: Optional[str]) -> Optional[Dataset]:
+	"""Dataset cargado (sin cargarlo) para los endpoints de estado; 404 si no existe."""
+	if registry is None:
+		return None
+	try:
+		return registry.get_loaded(dataset_id)
+	except KeyError:
+		raise HTTPException(status_code=404, detail=f"Dataset desconocido: {dataset_id}")
+
+
+def session_key(dataset_id: Optional[str], session_id: str) -> str:
+	# Un mismo id de sesión en otro dataset es otra conversación
+	if not dataset_id or dataset_id == DEFAULT_DATASET:
+		return session_id
+	return f"{dataset_id}:{session_id}"
+
+
+def resolve_question(ds: Dataset, q: QueryIn) -> Tuple[Optional[Session], str, str]:
+	"""Sesión, pregunta autónoma e historial compacto de la consulta."""
+	if not q.session_id:
+		return None, q.question, ""
+	with span("session"):
+		return session_store.prepare(
+			session_key(ds.id, q.session_id), q.question, ds.qa.token_counter.count, ds.question_filters
+		)
+
+
+def remember_turn(session: Optional[Session], question: str, answer: str) -> None:
+	if session is not None:
+		session_store.add_turn(session, question, answer)
+
+
+def session_fields(q: QueryIn, session: Optional[Session], question: str) -> dict:
+	if session is None:
+		return {}
+	return {"session_id": q.session_id, "standalone_question": question}
+
+
+def provenance(ds: Dataset, trace: metrics.RequestTrace, engine: str, res=None, hit: Optional[CacheHit] = None) -> dict:
+	"""Cómo se obtuvo la respuesta: motor, documentos con sus puntajes y tiempos por etapa."""
+	timings = trace.breakdown()
+	timings["total"] = round(trace.elapsed() * 1000.0, 1)
+	return {
+		"engine": engine,
+		"documents": [asdict(d) for d in res.documents] if res is not None else [],
+		"timings": timings,
+		"cache_match": {"kind": hit.kind, "similarity": round(hit.similarity, 4), "matched": hit.matched}
+		if hit is not None else None,
+		"dataset": ds.id,
+		"index_version": ds.qa.version,
+	}
+
+
+def sse_event(event: str, data: dict) -> str:
+	return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def saturated_error(e: SchedulerSaturated) -> HTTPException:
+	return HTTPException(
+		status_code=503,
+		detail="El asistente está atendiendo muchas consultas; intenta de nuevo en unos segundos.",
+		headers={"Retry-After": str(e.retry_after)},
+	)
+
+
+@app.post("/query", response_model=QueryOut)
+async def query(q: QueryIn):
+	with request_trace("/query", q.question) as trace:
+		return await answer_query(q, trace)
 
-	# Ejecutar retrieval + LLM
+
+async def answer_query(q: QueryIn, trace: metrics.RequestTrace) -> dict:
+	ds = await get_dataset(q.dataset)
+	# Repreguntas de una sesión: se responde la pregunta autónoma
+	session, question, history = resolve_question(ds, q)
+	extra = session_fields(q, session, question)
+
+	# Analítica y caché son CPU (pandas / embeddings): se corren en un hilo
+	direct = await asyncio.to_thread(direct_answer, ds, question)
+	if direct is not None:
+		trace.route, answer = direct
+		remember_turn(session, question, answer)
+		return {"answer": answer, "sources": [], **extra, **provenance(ds, trace, trace.route)}
+
+	hit = await asyncio.to_thread(cached_answer, ds, question)
+	if hit is not None:
+		trace.route = "cache"
+		remember_turn(session, question, hit.answer)
+		return {"answer": hit.answer, "sources": [], **extra, **provenance(ds, trace, "cache", hit=hit)}
+
+	# Ejecutar retrieval + LLM; preguntas idénticas en vuelo (con el mismo
+	# historial) comparten generación
+	start = time.perf_counter()
+	version = cache_version(ds)
+	rag = ds.qa
+	key = f"{ds.id}\n" + clean_question(question) + (f"\n{history}" if history else "")
+	try:
+		res = await llm_scheduler.submit(key, lambda: rag.agenerate(question, history))
+	except SchedulerSaturated as e:
+		trace.route = "saturated"
+		raise saturated_error(e)
+	except Exception as e:
+		print(f"[ERROR] Query failed: {str(e)}")
+		raise HTTPException(status_code=500, detail=f"Error al procesar consulta: {str(e)[:200]}")
+	trace.route = "fallback" if res.fallback else "rag"
+	note_first_query(start)
+	remember_turn(session, question, res.answer)
+	await asyncio.to_thread(remember_answer, ds, question, res, version)
+	return {"answer": res.answer, "sources": res.sources, "prompt_tokens": res.prompt_tokens, **extra,
+			**provenance(ds, trace, trace.route, res)}
+
+
+@app.post("/query/stream")
+async def query_stream(q: QueryIn):
+	"""Igual que /query pero emite Server-Sent Events a medida que el LLM genera.
+
+	Eventos: `sources` (primero, con el detalle de cada documento en
+	`documents`), `token` (uno por fragmento), `done` con la respuesta completa
+	y su procedencia (`engine`, `timings`, ...), o `error`.
+	"""
+	# La traza sigue abierta hasta que termina el stream (ver `open_stream`)
+	trace = metrics.RequestTrace("/query/stream", q.question)
+	try:
+		with trace.activate():
+			return await open_stream(q, trace)
+	except BaseException:
+		trace.finish()
+		raise
+
+
+async def open_stream(q: QueryIn, trace: metrics.RequestTrace) -> StreamingResponse:
+	ds = await get_dataset(q.dataset)
+	session, question, history = resolve_question(ds, q)
+	extra = session_fields(q, session, question)
+	route = "cache"
+	answer = None
+	hit = None
+	direct = await asyncio.to_thread(direct_answer, ds, question)
+	if direct is not None:
+		route, answer = direct
+	else:
+		hit = await asyncio.to_thread(cached_answer, ds, question)
+		answer = hit.answer if hit is not None else None
+
+	if answer is not None:
+		trace.finish(route)
+		remember_turn(session, question, answer)
+		done = {"answer": answer, **extra, **provenance(ds, trace, route, hit=hit)}
+
+		def instant_events():
+			yield sse_event("sources", {"sources": [], "documents": []})
+			yield sse_event("token", {"text": answer})
+			yield sse_event("done", done)
+		return StreamingResponse(instant_events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+	# El turno del LLM se reserva durante todo el stream
+	try:
+		lease = await llm_scheduler.acquire()
+	except SchedulerSaturated as e:
+		trace.route = "saturated"
+		raise saturated_error(e)
+
+	version = cache_version(ds)
 	try:
-		res = qa.run(q.question)
-		return {"answer": res, "sources": []}
+		# El retrieval se hace acá, antes de abrir el stream, para poder
+		# devolver un 500 normal si falla
+		stream = await ds.qa.astream(question, history)
 	except Exception as e:
+		lease.release(failed=True)
 		print(f"[ERROR] Query failed: {str(e)}")
 		raise HTTPException(status_code=500, detail=f"Error al procesar consulta: {str(e)[:200]}")
 
+	async def events():
+		try:
+			yield sse_event("sources", {"sources": stream.sources, "documents": [asdict(d) for d in stream.documents]})
+			async for text in stream:
+				yield sse_event("token", {"text": text})
+		except Exception as e:
+			lease.release(failed=True)
+			trace.finish("error")
+			print(f"[ERROR] Streaming failed: {str(e)}")
+			yield sse_event("error", {"detail": f"Error al procesar consulta: {str(e)[:200]}"})
+			return
+		finally:
+			lease.release()
+		trace.finish("fallback" if stream.result.fallback else "rag")
+		remember_turn(session, question, stream.result.answer)
+		await asyncio.to_thread(remember_answer, ds, question, stream.result, version)
+		yield sse_event("done", {"answer": stream.result.answer, "prompt_tokens": stream.result.prompt_tokens, **extra,
+								 **provenance(ds, trace, trace.route, stream.result)})
+
+	def close() -> None:
+		lease.release()
+		# Cliente desconectado a mitad del stream: la consulta cuenta como cancelada
+		trace.finish("cancelled")
+
+	# Si el cliente se desconecta antes de empezar, la tarea de fondo libera el turno
+	return StreamingResponse(
+		events(),
+		media_type="text/event-stream",
+		headers=SSE_HEADERS,
+		background=BackgroundTask(close),
+	)
+
+
+def batch_max_questions() -> int:
+	return int(os.getenv("BATCH_MAX_QUESTIONS", "100"))
+
+
+def batch_llm_concurrency() -> int:
+	# Por defecto, tantas generaciones como admite el scheduler: el lote no
+	# llena la cola ni deja a las consultas interactivas sin lugar
+	return int(os.getenv("BATCH_LLM_CONCURRENCY", "0")) or llm_scheduler.max_concurrency
+
+
+def warm_query_embeddings(ds: Dataset, questions: List[str]) -> None:
+	"""Una sola pasada del modelo para las claves del caché y del retrieval de todo el lote."""
+	embeddings = get_embeddings()
+	if not hasattr(embeddings, "embed_queries"):
+		return
+	texts = list(questions)
+	if ds.answer_cache is not None:
+		texts += [clean_question(q) for q in questions]
+	embeddings.embed_queries(list(dict.fromkeys(texts)))
+
+
+def batch_item(question: str, route: str, answer: Optional[str] = None, **fields) -> dict:
+	return {"question": question, "answer": answer, "route": route, "sources": [], "prompt_tokens": None,
+			"error": None, "documents": [], **fields}
+
+
+async def batch_answers(ds: Dataset, questions: List[str]) -> AsyncIterator[Tuple[int, dict]]:
+	"""Responde preguntas distintas; produce `(posición, resultado)` a medida que terminan."""
+	# 1. Saludos, respuestas canónicas y analítica directa, sin LLM
+	direct = await asyncio.to_thread(lambda: [direct_answer(ds, q) for q in questions])
+	pending = []
+	for i, hit in enumerate(direct):
+		if hit is not None:
+			yield i, batch_item(questions[i], hit[0], hit[1])
+		else:
+			pending.append(i)
+	if not pending:
+		return
+
+	# 2. Caché, con los embeddings de todo el lote calculados de una vez
+	await asyncio.to_thread(warm_query_embeddings, ds, [questions[i] for i in pending])
+	cached = await asyncio.to_thread(lambda: [cached_answer(ds, questions[i]) for i in pending])
+	for i, hit in zip(list(pending), cached):
+		if hit is not None:
+			pending.remove(i)
+			yield i, batch_item(questions[i], "cache", hit.answer)
+	if not pending:
+		return
+
+	# 3. Retrieval de las restantes en una pasada (embeddings batched + búsqueda)
+	rag = ds.qa
+	version = cache_version(ds)
+	try:
+		docs = await asyncio.to_thread(rag.retrieve_many, [questions[i] for i in pending])
+	except Exception as e:
+		print(f"[ERROR] Batch retrieval failed: {str(e)}")
+		for i in pending:
+			yield i, batch_item(questions[i], "error", error=f"Error al procesar consulta: {str(e)[:200]}")
+		return
+
+	# 4. LLM con paralelismo acotado; cada resultado sale apenas termina
+	semaphore = asyncio.Semaphore(batch_llm_concurrency())
+
+	async def generate(i: int, found: list) -> Tuple[int, dict]:
+		question = questions[i]
+		async with semaphore:
+			try:
+				res = await llm_scheduler.submit(
+					f"{ds.id}\n" + clean_question(question), lambda: rag.agenerate(question, docs=found)
+				)
+			except SchedulerSaturated:
+				return i, batch_item(question, "error", error="El asistente está atendiendo muchas consultas.")
+			except Exception as e:
+				print(f"[ERROR] Query failed: {str(e)}")
+				return i, batch_item(question, "error", error=f"Error al procesar consulta: {str(e)[:200]}")
+		await asyncio.to_thread(remember_answer, ds, question, res, version)
+		return i, batch_item(
+			question, "fallback" if res.fallback else "rag", res.answer,
+			sources=res.sources, prompt_tokens=res.prompt_tokens, documents=[asdict(d) for d in res.documents],
+		)
+
+	tasks = [asyncio.ensure_future(generate(i, found)) for i, found in zip(pending, docs)]
+	try:
+		for next_done in asyncio.as_completed(tasks):
+			yield await next_done
+	finally:
+		for task in tasks:
+			task.cancel()
+
+
+def dedupe_questions(questions: List[str]) -> Tuple[List[str], Dict[int, List[int]]]:
+	"""Preguntas distintas (por `clean_question`) y, para cada una, sus posiciones en el lote."""
+	unique: List[str] = []
+	positions: Dict[int, List[int]] = {}
+	seen: Dict[str, int] = {}
+	for i, question in enumerate(questions):
+		key = clean_question(question)
+		if key not in seen:
+			seen[key] = len(unique)
+			unique.append(question)
+		positions.setdefault(seen[key], []).append(i)
+	return unique, positions
+
+
+@app.post("/query/batch", response_model=BatchQueryOut)
+async def query_batch(body: BatchQueryIn):
+	"""Varias preguntas en una consulta (reportes).
+
+	Las repetidas se responden una vez; las de analítica salen directo de los
+	datos; el resto se recupera en una sola pasada y va al LLM con a lo sumo
+	`BATCH_LLM_CONCURRENCY` generaciones a la vez. Con `stream: true` responde
+	NDJSON: una línea `{"index": ..., ...}` por pregunta a medida que terminan
+	y una última `{"done": true, ...}`.
+	"""
+	if len(body.questions) > batch_max_questions():
+		raise HTTPException(status_code=413, detail=f"Máximo {batch_max_questions()} preguntas por lote")
+
+	ds = await get_dataset(body.dataset)
+	unique, positions = dedupe_questions(body.questions)
+	trace = metrics.RequestTrace("/query/batch", f"{len(body.questions)} preguntas")
+	start = time.perf_counter()
+
+	if not body.stream:
+		results: List[Optional[dict]] = [None] * len(body.questions)
+		try:
+			with trace.activate():
+				async for i, item in batch_answers(ds, unique):
+					for position in positions[i]:
+						results[position] = dict(item, question=body.questions[position])
+		finally:
+			trace.finish("batch")
+		return {"results": results, "unique": len(unique), "seconds": _elapsed(start)}
+
+	async def lines():
+		try:
+			with trace.activate():
+				async for i, item in batch_answers(ds, unique):
+					for position in positions[i]:
+						line = {"index": position, **item, "question": body.questions[position]}
+						yield json.dumps(line, ensure_ascii=False) + "\n"
+			yield json.dumps({"done": True, "count": len(body.questions), "unique": len(unique),
+							  "seconds": _elapsed(start)}) + "\n"
+		finally:
+			trace.finish("batch")
+
+	return StreamingResponse(lines(), media_type="application/x-ndjson", headers=SSE_HEADERS)
+
+
+@app.post("/reindex", status_code=202)
+async def reindex(force: bool = False, dataset: Optional[str] = None):
+	"""Reconstruye el índice desde el Excel en segundo plano y lo activa al terminar.
+
+	Sólo re-embebe los documentos que cambiaron; `?force=true` rehace todo.
+	`?dataset=` elige el dataset (por defecto, el principal).
+	"""
+	ds = await get_dataset(dataset)
+	if not ds.start_reindex(force=force):
+		raise HTTPException(status_code=409, detail="Ya hay un reindex en curso (en este u otro worker)")
+	return {**ds.reindex_manager.status(), "dataset": ds.id}
+
+
+@app.get("/embeddings/stats")
+def embeddings_stats():
+	return embedding_info()
+
+
+@app.get("/ready")
+def ready():
+	"""200 sólo cuando índice, embeddings y LLM están cargados y precalentados; si no, 503."""
+	if registry is not None and not readiness["llm"]:
+		# Reintentar: Ollama puede haber arrancado después que el backend
+		start_llm_warmup()
+	is_ready = all(readiness.values())
+	body = {
+		"ready": is_ready,
+		"checks": dict(readiness),
+		"llm_error": llm_warmup_error,
+		"timings": dict(startup_timings),
+		"embeddings": embedding_info(),
+	}
+	return JSONResponse(body, status_code=200 if is_ready else 503)
+
+
+@app.get("/reindex/status")
+def reindex_status(dataset: Optional[str] = None):
+	# Con varios workers cada uno responde por sí mismo (`worker` = pid). Un
+	# dataset sin cargar no se carga para esto.
+	ds = peek_dataset(dataset)
+	if ds is None:
+		return {"state": "idle", "active_version": None, "worker": os.getpid(), "loaded": False}
+	return {**ds.reindex_manager.status(), "worker": os.getpid(), "dataset": ds.id}
+
+
+@app.get("/cache/stats")
+def cache_stats(dataset: Optional[str] = None):
+	ds = peek_dataset(dataset)
+	if ds is None or ds.answer_cache is None:
+		return {"enabled": False}
+	return {"enabled": True, **ds.answer_cache.stats()}
+
+
+@app.get("/canonical/stats")
+def canonical_stats(dataset: Optional[str] = None):
+	ds = peek_dataset(dataset)
+	if ds is None or ds.canonical is None:
+		return {"enabled": False}
+	return {"enabled": True, **ds.canonical.stats()}
+
+
+@app.get("/datasets")
+def datasets_stats():
+	"""Datasets disponibles, los cargados (memoria estimada, versión) y cargas / descargas del LRU."""
+	if registry is None:
+		return {"datasets": [], "loaded": []}
+	return registry.stats()
+
+
+@app.get("/scheduler/stats")
+def scheduler_stats():
+	return llm_scheduler.stats()
+
+
+@app.get("/llm/stats")
+def llm_stats():
+	"""Estado, llamadas en curso, errores y latencias de cada backend del LLM."""
+	if llm is None or not hasattr(llm, "stats"):
+		return {"backends": []}
+	return llm.stats()
+
+
+@app.get("/sessions/stats")
+def sessions_stats():
+	return session_store.stats()
+
 
+@app.delete("/sessions/{session_id}")
+def drop_session(session_id: str, dataset: Optional[str] = None):
+	"""Olvida el historial de una conversación (p. ej. al empezar una nueva)."""
+	return {"session_id": session_id, "dropped": session_store.drop(session_key(dataset, session_id))}
 
-@app.post("/reindex")
-def reindex():
-	# Endpoint sencillo para reconstruir el índice desde el Excel
-	from data_loader import build_documents_from_excel
-	from embeddings_builder import compute_embeddings, build_faiss_index
 
-	# Usar la ruta configurada en DATASET_PATH o, por defecto,
-	# el archivo de Excel en la raíz del proyecto.
-	default_path = os.path.join(os.path.dirname(__file__), "..", "TrabajoFinalPowerBI_v2 (1).xlsx")
-	path = os.getenv("DATASET_PATH", default_path)
-	docs = build_documents_from_excel(path)
-	embs = compute_embeddings(docs)
-	build_faiss_index(embs, docs, os.getenv("VECTORSTORE_DIR", "./vectorstore"))
-	return {"status": "ok", "docs_indexed": len(docs)}
\ No newline at end of file
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+	"""Latencia por etapa, tokens, errores del LLM y consultas en curso (formato Prometheus)."""
+	return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
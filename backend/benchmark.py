@@ -0,0 +1,502 @@
+"""
+Benchmarks y prueba de carga del backend, sin Ollama ni red.
+
+Ejecutar:
+    python benchmark.py                       # micro-benchmarks + carga
+    python benchmark.py --fake-embeddings     # sin descargar el modelo de embeddings
+    python benchmark.py --compare bench-abc1234.json
+    python benchmark.py --stub-ollama 3       # LLMGateway contra 3 Ollama simulados
+
+- El LLM es `FakeLLM`: determinista, con latencia hasta el primer token y
+  tokens por segundo configurables (simula un Ollama en CPU).
+- Índice, cubo y caché del Excel se generan en un directorio temporal, así
+  cada corrida parte de cero y no toca los del proyecto.
+- Micro-benchmarks: lectura del Excel, cubo, documentos, embeddings, búsqueda
+  FAISS / híbrida, armado del prompt y analítica directa.
+- Carga: levanta la app con uvicorn y le manda consultas a concurrencia
+  creciente; reporta throughput y latencias p50/p95/p99 (y tiempo al primer
+  token con `--endpoint stream`).
+- `--stub-ollama N`: en lugar de inyectar `FakeLLM`, levanta N servidores
+  HTTP que imitan la API de Ollama (`/api/chat`, `/api/tags`) y la app les
+  habla por `LLMGateway`, como a varias máquinas con Ollama. `--stub-down M`
+  agrega M backends caídos para ejercitar el failover y el circuit breaker.
+
+El resultado se guarda en JSON (con el commit actual) para comparar corridas.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+# Preguntas que van al RAG (LLM) y preguntas que resuelve la analítica directa
+RAG_QUESTIONS = [
+    "¿Qué información tienes?",
+    "Resume cómo le fue a la categoría de bebidas",
+    "¿Qué clientes de Asunción compran más?",
+    "Compara las ventas de marzo de 2023 con las de marzo de 2024",
+    "¿Qué productos conviene promocionar?",
+    "¿Cómo evolucionaron las ventas en 2024?",
+]
+ANALYTICS_QUESTIONS = [
+    "¿Cuántas ventas hubo en 2023?",
+    "¿Cuál es el producto más vendido?",
+    "¿Cuál fue el ticket promedio en 2024?",
+    "¿Qué ciudad tiene más ventas?",
+]
+
+_WORDS = ("las", "ventas", "del", "período", "muestran", "que", "el", "producto", "con", "más",
+          "ingresos", "fue", "seguido", "por", "y", "la", "categoría", "creció", "en", "2024")
+
+
+class FakeLLM(BaseChatModel):
+    """LLM simulado y determinista: misma pregunta, misma respuesta.
+
+    `latency` es el tiempo hasta el primer token (lectura del prompt) y
+    `tokens_per_second` la velocidad de generación de `answer_tokens` tokens.
+    """
+
+    latency: float = 0.3
+    tokens_per_second: float = 40.0
+    answer_tokens: int = 60
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    def _tokens(self, messages: List[BaseMessage]) -> List[str]:
+        prompt = "".join(str(m.content) for m in messages)
+        seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16)
+        return [_WORDS[(seed + i * 7) % len(_WORDS)] + " " for i in range(self.answer_tokens)]
+
+    def _token_delay(self) -> float:
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        tokens = self._tokens(messages)
+        time.sleep(self.latency + self._token_delay() * len(tokens))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens).strip()))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        tokens = self._tokens(messages)
+        await asyncio.sleep(self.latency + self._token_delay() * len(tokens))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens).strip()))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        for token in self._tokens(messages):
+            time.sleep(self._token_delay())
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency)
+        for token in self._tokens(messages):
+            await asyncio.sleep(self._token_delay())
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+# ----------------------------------------------------------------------
+# Estadísticas
+# ----------------------------------------------------------------------
+def summarize(samples_ms: List[float]) -> Dict[str, float]:
+    if not samples_ms:
+        return {"n": 0}
+    arr = np.asarray(samples_ms)
+    return {
+        "n": len(arr),
+        "mean_ms": round(float(arr.mean()), 3),
+        "p50_ms": round(float(np.percentile(arr, 50)), 3),
+        "p95_ms": round(float(np.percentile(arr, 95)), 3),
+        "p99_ms": round(float(np.percentile(arr, 99)), 3),
+        "min_ms": round(float(arr.min()), 3),
+        "max_ms": round(float(arr.max()), 3),
+    }
+
+
+def measure(fn: Callable[[int], Any], repeat: int, warmup: int = 1) -> Dict[str, float]:
+    """Corre `fn(i)` `repeat` veces (después de `warmup`) y resume los tiempos."""
+    for i in range(warmup):
+        fn(i)
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(warmup + i)
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return summarize(samples)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+# ----------------------------------------------------------------------
+# Micro-benchmarks
+# ----------------------------------------------------------------------
+def run_micro(dataset_path: str, repeat: int) -> Dict[str, dict]:
+    import data_loader
+    from analytics import SalesAnalytics
+    from embedding_service import get_embeddings
+    from embeddings_builder import build_vectorstore
+    from rag_pipeline import load_vectorstore, make_retriever, SimpleRAG
+
+    results: Dict[str, dict] = {}
+    slow = max(1, repeat // 10)
+
+    def record(name: str, stats: dict) -> None:
+        results[name] = stats
+        print(f"[INFO] {name:<28} p50 {stats.get('p50_ms', 0):>10.3f} ms   p95 {stats.get('p95_ms', 0):>10.3f} ms")
+
+    record("read_excel", measure(lambda i: data_loader.read_excel(dataset_path), slow))
+    dfs = data_loader.read_dataset(dataset_path)
+    record("read_dataset_cached", measure(lambda i: data_loader.read_dataset(dataset_path), repeat))
+    record("build_cube", measure(lambda i: data_loader.build_cube(dfs), slow))
+    cube = data_loader.build_cube(dfs)
+    record("create_summary_documents", measure(lambda i: data_loader.create_summary_documents(dfs, cube), slow))
+    record("create_focused_documents", measure(lambda i: data_loader.create_focused_documents(cube), slow))
+
+    embeddings = get_embeddings()
+    model = getattr(embeddings, "base", embeddings)
+    # Textos distintos en cada vuelta: mide el modelo, no el LRU
+    record("embed_query", measure(lambda i: model.embed_query(f"¿Cuántas ventas hubo en el mes {i}?"), repeat))
+    batch = [f"Documento de prueba número {j} con ventas e ingresos" for j in range(32)]
+    record("embed_documents_32", measure(lambda i: model.embed_documents(batch), slow))
+
+    start = time.perf_counter()
+    build = build_vectorstore(dataset_path, os.environ["VECTORSTORE_DIR"], embeddings=embeddings, force=True)
+    results["build_index"] = {"seconds": round(time.perf_counter() - start, 3), "docs": build.docs_total,
+                              "pipeline": build.pipeline}
+    print(f"[INFO] {'build_index':<28} {results['build_index']['seconds']}s ({build.docs_total} documentos)")
+
+    vectorstore = load_vectorstore(os.environ["VECTORSTORE_DIR"], embeddings)
+    retriever = make_retriever(vectorstore, k=4)
+    vectors = np.asarray(model.embed_documents(RAG_QUESTIONS), dtype=np.float32)
+    record("faiss_search", measure(lambda i: vectorstore.index.search(vectors[i % len(vectors)][None, :], 4), repeat))
+    record("hybrid_search", measure(lambda i: retriever.get_relevant_documents(RAG_QUESTIONS[i % len(RAG_QUESTIONS)]), repeat))
+
+    qa = SimpleRAG(llm=FakeLLM(latency=0, tokens_per_second=0), retriever=retriever, vectorstore=vectorstore, k=4)
+    docs = {q: retriever.get_relevant_documents(q) for q in RAG_QUESTIONS}
+    record("prompt_assembly", measure(lambda i: qa._assemble(RAG_QUESTIONS[i % len(RAG_QUESTIONS)],
+                                                              docs[RAG_QUESTIONS[i % len(RAG_QUESTIONS)]]), repeat))
+
+    analytics = SalesAnalytics.from_excel(dataset_path)
+    if analytics is not None:
+        record("analytics_answer", measure(lambda i: analytics.answer(ANALYTICS_QUESTIONS[i % len(ANALYTICS_QUESTIONS)]), repeat))
+    return results
+
+
+# ----------------------------------------------------------------------
+# Servidores Ollama simulados
+# ----------------------------------------------------------------------
+def stub_ollama_app(llm: FakeLLM):
+    """App FastAPI con la API de chat de Ollama, respondida por `llm`."""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import StreamingResponse
+    from langchain_core.messages import HumanMessage
+
+    stub = FastAPI()
+
+    def line(model: str, content: str, done: bool, **extra) -> dict:
+        return {"model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "message": {"role": "assistant", "content": content}, "done": done, **extra}
+
+    @stub.get("/api/tags")
+    def tags():
+        return {"models": [{"name": "stub", "model": "stub"}]}
+
+    @stub.post("/api/chat")
+    async def chat(request: Request):
+        body = await request.json()
+        model = body.get("model", "stub")
+        prompt = "".join(str(m.get("content", "")) for m in body.get("messages", []))
+        tokens = llm._tokens([HumanMessage(content=prompt)])
+        done = {"done_reason": "stop", "prompt_eval_count": len(prompt) // 4, "eval_count": len(tokens)}
+        if not body.get("stream", True):
+            await asyncio.sleep(llm.latency + llm._token_delay() * len(tokens))
+            return line(model, "".join(tokens).strip(), True, **done)
+
+        async def ndjson():
+            await asyncio.sleep(llm.latency)
+            for token in tokens:
+                await asyncio.sleep(llm._token_delay())
+                yield json.dumps(line(model, token, False)) + "\n"
+            yield json.dumps(line(model, "", True, **done)) + "\n"
+
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    return stub
+
+
+def free_port() -> int:
+    import socket
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve(asgi_app, port: int, name: str):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(asgi_app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name=name, daemon=True)
+    thread.start()
+    deadline = time.time() + 300
+    while not server.started:
+        if not thread.is_alive() or time.time() > deadline:
+            raise RuntimeError(f"El servidor {name} no arrancó")
+        time.sleep(0.05)
+    return server, thread
+
+
+def start_stub_backends(llm: FakeLLM, count: int, down: int = 0) -> list:
+    """Levanta `count` Ollama simulados y apunta `LLM_BACKENDS` a ellos (más `down` caídos)."""
+    servers = []
+    urls = []
+    for i in range(count):
+        port = free_port()
+        servers.append(serve(stub_ollama_app(llm), port, f"stub-ollama-{i}"))
+        urls.append(f"ollama:http://127.0.0.1:{port}")
+    # Puertos sin nadie escuchando: conexión rechazada al instante
+    urls += [f"ollama:http://127.0.0.1:{free_port()}" for _ in range(down)]
+    os.environ["LLM_BACKENDS"] = ",".join(urls)
+    return servers
+
+
+# ----------------------------------------------------------------------
+# Prueba de carga
+# ----------------------------------------------------------------------
+def start_server(llm: Optional[FakeLLM], port: int):
+    import app as app_module
+
+    # Sin `llm`, la app arma su LLMGateway desde LLM_BACKENDS (los stubs)
+    if llm is not None:
+        app_module.build_llm = lambda: llm
+    return serve(app_module.app, port, "bench-server")
+
+
+def _questions(mix: str) -> List[str]:
+    if mix == "rag":
+        return RAG_QUESTIONS
+    if mix == "analytics":
+        return ANALYTICS_QUESTIONS
+    return RAG_QUESTIONS + ANALYTICS_QUESTIONS
+
+
+async def _load_level(base_url: str, concurrency: int, total: int, endpoint: str, questions: List[str], unique: bool) -> dict:
+    import httpx
+
+    latencies: List[float] = []
+    ttfts: List[float] = []
+    status: Dict[str, int] = {}
+    counter = iter(range(total))
+
+    async def one(client, i: int) -> None:
+        question = questions[i % len(questions)]
+        if unique:
+            question = f"{question} (consulta {i})"
+        start = time.perf_counter()
+        first_token = None
+        engine = None
+        try:
+            if endpoint == "stream":
+                async with client.stream("POST", "/query/stream", json={"question": question}) as resp:
+                    code = resp.status_code
+                    event = None
+                    async for line in resp.aiter_lines():
+                        if line.startswith("event:"):
+                            event = line[6:].strip()
+                            if first_token is None and event == "token":
+                                first_token = (time.perf_counter() - start) * 1000.0
+                        elif line.startswith("data:") and event == "done":
+                            engine = json.loads(line[5:]).get("engine")
+            else:
+                resp = await client.post("/query", json={"question": question})
+                code = resp.status_code
+                if code == 200:
+                    engine = resp.json().get("engine")
+        except httpx.HTTPError as e:
+            code = type(e).__name__
+        # Una respuesta en modo demo (el LLM falló) no cuenta como exitosa
+        if code == 200 and engine == "fallback":
+            code = "fallback"
+        status[str(code)] = status.get(str(code), 0) + 1
+        if code == 200:
+            latencies.append((time.perf_counter() - start) * 1000.0)
+            if first_token is not None:
+                ttfts.append(first_token)
+
+    async def worker(client) -> None:
+        for i in counter:
+            await one(client, i)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        wall = time.perf_counter() - start
+
+    level = {
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": len(latencies),
+        "status": status,
+        "seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "latency": summarize(latencies),
+    }
+    if endpoint == "stream":
+        level["ttft"] = summarize(ttfts)
+    return level
+
+
+def run_load(args, llm: FakeLLM) -> List[dict]:
+    stubs = start_stub_backends(llm, args.stub_ollama, args.stub_down) if args.stub_ollama else []
+    port = free_port()
+    server, thread = start_server(None if stubs else llm, port)
+    base_url = f"http://127.0.0.1:{port}"
+    results = []
+    try:
+        for concurrency in [int(c) for c in args.concurrency.split(",") if c.strip()]:
+            total = max(concurrency, args.requests_per_level)
+            level = asyncio.run(_load_level(base_url, concurrency, total, args.endpoint, _questions(args.mix), args.unique))
+            lat = level["latency"]
+            print(f"[INFO] concurrencia {concurrency:>3}: {level['throughput_rps']:>7} req/s  "
+                  f"p50 {lat.get('p50_ms', 0):>9.1f} ms  p95 {lat.get('p95_ms', 0):>9.1f} ms  "
+                  f"p99 {lat.get('p99_ms', 0):>9.1f} ms  estados {level['status']}")
+            if stubs:
+                import httpx
+
+                level["llm_backends"] = httpx.get(f"{base_url}/llm/stats", timeout=30).json()
+                print("[INFO]   backends: " + "  ".join(
+                    f"{b['name']} {b['state']} {b['requests']} llamadas p50 {b['p50_ms']} ms"
+                    for b in level["llm_backends"]["backends"]))
+            results.append(level)
+    finally:
+        for stub_server, stub_thread in [(server, thread)] + stubs:
+            stub_server.should_exit = True
+            stub_thread.join(timeout=30)
+    return results
+
+
+# ----------------------------------------------------------------------
+# Comparación entre corridas
+# ----------------------------------------------------------------------
+def compare(current: dict, baseline_path: str) -> None:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\n=== Comparación con {baseline_path} (commit {baseline.get('meta', {}).get('commit')}) ===")
+    for name, stats in current.get("micro", {}).items():
+        old = baseline.get("micro", {}).get(name, {})
+        if "p50_ms" in stats and old.get("p50_ms"):
+            delta = (stats["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100
+            print(f"{name:<28} p50 {old['p50_ms']:>10.3f} -> {stats['p50_ms']:>10.3f} ms ({delta:+.1f}%)")
+    old_levels = {lvl["concurrency"]: lvl for lvl in baseline.get("load", [])}
+    for level in current.get("load", []):
+        old = old_levels.get(level["concurrency"])
+        if old and old["latency"].get("p95_ms"):
+            print(f"concurrencia {level['concurrency']:>3}  req/s {old['throughput_rps']} -> {level['throughput_rps']}  "
+                  f"p95 {old['latency']['p95_ms']} -> {level['latency'].get('p95_ms')} ms")
+
+
+def main(argv: Optional[List[str]] = None) -> dict:
+    parser = argparse.ArgumentParser(description="Benchmarks del backend RAG con un LLM simulado")
+    default_dataset = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "TrabajoFinalPowerBI_v2 (1).xlsx")
+    parser.add_argument("--dataset", default=os.getenv("DATASET_PATH", default_dataset))
+    parser.add_argument("--out", help="archivo JSON de resultados (por defecto bench-<commit>.json)")
+    parser.add_argument("--compare", help="JSON de una corrida anterior para comparar")
+    parser.add_argument("--repeat", type=int, default=50, help="repeticiones por micro-benchmark")
+    parser.add_argument("--concurrency", default="1,4,16,32", help="niveles de concurrencia de la prueba de carga")
+    parser.add_argument("--requests-per-level", type=int, default=64)
+    parser.add_argument("--endpoint", choices=["query", "stream"], default="query")
+    parser.add_argument("--mix", choices=["rag", "analytics", "mixed"], default="mixed")
+    parser.add_argument("--unique", action="store_true", help="preguntas distintas (sin caché ni coalescing)")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="segundos hasta el primer token")
+    parser.add_argument("--llm-tps", type=float, default=40.0, help="tokens por segundo")
+    parser.add_argument("--llm-tokens", type=int, default=60, help="tokens por respuesta")
+    parser.add_argument("--fake-embeddings", action="store_true", help="embeddings deterministas (sin modelo)")
+    parser.add_argument("--stub-ollama", type=int, default=0, help="servidores Ollama simulados detrás de LLMGateway")
+    parser.add_argument("--stub-down", type=int, default=0, help="backends caídos agregados a los simulados")
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--skip-load", action="store_true")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.dataset):
+        raise SystemExit(f"[ERROR] Dataset no encontrado: {args.dataset}")
+    dataset_path = os.path.abspath(args.dataset)
+
+    # Directorios propios: cada corrida parte de cero (antes de importar la app)
+    workdir = tempfile.mkdtemp(prefix="rag-bench-")
+    os.environ.update(
+        DATASET_PATH=dataset_path,
+        VECTORSTORE_DIR=os.path.join(workdir, "vectorstore"),
+        CUBE_DIR=os.path.join(workdir, "cube"),
+        DATASET_CACHE_DIR=os.path.join(workdir, "dataset_cache"),
+        LLM_WARMUP="false",
+    )
+    os.environ.setdefault("ANSWER_CACHE_ENABLED", "false")
+
+    if args.fake_embeddings:
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        from embedding_service import use_embeddings
+
+        use_embeddings(DeterministicFakeEmbedding(size=384))
+
+    llm = FakeLLM(latency=args.llm_latency, tokens_per_second=args.llm_tps, answer_tokens=args.llm_tokens)
+    results: Dict[str, Any] = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "fake_embeddings": args.fake_embeddings,
+            "llm": {"latency": args.llm_latency, "tokens_per_second": args.llm_tps, "tokens": args.llm_tokens},
+            "load": {"endpoint": args.endpoint, "mix": args.mix, "unique": args.unique,
+                     "requests_per_level": args.requests_per_level,
+                     "stub_ollama": args.stub_ollama, "stub_down": args.stub_down},
+        },
+    }
+    try:
+        if not args.skip_micro:
+            print("\n=== Micro-benchmarks ===")
+            results["micro"] = run_micro(dataset_path, args.repeat)
+        if not args.skip_load:
+            if args.skip_micro:
+                from embeddings_builder import build_vectorstore
+                build_vectorstore(dataset_path, os.environ["VECTORSTORE_DIR"], force=True)
+            print("\n=== Prueba de carga ===")
+            results["load"] = run_load(args, llm)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    out = args.out or f"bench-{results['meta']['commit'] or 'local'}.json"
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=1)
+    print(f"\n[OK] Resultados guardados en {out}")
+    if args.compare:
+        compare(results, args.compare)
+    return results
+
+
+if __name__ == "__main__":
+    main()
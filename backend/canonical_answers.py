@@ -0,0 +1,490 @@
+"""Respuestas precalculadas para las preguntas canónicas.
+
+La mayoría de las consultas son unas pocas preguntas con distinto año, mes o
+producto ("¿Cuántas ventas hubo en marzo de 2023?", "¿Cuál es el producto más
+vendido?"). Cada reindex las responde todas de antemano:
+
+- El catálogo de plantillas (`DEFAULT_TEMPLATES` o el JSON de
+  `CANONICAL_TEMPLATES_FILE`) tiene, por plantilla, una pregunta canónica y
+  variantes con la misma intención, con huecos `{año}`, `{mes}` y `{producto}`.
+- Cada plantilla se expande con todos los valores del dataset y se responde con
+  `SalesAnalytics`. Las variantes que la analítica interpreta distinto a la
+  canónica se descartan, así ninguna respuesta cambia de significado.
+- El resultado se guarda junto al índice (`canonical_answers.json` en el
+  directorio de la versión), con la versión del dataset y una huella del
+  catálogo; si no coinciden se vuelve a calcular.
+
+Para responder, la pregunta se normaliza, los valores de año, mes y producto se
+reemplazan por su hueco y el esqueleto resultante se busca:
+
+1. Exacto entre las variantes del catálogo.
+2. Difuso: mismas palabras clave (más/menos, ingresos/ventas/unidades,
+   producto/cliente...) y Jaccard de palabras >= `CANONICAL_MIN_SIMILARITY`.
+3. Por embeddings (`CANONICAL_EMBEDDING_THRESHOLD`, 0 = desactivado), sólo
+   contra variantes con los mismos huecos y palabras clave que además
+   contienen todas las palabras (sin relleno) de la pregunta: una palabra
+   que el catálogo no conoce ("devoluciones", "ayer") puede cambiar la
+   pregunta y la similitud del embedding no lo nota.
+
+El esqueleto resuelto se memoriza, así las repeticiones son un par de
+búsquedas en diccionarios. Una pregunta con otros filtros (cliente, ciudad,
+categoría, "top 3") nunca es canónica y sigue por la analítica o el RAG.
+"""
+
+import hashlib
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from text_utils import MESES, NOMBRES_MES, normalize
+
+
+# Archivo dentro del directorio de cada versión del índice
+CANONICAL_FILE = "canonical_answers.json"
+
+# Hueco (normalizado) -> columna del dataset
+SLOTS = {"ano": "Año", "mes": "Mes", "producto": "NombreProducto"}
+# Columnas cuyos valores se reconocen en la pregunta; las que no son hueco
+# (cliente, ciudad, categoría) hacen que la pregunta no sea canónica
+ENTITY_COLUMNS = ["NombreProducto", "Categoria", "Ciudad", "NombreCliente"]
+
+DEFAULT_TEMPLATES = [
+    {"id": "ventas", "questions": [
+        "¿Cuántas ventas hubo?", "¿Cuántas ventas hubo en total?", "¿Cuántas ventas se hicieron?",
+        "Cantidad de ventas", "Número de ventas",
+    ]},
+    {"id": "ventas_ano", "questions": [
+        "¿Cuántas ventas hubo en {año}?", "¿Cuántas ventas se hicieron en {año}?",
+        "Cantidad de ventas en {año}", "Número de ventas en {año}", "¿Cuántas ventas tuvimos en {año}?",
+    ]},
+    {"id": "ventas_mes", "questions": [
+        "¿Cuántas ventas hubo en {mes} de {año}?", "¿Cuántas ventas se hicieron en {mes} de {año}?",
+        "Cantidad de ventas en {mes} de {año}", "Número de ventas en {mes} de {año}",
+        "¿Cuántas ventas hubo en {mes} del {año}?",
+    ]},
+    {"id": "ventas_producto", "questions": [
+        "¿Cuántas ventas hubo de {producto}?", "¿Cuántas ventas tuvo {producto}?",
+        "Cantidad de ventas de {producto}",
+    ]},
+    {"id": "ventas_producto_ano", "questions": [
+        "¿Cuántas ventas hubo de {producto} en {año}?", "¿Cuántas ventas tuvo {producto} en {año}?",
+        "Cantidad de ventas de {producto} en {año}",
+    ]},
+    {"id": "ingresos", "questions": [
+        "¿Cuál fue el total de ingresos?", "¿Cuáles fueron los ingresos totales?", "Ingresos totales",
+    ]},
+    {"id": "ingresos_ano", "questions": [
+        "¿Cuál fue el total de ingresos en {año}?", "¿Cuáles fueron los ingresos en {año}?",
+        "Ingresos totales en {año}", "¿Cuánto se facturó en {año}?",
+    ]},
+    {"id": "ingresos_mes", "questions": [
+        "¿Cuál fue el total de ingresos en {mes} de {año}?", "¿Cuáles fueron los ingresos en {mes} de {año}?",
+        "¿Cuánto se facturó en {mes} de {año}?",
+    ]},
+    {"id": "producto_top", "questions": [
+        "¿Cuál es el producto más vendido?", "¿Cuál fue el producto más vendido?", "Producto más vendido",
+    ]},
+    {"id": "producto_top_ano", "questions": [
+        "¿Cuál es el producto más vendido en {año}?", "¿Cuál fue el producto más vendido en {año}?",
+        "Producto más vendido en {año}",
+    ]},
+    {"id": "producto_top_mes", "questions": [
+        "¿Cuál es el producto más vendido en {mes} de {año}?", "¿Cuál fue el producto más vendido en {mes} de {año}?",
+    ]},
+    {"id": "categoria_top", "questions": [
+        "¿Qué categoría generó más ingresos?", "¿Cuál es la categoría que generó más ingresos?",
+        "¿Qué categoría tiene más ingresos?",
+    ]},
+    {"id": "categoria_top_ano", "questions": [
+        "¿Qué categoría generó más ingresos en {año}?", "¿Cuál es la categoría que generó más ingresos en {año}?",
+    ]},
+    {"id": "cliente_top", "questions": [
+        "¿Cuál es el cliente con más compras?", "¿Qué cliente tiene más compras?", "Cliente con más compras",
+    ]},
+    {"id": "cliente_top_ano", "questions": [
+        "¿Cuál es el cliente con más compras en {año}?", "¿Qué cliente tiene más compras en {año}?",
+    ]},
+    {"id": "ciudad_top", "questions": [
+        "¿Qué ciudad tiene más ventas?", "¿Cuál es la ciudad con más ventas?", "Ciudad con más ventas",
+    ]},
+    {"id": "ciudad_top_ano", "questions": [
+        "¿Qué ciudad tiene más ventas en {año}?", "¿Cuál es la ciudad con más ventas en {año}?",
+    ]},
+]
+
+_RE_SLOT = re.compile(r"\{(\w+)\}")
+_RE_ANO = re.compile(r"^20\d{2}$")
+
+# Palabras que no cambian la intención; el resto cuenta para el Jaccard
+_RELLENO = frozenset(
+    "a al cual cuales de del decir dime el en es esta este favor fue fueron hay hubo la las lo los me "
+    "nos podes podrias por puedes que se sabes son su sus tuvimos un una y".split()
+)
+# Palabras que sí la cambian: deben coincidir para aceptar una coincidencia difusa
+_CLAVES = frozenset("no sin excepto salvo mas menos mayor menor mejor peor top total promedio media".split())
+_PREFIJOS_CLAVE = (
+    "ingres", "factur", "recaud", "monto", "dinero", "gananci", "unidad", "ticket", "vend", "venta",
+    "compr", "product", "categor", "client", "ciudad", "distint", "diferent", "cuant",
+)
+
+
+def _is_key(word: str) -> bool:
+    return word in _CLAVES or word.startswith(_PREFIJOS_CLAVE)
+
+
+def load_templates(path: Optional[str] = None) -> List[dict]:
+    """Catálogo de `CANONICAL_TEMPLATES_FILE` (lista de `{"id", "questions"}`) o el de por defecto."""
+    path = path if path is not None else os.getenv("CANONICAL_TEMPLATES_FILE", "")
+    if not path:
+        return DEFAULT_TEMPLATES
+    with open(path, encoding="utf-8") as f:
+        templates = json.load(f)
+    for t in templates:
+        if not t.get("id") or not t.get("questions"):
+            raise ValueError(f"Plantilla canónica inválida en {path}: {t!r}")
+    return templates
+
+
+def templates_fingerprint(templates: List[dict]) -> str:
+    raw = json.dumps(templates, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return hashlib.sha1(raw).hexdigest()[:12]
+
+
+def _slots_of(skeleton: str) -> Tuple[str, ...]:
+    slots = tuple(sorted(set(_RE_SLOT.findall(skeleton))))
+    unknown = [s for s in slots if s not in SLOTS]
+    if unknown:
+        raise ValueError(f"Hueco desconocido en plantilla canónica: {unknown} (válidos: año, mes, producto)")
+    return slots
+
+
+def _slot_text(slot: str, value) -> str:
+    return NOMBRES_MES[int(value)] if slot == "mes" else str(value)
+
+
+def _fill(skeleton: str, values: Dict[str, object]) -> str:
+    for slot, value in values.items():
+        skeleton = skeleton.replace("{" + slot + "}", _slot_text(slot, value))
+    return skeleton
+
+
+def answer_key(template_id: str, values: Dict[str, object]) -> str:
+    # "ventas_mes|ano=2023|mes=3"
+    return "|".join([template_id] + [f"{slot}={values[slot]}" for slot in sorted(values)])
+
+
+@dataclass
+class _Variant:
+    template_id: str
+    skeleton: str
+    slots: Tuple[str, ...]
+    keys: frozenset
+    words: frozenset
+
+
+@dataclass
+class CanonicalMatch:
+    template_id: str
+    values: Dict[str, object]
+    kind: str            # "exact" | "fuzzy" | "embedding"
+    key: str
+
+
+class CanonicalAnswers:
+    """Respuestas precalculadas por plantilla + valores de los huecos."""
+
+    def __init__(
+        self,
+        templates: List[dict],
+        answers: Dict[str, str],
+        values: Dict[str, list],
+        dataset: Optional[str] = None,
+        embeddings=None,
+        min_similarity: float = 0.8,
+        embedding_threshold: float = 0.9,
+        build_seconds: Optional[float] = None,
+        catalog: Optional[str] = None,
+        source: str = "built",
+    ):
+        self.templates = templates
+        self.answers = answers
+        self.values = values
+        self.dataset = dataset
+        self.embeddings = embeddings
+        self.min_similarity = min_similarity
+        self.embedding_threshold = embedding_threshold
+        self.build_seconds = build_seconds
+        self.catalog = catalog          # huella del catálogo con el que se calcularon
+        self.source = source            # "index" (leído del índice) | "built" (calculado al cargar)
+
+        self._variants: List[_Variant] = []
+        self._by_skeleton: Dict[str, str] = {}
+        for t in templates:
+            for question in t["questions"]:
+                skeleton = normalize(question)
+                words = frozenset(w for w in skeleton.split() if w not in _RELLENO)
+                variant = _Variant(t["id"], skeleton, _slots_of(skeleton),
+                                   frozenset(w for w in words if _is_key(w)), words)
+                self._variants.append(variant)
+                self._by_skeleton.setdefault(skeleton, t["id"])
+
+        # Frase normalizada -> (hueco o columna, valor). Los meses y años se
+        # reconocen aparte; las frases largas se prueban primero.
+        self._entities: Dict[str, Tuple[str, object]] = {}
+        for col in ENTITY_COLUMNS:
+            slot = next((s for s, c in SLOTS.items() if c == col), col)
+            for value in values.get(col, []):
+                self._entities.setdefault(normalize(str(value)), (slot, value))
+        for name, month in MESES.items():
+            self._entities[name] = ("mes", month)
+        self._max_words = max((len(p.split()) for p in self._entities), default=1)
+
+        self._lock = threading.Lock()
+        # Esqueleto -> (plantilla o None, tipo de coincidencia)
+        self._memo: Dict[str, Tuple[Optional[str], str]] = {}
+        self._vectors: Optional[np.ndarray] = None
+        self.hits = 0
+        self.misses = 0
+        self.matched = {"exact": 0, "fuzzy": 0, "embedding": 0}
+
+    # ------------------------------------------------------------------
+    # Precálculo y persistencia
+    # ------------------------------------------------------------------
+    @classmethod
+    def build(cls, analytics, templates: Optional[List[dict]] = None, dataset: Optional[str] = None,
+              max_answers: int = 20000, **kwargs) -> "CanonicalAnswers":
+        """Expande cada plantilla con los valores del dataset y la responde con `analytics`."""
+        templates = templates if templates is not None else load_templates()
+        start = time.perf_counter()
+        cube = analytics.cube
+        values = {col: sorted(str(v) for v in cube.values(col)) for col in ENTITY_COLUMNS}
+        values["Año"] = sorted(int(v) for v in cube.values("Año"))
+        slot_values = {"ano": values["Año"], "mes": list(range(1, 13)), "producto": values["NombreProducto"]}
+
+        kept: List[dict] = []
+        answers: Dict[str, str] = {}
+        for t in templates:
+            canonical = normalize(t["questions"][0])
+            slots = _slots_of(canonical)
+            combos = [dict(zip(slots, combo)) for combo in itertools.product(*(slot_values[s] for s in slots))]
+            if not combos:
+                continue
+            reference = analytics.parse(_fill(canonical, combos[0]))
+            if reference is None:
+                print(f"[WARN] Plantilla canónica '{t['id']}' descartada: la analítica no la reconoce.")
+                continue
+            # Sólo variantes con los mismos huecos que la analítica interpreta igual
+            questions = [q for q in t["questions"]
+                         if _slots_of(normalize(q)) == slots and analytics.parse(_fill(normalize(q), combos[0])) == reference]
+            if len(questions) < len(t["questions"]):
+                dropped = [q for q in t["questions"] if q not in questions]
+                print(f"[WARN] Plantilla canónica '{t['id']}': variantes descartadas {dropped}")
+            if len(answers) + len(combos) > max_answers:
+                print(f"[WARN] Plantilla canónica '{t['id']}' descartada: supera CANONICAL_MAX_ANSWERS ({max_answers}).")
+                continue
+            for combo in combos:
+                answer = analytics.answer(_fill(canonical, combo))
+                if answer is not None:
+                    answers[answer_key(t["id"], combo)] = answer
+            kept.append({"id": t["id"], "questions": questions})
+
+        seconds = round(time.perf_counter() - start, 3)
+        print(f"[INFO] Respuestas canónicas: {len(answers)} de {len(kept)} plantillas en {seconds}s")
+        return cls(kept, answers, values, dataset=dataset, build_seconds=seconds,
+                   catalog=templates_fingerprint(templates), **kwargs)
+
+    def save(self, index_dir: str) -> str:
+        """Guarda las respuestas en `index_dir` (escritura atómica)."""
+        path = os.path.join(index_dir, CANONICAL_FILE)
+        data = {
+            "dataset": self.dataset,
+            "catalog": self.catalog,
+            "build_seconds": self.build_seconds,
+            "templates": self.templates,
+            "values": self.values,
+            "answers": self.answers,
+        }
+        # Temporal por proceso: varios workers pueden calcularlas a la vez
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, index_dir: str, dataset: Optional[str] = None, **kwargs) -> Optional["CanonicalAnswers"]:
+        """Respuestas guardadas en `index_dir`; None si faltan o son de otro dataset o catálogo."""
+        try:
+            with open(os.path.join(index_dir, CANONICAL_FILE), encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if dataset is not None and data.get("dataset") != dataset:
+            return None
+        if data.get("catalog") != templates_fingerprint(load_templates()):
+            return None
+        return cls(data["templates"], data["answers"], data["values"], dataset=data.get("dataset"),
+                   build_seconds=data.get("build_seconds"), catalog=data["catalog"], source="index", **kwargs)
+
+    @classmethod
+    def from_env(cls, index_dir: Optional[str], analytics=None, dataset: Optional[str] = None,
+                 embeddings=None) -> Optional["CanonicalAnswers"]:
+        """Las del índice si están al día; si no, se calculan con `analytics` y se guardan."""
+        kwargs = {
+            "embeddings": embeddings,
+            "min_similarity": float(os.getenv("CANONICAL_MIN_SIMILARITY", "0.8")),
+            "embedding_threshold": float(os.getenv("CANONICAL_EMBEDDING_THRESHOLD", "0.9")),
+        }
+        canonical = cls.load(index_dir, dataset, **kwargs) if index_dir else None
+        if canonical is not None or analytics is None:
+            return canonical
+        canonical = cls.build(analytics, dataset=dataset,
+                              max_answers=int(os.getenv("CANONICAL_MAX_ANSWERS", "20000")), **kwargs)
+        if index_dir and os.path.isdir(index_dir):
+            try:
+                canonical.save(index_dir)
+            except OSError as e:
+                print(f"[WARN] No se pudieron guardar las respuestas canónicas: {str(e)[:100]}")
+        return canonical
+
+    # ------------------------------------------------------------------
+    # Coincidencia
+    # ------------------------------------------------------------------
+    def _extract(self, text: str) -> Optional[Tuple[str, Dict[str, object]]]:
+        """Esqueleto y valores de los huecos; None si la pregunta tiene otros filtros."""
+        words = text.split()
+        out: List[str] = []
+        values: Dict[str, object] = {}
+        i = 0
+        while i < len(words):
+            word = words[i]
+            if _RE_ANO.match(word):
+                slot, value, n = "ano", int(word), 1
+            elif word.isdigit():
+                return None
+            else:
+                slot = None
+                for n in range(min(self._max_words, len(words) - i), 0, -1):
+                    found = self._entities.get(" ".join(words[i:i + n]))
+                    if found is not None:
+                        slot, value = found
+                        break
+                if slot is None:
+                    out.append(word)
+                    i += 1
+                    continue
+            if slot not in SLOTS or slot in values:
+                return None
+            values[slot] = value
+            out.append("{" + slot + "}")
+            i += n
+        return " ".join(out), values
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1.0)
+
+    def _resolve(self, skeleton: str) -> Tuple[Optional[str], str]:
+        template_id = self._by_skeleton.get(skeleton)
+        if template_id is not None:
+            return template_id, "exact"
+
+        words = frozenset(w for w in skeleton.split() if w not in _RELLENO)
+        keys = frozenset(w for w in words if _is_key(w))
+        slots = tuple(sorted(set(_RE_SLOT.findall(skeleton))))
+        candidates = [i for i, v in enumerate(self._variants) if v.slots == slots and v.keys == keys and keys]
+        if not candidates:
+            return None, "miss"
+
+        best, best_sim = None, 0.0
+        for i in candidates:
+            v = self._variants[i]
+            sim = len(words & v.words) / len(words | v.words)
+            if sim > best_sim:
+                best, best_sim = v.template_id, sim
+        if best_sim >= self.min_similarity:
+            return best, "fuzzy"
+
+        if self.embeddings is None or self.embedding_threshold <= 0:
+            return None, "miss"
+        candidates = [i for i in candidates if words <= self._variants[i].words]
+        if not candidates:
+            return None, "miss"
+        try:
+            with self._lock:
+                if self._vectors is None:
+                    self._vectors = self._embed([v.skeleton for v in self._variants])
+            vec = self._embed([skeleton])[0]
+        except Exception as e:
+            print(f"[WARN] Respuestas canónicas: no se pudo calcular el embedding: {str(e)[:100]}")
+            return None, "miss"
+        sims = self._vectors[candidates] @ vec
+        j = int(np.argmax(sims))
+        if float(sims[j]) >= self.embedding_threshold:
+            return self._variants[candidates[j]].template_id, "embedding"
+        return None, "miss"
+
+    def match(self, question: str) -> Optional[CanonicalMatch]:
+        extracted = self._extract(normalize(question))
+        if extracted is None:
+            return None
+        skeleton, values = extracted
+        resolved = self._memo.get(skeleton)
+        if resolved is None:
+            resolved = self._resolve(skeleton)
+            with self._lock:
+                if len(self._memo) >= 10000:
+                    self._memo.clear()
+                self._memo[skeleton] = resolved
+                if resolved[0] is not None:
+                    self.matched[resolved[1]] += 1
+        template_id, kind = resolved
+        if template_id is None:
+            return None
+        return CanonicalMatch(template_id, values, kind, answer_key(template_id, values))
+
+    def answer(self, question: str) -> Optional[str]:
+        """Respuesta precalculada, o None si la pregunta no es canónica."""
+        match = self.match(question)
+        answer = self.answers.get(match.key) if match is not None else None
+        with self._lock:
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return answer
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "dataset": self.dataset,
+                "source": self.source,
+                "templates": len(self.templates),
+                "variants": len(self._variants),
+                "answers": len(self.answers),
+                "build_seconds": self.build_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "matched_skeletons": dict(self.matched),
+                "memo": len(self._memo),
+            }
+
+
+def precompute(dataset_path: str, index_dir: str, dataset: Optional[str] = None) -> Optional[str]:
+    """Paso del reindex: calcula las respuestas del dataset y las guarda en `index_dir`."""
+    from analytics import SalesAnalytics
+
+    analytics = SalesAnalytics.from_excel(dataset_path)
+    if analytics is None:
+        return None
+    return CanonicalAnswers.build(
+        analytics, dataset=dataset, max_answers=int(os.getenv("CANONICAL_MAX_ANSWERS", "20000")),
+    ).save(index_dir)
@@ -0,0 +1,170 @@
+"""Armado del contexto del prompt dentro de un presupuesto de tokens.
+
+El tiempo hasta el primer token en Ollama (CPU) crece con el largo del
+prompt, y `num_ctx` es finito. Antes de llamar al LLM:
+
+1. Se compactan las tablas que emite `DataFrame.to_string()` (el relleno de
+   espacios para alinear columnas son tokens que no aportan nada).
+2. Se cuentan tokens con el tokenizer del modelo si está disponible
+   (`CONTEXT_TOKENIZER` de Hugging Face, o `llm.get_num_tokens` cuando el
+   proveedor lo implementa, p. ej. OpenAI); si no, se estima por caracteres.
+3. Se meten los documentos en orden de relevancia mientras entren en el
+   presupuesto; si ni el primero entra, se recorta por líneas.
+"""
+
+import math
+import os
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence
+
+from langchain_core.language_models import BaseLanguageModel
+
+
+# Estimación conservadora para español con muchos números
+CHARS_PER_TOKEN = 3.5
+
+_PADDING = re.compile(r" {2,}")
+
+
+def compact_table(text: str) -> str:
+    """Quita el relleno de alineación de las tablas de pandas.
+
+    Las líneas con dos o más espacios seguidos se consideran filas de tabla:
+    se recortan y las columnas quedan separadas por " | ". La línea con el
+    nombre del índice que agrega `to_string()` bajo los encabezados se une
+    a ellos. El texto corrido (un espacio entre palabras) no se modifica.
+    """
+    raw = text.splitlines()
+    lines: List[str] = []
+    i = 0
+    while i < len(raw):
+        stripped = raw[i].strip()
+        i += 1
+        if not stripped:
+            if lines and lines[-1]:
+                lines.append("")
+            continue
+        if _PADDING.search(stripped):
+            stripped = _PADDING.sub(" | ", stripped)
+            # Encabezados seguidos del nombre del índice: "Año | Ventas | Total"
+            index_name = raw[i].strip() if i < len(raw) else ""
+            if index_name and " " not in index_name:
+                stripped = f"{index_name} | {stripped}"
+                i += 1
+        lines.append(stripped)
+    return "\n".join(lines)
+
+
+class TokenCounter:
+    """Cuenta tokens con el mejor método disponible para el LLM configurado."""
+
+    def __init__(self, llm=None, tokenizer: Optional[str] = None):
+        self.method = "estimate"
+        self._count = self._estimate
+
+        tokenizer = tokenizer if tokenizer is not None else os.getenv("CONTEXT_TOKENIZER", "")
+        if tokenizer:
+            try:
+                from transformers import AutoTokenizer
+
+                tok = AutoTokenizer.from_pretrained(tokenizer)
+                self._count = lambda text: len(tok.encode(text, add_special_tokens=False))
+                self.method = f"hf:{tokenizer}"
+                return
+            except Exception as e:
+                print(f"[WARN] Tokenizer '{tokenizer}' no disponible ({str(e)[:100]}); se estima por caracteres.")
+
+        if llm is not None and self._has_own_tokenizer(llm):
+            self._count = llm.get_num_tokens
+            self.method = f"llm:{type(llm).__name__}"
+
+    @staticmethod
+    def _has_own_tokenizer(llm) -> bool:
+        # La implementación base de LangChain descarga el tokenizer de GPT-2,
+        # que ni es el del modelo ni está disponible sin red: sólo se usa
+        # `get_num_tokens` si el proveedor lo redefine (p. ej. ChatOpenAI)
+        cls = type(llm)
+        for name in ("get_num_tokens", "get_token_ids"):
+            impl = getattr(cls, name, None)
+            if impl is not None and impl is not getattr(BaseLanguageModel, name):
+                return True
+        return False
+
+    @staticmethod
+    def _estimate(text: str) -> int:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        try:
+            return self._count(text)
+        except Exception as e:
+            print(f"[WARN] Error contando tokens ({str(e)[:100]}); se estima por caracteres.")
+            self._count = self._estimate
+            self.method = "estimate"
+            return self._estimate(text)
+
+
+@dataclass
+class PackedContext:
+    text: str
+    tokens: int
+    used: List[int] = field(default_factory=list)     # índices de los documentos incluidos
+    dropped: List[int] = field(default_factory=list)  # no entraron en el presupuesto
+    truncated: bool = False
+
+
+SEPARATOR = "\n\n"
+
+
+def _truncate(text: str, budget: int, counter: TokenCounter) -> str:
+    # Conservar las primeras líneas (título y cifras generales) que entren
+    lines = text.splitlines()
+    lo, hi = 0, len(lines)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if counter.count("\n".join(lines[:mid])) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return "\n".join(lines[:lo])
+
+
+def pack_context(texts: Sequence[str], budget: Optional[int], counter: TokenCounter) -> PackedContext:
+    """Compacta `texts` (ordenados por relevancia) y toma los que entren en `budget` tokens."""
+    parts: List[str] = []
+    packed = PackedContext("", 0)
+    sep_tokens = counter.count(SEPARATOR)
+
+    for i, text in enumerate(texts):
+        text = compact_table(text)
+        tokens = counter.count(text)
+        cost = tokens + (sep_tokens if parts else 0)
+        if budget is None or packed.tokens + cost <= budget:
+            parts.append(text)
+            packed.tokens += cost
+            packed.used.append(i)
+        elif not parts:
+            # Ni el documento más relevante entra: recortarlo
+            text = _truncate(text, budget, counter)
+            if text:
+                parts.append(text)
+                packed.tokens += counter.count(text)
+                packed.used.append(i)
+                packed.truncated = True
+            else:
+                packed.dropped.append(i)
+        else:
+            # Seguir probando: uno más chico y menos relevante puede entrar
+            packed.dropped.append(i)
+
+    packed.text = SEPARATOR.join(parts)
+    return packed
+
+
+def get_context_budget() -> Optional[int]:
+    """Tokens máximos de contexto (CONTEXT_TOKEN_BUDGET; 0 = sin límite)."""
+    budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+    return budget if budget > 0 else None
@@ -0,0 +1,185 @@
+"""Cubo OLAP precalculado con los agregados de ventas.
+
+Se calcula en una sola pasada (un único `groupby`) sobre `ventas_full` al
+nivel más fino (Año, Mes, Categoria, NombreProducto, Ciudad, NombreCliente)
+con medidas aditivas (conteo y sumas). Cualquier roll-up se obtiene
+reagrupando esa tabla, que es mucho más chica que las ventas originales, y
+los promedios se derivan de sumas / conteos para que sean exactos.
+
+Las filas sin categoría, producto, ciudad o cliente (p. ej. un producto que
+no está en la hoja de productos) se agrupan bajo "Sin dato" en vez de
+perderse, y las ventas sin fecha quedan con Año / Mes vacíos en una
+partición propia: los totales del cubo siempre cuadran con las ventas.
+
+El cubo se persiste en Parquet junto con un manifiesto que guarda la versión
+del dataset y una huella por partición (Año, Mes). Al reconstruir sólo se
+recalculan las particiones cuya huella cambió.
+"""
+
+import json
+import os
+from typing import Dict, Iterable, List, Mapping, Optional
+
+import pandas as pd
+
+
+CUBE_DIMS = ["Año", "Mes", "Categoria", "NombreProducto", "Ciudad", "NombreCliente"]
+CUBE_MEASURES = ["Ventas", "Cantidad", "Total"]
+
+# Dimensión derivada: "YYYY-MM" a partir de Año y Mes
+MES_ANO = "MesAño"
+
+# Valor de las dimensiones de texto vacías y partición de las ventas sin fecha
+SIN_DATO = "Sin dato"
+SIN_FECHA = "sin-fecha"
+
+CUBE_FILE = "cube.parquet"
+MANIFEST_FILE = "cube.json"
+
+
+def _fill_missing(col: pd.Series) -> pd.Series:
+    if not col.isna().any():
+        return col
+    if isinstance(col.dtype, pd.CategoricalDtype) and SIN_DATO not in col.cat.categories:
+        col = col.cat.add_categories([SIN_DATO])
+    return col.fillna(SIN_DATO)
+
+
+def _aggregate(ventas_full: pd.DataFrame) -> pd.DataFrame:
+    # Única agregación sobre los datos crudos: todas las medidas de una vez.
+    # dropna=False: una venta sin fecha también cuenta en los totales
+    ventas_full = ventas_full.assign(**{c: _fill_missing(ventas_full[c]) for c in CUBE_DIMS if c not in ("Año", "Mes")})
+    return (
+        ventas_full.groupby(CUBE_DIMS, observed=True, sort=False, dropna=False)
+        .agg(Ventas=("IdVenta", "count"), Cantidad=("Cantidad", "sum"), Total=("Total", "sum"))
+        .reset_index()
+    )
+
+
+def _partition_key(anio, mes) -> str:
+    if pd.isna(anio) or pd.isna(mes):
+        return SIN_FECHA
+    return f"{int(anio):04d}-{int(mes):02d}"
+
+
+def _month_labels(table: pd.DataFrame) -> pd.Series:
+    """Etiqueta "YYYY-MM" de cada fila (vacía si la venta no tiene fecha)."""
+    dated = table["Año"].notna() & table["Mes"].notna()
+    labels = pd.Series(None, index=table.index, dtype=object)
+    rows = table[dated]
+    labels[dated] = rows["Año"].astype(int).astype(str).str.zfill(4) + "-" + rows["Mes"].astype(int).astype(str).str.zfill(2)
+    return labels
+
+
+def _partition_fingerprints(ventas_full: pd.DataFrame) -> Dict[str, str]:
+    """Huella por (Año, Mes), independiente del orden de las filas."""
+    if ventas_full.empty:
+        return {}
+    row_hash = pd.util.hash_pandas_object(ventas_full, index=False)
+    grouped = row_hash.groupby([ventas_full["Año"], ventas_full["Mes"]], dropna=False).agg(["sum", "count"])
+    return {
+        _partition_key(anio, mes): f"{int(row['sum']):016x}-{int(row['count'])}"
+        for (anio, mes), row in grouped.iterrows()
+    }
+
+
+def _partition_mask(table: pd.DataFrame, keys: Iterable[str]) -> pd.Series:
+    return _month_labels(table).fillna(SIN_FECHA).isin(set(keys))
+
+
+class SalesCube:
+    """Tabla de agregados al grano más fino, consultable por cualquier roll-up."""
+
+    def __init__(self, table: pd.DataFrame, version: Optional[str] = None, partitions: Optional[Dict[str, str]] = None):
+        self.table = table
+        self.version = version
+        self.partitions = partitions or {}
+
+    @classmethod
+    def build(cls, ventas_full: pd.DataFrame, version: Optional[str] = None, previous: Optional["SalesCube"] = None) -> "SalesCube":
+        """Construye el cubo; con `previous` sólo recalcula las particiones que cambiaron."""
+        fingerprints = _partition_fingerprints(ventas_full)
+
+        if previous is None or not previous.partitions:
+            return cls(_aggregate(ventas_full), version, fingerprints)
+
+        changed = {p for p, fp in fingerprints.items() if previous.partitions.get(p) != fp}
+        unchanged = set(fingerprints) - changed
+        print(f"[INFO] Cubo: {len(changed)} particiones a recalcular, {len(unchanged)} reutilizadas")
+
+        kept = previous.table[_partition_mask(previous.table, unchanged)]
+        if changed:
+            fresh = _aggregate(ventas_full[_partition_mask(ventas_full, changed)])
+            table = pd.concat([kept, fresh], ignore_index=True)
+        else:
+            table = kept.reset_index(drop=True)
+        return cls(table, version, fingerprints)
+
+    # ------------------------------------------------------------------
+    # Persistencia
+    # ------------------------------------------------------------------
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        tmp = os.path.join(directory, CUBE_FILE + ".tmp")
+        self.table.to_parquet(tmp, index=False)
+        os.replace(tmp, os.path.join(directory, CUBE_FILE))
+        manifest = {"version": self.version, "dims": CUBE_DIMS, "partitions": self.partitions}
+        tmp = os.path.join(directory, MANIFEST_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(directory, MANIFEST_FILE))
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["SalesCube"]:
+        manifest_path = os.path.join(directory, MANIFEST_FILE)
+        cube_path = os.path.join(directory, CUBE_FILE)
+        if not (os.path.exists(manifest_path) and os.path.exists(cube_path)):
+            return None
+        try:
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("dims") != CUBE_DIMS:
+                return None
+            return cls(pd.read_parquet(cube_path), manifest.get("version"), manifest.get("partitions"))
+        except Exception as e:
+            print(f"[WARN] No se pudo leer el cubo en {directory}: {str(e)[:200]}")
+            return None
+
+    # ------------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------------
+    def slice(self, filters: Optional[Mapping[str, object]] = None) -> pd.DataFrame:
+        """Filas del cubo que cumplen los filtros (igualdad por dimensión)."""
+        table = self.table
+        if not filters:
+            return table
+        mask = pd.Series(True, index=table.index)
+        for col, val in filters.items():
+            mask &= table[col] == val
+        return table[mask]
+
+    def rollup(self, dims: List[str], filters: Optional[Mapping[str, object]] = None) -> pd.DataFrame:
+        """Agrega el cubo por `dims` (acepta también "MesAño").
+
+        Devuelve las medidas aditivas más los promedios derivados
+        `TicketPromedio` (Total / Ventas) y `CantidadPromedio`.
+        """
+        table = self.slice(filters)
+        if MES_ANO in dims:
+            table = table.assign(**{MES_ANO: _month_labels(table)})
+        out = table.groupby(dims, observed=True)[CUBE_MEASURES].sum()
+        return _with_means(out)
+
+    def totals(self, filters: Optional[Mapping[str, object]] = None) -> pd.Series:
+        """Medidas globales (opcionalmente filtradas) como una Serie."""
+        out = self.slice(filters)[CUBE_MEASURES].sum().to_frame().T
+        return _with_means(out).iloc[0]
+
+    def values(self, dim: str) -> List:
+        return list(self.table[dim].dropna().unique())
+
+
+def _with_means(df: pd.DataFrame) -> pd.DataFrame:
+    ventas = df["Ventas"].where(df["Ventas"] != 0)
+    return df.assign(TicketPromedio=df["Total"] / ventas, CantidadPromedio=df["Cantidad"] / ventas)
+
@@ -1,11 +1,30 @@
 # pyright: reportCallIssue=false
 
+import hashlib
+import multiprocessing
+import os
 import pandas as pd
-from typing import List, Mapping, cast
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Deque, Dict, Iterator, List, Mapping, Optional, Tuple, cast
+import dataset_cache
+from cube import MES_ANO, SalesCube
+from text_utils import NOMBRES_MES, normalize
 
 
 CHUNK_SIZE = 500  # caracteres (ajustable)
 
+# Medidas que muestran las tablas de los documentos por dimensión
+MEDIDAS = ['Ventas', 'Cantidad', 'Total']
+
+
+# Columnas que usa `build_sales_frame`; permite leer sólo eso del caché columnar
+SALES_COLUMNS = {
+	'Ventas': ['IdVenta', 'IdProducto', 'IdCliente', 'Cantidad', 'FechaVenta'],
+	'Productos': ['IdProducto', 'NombreProducto', 'Categoria', 'Precio'],
+	'Clientes': ['IdCliente', 'NombreCliente', 'Ciudad'],
+}
+
 
 def read_excel(path: str) -> Mapping[str, pd.DataFrame]:
 	xls = pd.ExcelFile(path)
@@ -13,82 +32,370 @@ def read_excel(path: str) -> Mapping[str, pd.DataFrame]:
 	return cast(Mapping[str, pd.DataFrame], dfs)
 
 
-def create_summary_documents(dfs: Mapping[str, pd.DataFrame]) -> List[dict]:
-	"""Crea UN SOLO documento con TODA la información necesaria"""
+def read_dataset(path: str, columns: Optional[Mapping[str, List[str]]] = None) -> Mapping[str, pd.DataFrame]:
+	"""Lee las hojas desde el caché columnar; si no existe, parsea el Excel y lo crea.
+
+	`columns` restringe hojas y columnas ({"Ventas": [...]}); con el caché
+	sólo se leen esas columnas del disco.
+	"""
+	version = dataset_version(path)
+	dfs = dataset_cache.load_sheets(version, columns)
+	if dfs is not None:
+		return dfs
+
+	dfs = read_excel(path)
+	dataset_cache.save_sheets(version, dfs)
+	if columns is not None:
+		dfs = {sheet: dfs[sheet][cols] for sheet, cols in columns.items() if sheet in dfs}
+	return dfs
+
+
+def build_sales_frame(dfs: Mapping[str, pd.DataFrame]) -> Optional[pd.DataFrame]:
+	"""Une Ventas con Productos y Clientes y agrega columnas derivadas.
+
+	Devuelve None si falta alguna de las tres hojas.
+	"""
+	if not ('Ventas' in dfs and 'Productos' in dfs and 'Clientes' in dfs):
+		return None
+
+	# Merge completo
+	ventas_full = dfs['Ventas'].merge(dfs['Productos'], on='IdProducto').merge(dfs['Clientes'], on='IdCliente')
+	ventas_full['Total'] = ventas_full['Cantidad'] * ventas_full['Precio']
+	ventas_full['FechaVenta'] = pd.to_datetime(ventas_full['FechaVenta'])
+	ventas_full['Año'] = ventas_full['FechaVenta'].dt.year
+	ventas_full['Mes'] = ventas_full['FechaVenta'].dt.month
+	ventas_full['MesAño'] = ventas_full['FechaVenta'].dt.strftime('%Y-%m')
+	return ventas_full
+
+
+_version_memo: Dict[tuple, str] = {}
+
+
+def dataset_version(path: str) -> str:
+	"""Hash del archivo de origen; identifica la versión del dataset."""
+	# Mientras tamaño y fecha de modificación no cambien, no se vuelve a leer
+	st = os.stat(path)
+	key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+	if key in _version_memo:
+		return _version_memo[key]
+
+	h = hashlib.sha256()
+	with open(path, "rb") as f:
+		for block in iter(lambda: f.read(1 << 20), b""):
+			h.update(block)
+	_version_memo[key] = h.hexdigest()[:16]
+	return _version_memo[key]
+
+
+def get_cube_dir() -> str:
+	return os.getenv("CUBE_DIR", "../cube")
+
+
+def build_cube(dfs: Mapping[str, pd.DataFrame], version: Optional[str] = None, cube_dir: Optional[str] = None) -> Optional[SalesCube]:
+	"""Construye el cubo de ventas; si hay uno persistido en `cube_dir` lo reutiliza.
+
+	Con la misma versión se devuelve tal cual; con otra versión sólo se
+	recalculan las particiones (Año, Mes) que cambiaron.
+	"""
+	previous = SalesCube.load(cube_dir) if cube_dir else None
+	if previous is not None and version is not None and previous.version == version:
+		return previous
+
+	ventas_full = build_sales_frame(dfs)
+	if ventas_full is None:
+		return None
+	cube = SalesCube.build(ventas_full, version, previous=previous)
+	if cube_dir:
+		cube.save(cube_dir)
+	return cube
+
+
+def load_sales_cube(path: str, cube_dir: Optional[str] = None) -> Optional[SalesCube]:
+	"""Devuelve el cubo de la versión actual del Excel, sin parsearlo si ya existe."""
+	cube_dir = cube_dir or get_cube_dir()
+	version = dataset_version(path)
+	cube = SalesCube.load(cube_dir)
+	if cube is not None and cube.version == version:
+		return cube
+	return build_cube(read_dataset(path, SALES_COLUMNS), version, cube_dir)
+
+
+def create_summary_documents(dfs: Mapping[str, pd.DataFrame], cube: Optional[SalesCube] = None) -> List[dict]:
+	"""Crea UN SOLO documento con TODA la información necesaria
+
+	Todas las cifras salen de roll-ups del cubo de ventas; si no se pasa uno,
+	se construye en una sola pasada sobre `ventas_full`.
+	"""
 	docs = []
 	
-	if 'Ventas' in dfs and 'Productos' in dfs and 'Clientes' in dfs:
+	if cube is None:
+		cube = build_cube(dfs)
+	if cube is not None:
 		df_ventas = dfs['Ventas']
 		df_prod = dfs['Productos']
 		df_cli = dfs['Clientes']
-		
-		# Merge completo
-		ventas_full = df_ventas.merge(df_prod, on='IdProducto').merge(df_cli, on='IdCliente')
-		ventas_full['Total'] = ventas_full['Cantidad'] * ventas_full['Precio']
-		ventas_full['FechaVenta'] = pd.to_datetime(ventas_full['FechaVenta'])
-		ventas_full['Año'] = ventas_full['FechaVenta'].dt.year
-		ventas_full['Mes'] = ventas_full['FechaVenta'].dt.month
-		ventas_full['MesAño'] = ventas_full['FechaVenta'].dt.strftime('%Y-%m')
+
+		totales = cube.totals()
+		por_producto = cube.rollup(['NombreProducto'])
+		por_categoria = cube.rollup(['Categoria'])
+		por_cliente = cube.rollup(['NombreCliente'])
+		por_ciudad = cube.rollup(['Ciudad'])
+		por_anio = cube.rollup(['Año'])
+		por_mes = cube.rollup([MES_ANO])
+
+		def ventas_anio(anio: int) -> int:
+			return int(por_anio['Ventas'].get(anio, 0))
+
+		def detalle_anio(anio: int) -> str:
+			if anio not in por_anio.index:
+				return f"No hay datos de {anio}\n\n"
+			top3 = cube.rollup(['NombreProducto'], {'Año': anio})['Total'].sort_values(ascending=False).head(3)
+			return (
+				f"Transacciones: {ventas_anio(anio)}\n"
+				f"Ingresos: ${por_anio.loc[anio, 'Total']:,.2f}\n"
+				f"Top 3 productos {anio}: {top3.to_dict()}"
+			)
 		
 		# UN SOLO DOCUMENTO COMPLETO
 		doc_completo = f"""=== BASE DE DATOS COMPLETA DE VENTAS ===
 
 1. RESUMEN GENERAL:
 Total ventas: {len(df_ventas)}
-Ingresos totales: ${ventas_full['Total'].sum():,.2f}
-Ticket promedio: ${ventas_full['Total'].mean():.2f}
-Unidades vendidas: {int(ventas_full['Cantidad'].sum())}
+Ingresos totales: ${totales['Total']:,.2f}
+Ticket promedio: ${totales['TicketPromedio']:.2f}
+Unidades vendidas: {int(totales['Cantidad'])}
 
 2. PRODUCTOS ({len(df_prod)} productos):
 Categorías: {', '.join(df_prod['Categoria'].unique())}
-Producto más vendido (unidades): {ventas_full.groupby('NombreProducto')['Cantidad'].sum().idxmax()} ({int(ventas_full.groupby('NombreProducto')['Cantidad'].sum().max())} unidades)
-Producto más vendido (ingresos): {ventas_full.groupby('NombreProducto')['Total'].sum().idxmax()} (${ventas_full.groupby('NombreProducto')['Total'].sum().max():,.2f})
+Producto más vendido (unidades): {por_producto['Cantidad'].idxmax()} ({int(por_producto['Cantidad'].max())} unidades)
+Producto más vendido (ingresos): {por_producto['Total'].idxmax()} (${por_producto['Total'].max():,.2f})
 
 Top 10 productos por ventas:
-{ventas_full.groupby('NombreProducto').agg({'Cantidad': 'sum', 'Total': 'sum'}).sort_values(by='Total', ascending=False).head(10).to_string()}
+{por_producto[['Cantidad', 'Total']].sort_values(by='Total', ascending=False).head(10).to_string()}
 
 Ventas por categoría:
-{ventas_full.groupby('Categoria')['Total'].sum().sort_values(ascending=False).to_string()}
+{por_categoria['Total'].sort_values(ascending=False).to_string()}
 
 3. CLIENTES ({len(df_cli)} clientes):
 Ciudades: {', '.join(df_cli['Ciudad'].unique())}
-Cliente con más compras: {ventas_full.groupby('NombreCliente')['IdVenta'].count().idxmax()} ({int(ventas_full.groupby('NombreCliente')['IdVenta'].count().max())} compras)
-Cliente con más ingresos: {ventas_full.groupby('NombreCliente')['Total'].sum().idxmax()} (${ventas_full.groupby('NombreCliente')['Total'].sum().max():,.2f})
+Cliente con más compras: {por_cliente['Ventas'].idxmax()} ({int(por_cliente['Ventas'].max())} compras)
+Cliente con más ingresos: {por_cliente['Total'].idxmax()} (${por_cliente['Total'].max():,.2f})
 
 Top 10 clientes:
-{ventas_full.groupby('NombreCliente').agg({'IdVenta': 'count', 'Total': 'sum'}).sort_values(by='Total', ascending=False).head(10).to_string()}
+{por_cliente[['Ventas', 'Total']].sort_values(by='Total', ascending=False).head(10).to_string()}
 
 Ventas por ciudad:
-{ventas_full.groupby('Ciudad').agg({'IdVenta': 'count', 'Total': 'sum'}).sort_values(by='Total', ascending=False).to_string()}
+{por_ciudad[['Ventas', 'Total']].sort_values(by='Total', ascending=False).to_string()}
 
 4. ANÁLISIS TEMPORAL:
 VENTAS POR AÑO (número de transacciones):
-- Año 2023: {len(ventas_full[ventas_full['Año'] == 2023])} ventas
-- Año 2024: {len(ventas_full[ventas_full['Año'] == 2024])} ventas
+- Año 2023: {ventas_anio(2023)} ventas
+- Año 2024: {ventas_anio(2024)} ventas
 
 Detalle por año:
-{ventas_full.groupby('Año').agg({'IdVenta': 'count', 'Total': 'sum', 'Cantidad': 'sum'}).to_string()}
+{por_anio[['Ventas', 'Total', 'Cantidad']].to_string()}
 
 Ventas por mes (YYYY-MM, número de transacciones):
-{ventas_full.groupby('MesAño').agg({'IdVenta': 'count', 'Total': 'sum'}).sort_index().to_string()}
+{por_mes[['Ventas', 'Total']].sort_index().to_string()}
 
 5. DETALLES POR AÑO 2023:
-{f"Transacciones: {len(ventas_full[ventas_full['Año'] == 2023])}" if 2023 in ventas_full['Año'].values else "No hay datos de 2023"}
-{f"Ingresos: ${ventas_full[ventas_full['Año'] == 2023]['Total'].sum():,.2f}" if 2023 in ventas_full['Año'].values else ""}
-{f"Top 3 productos 2023: {ventas_full[ventas_full['Año'] == 2023].groupby('NombreProducto')['Total'].sum().sort_values(ascending=False).head(3).to_dict()}" if 2023 in ventas_full['Año'].values else ""}
+{detalle_anio(2023)}
 
 6. DETALLES POR AÑO 2024:
-{f"Transacciones: {len(ventas_full[ventas_full['Año'] == 2024])}" if 2024 in ventas_full['Año'].values else "No hay datos de 2024"}
-{f"Ingresos: ${ventas_full[ventas_full['Año'] == 2024]['Total'].sum():,.2f}" if 2024 in ventas_full['Año'].values else ""}
-{f"Top 3 productos 2024: {ventas_full[ventas_full['Año'] == 2024].groupby('NombreProducto')['Total'].sum().sort_values(ascending=False).head(3).to_dict()}" if 2024 in ventas_full['Año'].values else ""}
+{detalle_anio(2024)}
 
 NOTA: Los datos NO incluyen información sobre vendedores, canales de venta, formas de pago ni locales/sucursales específicos. Solo se tiene información de productos, clientes (con ciudades) y fechas de venta."""
 		
-		docs.append({"page_content": doc_completo, "metadata": {"type": "complete", "priority": "highest"}})
+		docs.append({"page_content": doc_completo, "metadata": {"id": "resumen-completo", "type": "complete", "priority": "highest"}})
 	
 	return docs
 
 
+def _slug(value) -> str:
+	return normalize(str(value)).replace(' ', '-')
+
+
+def _tabla(df: pd.DataFrame, cols: List[str], n: Optional[int] = None) -> str:
+	# Tabla compacta ordenada por ingresos
+	out = df[cols].sort_values(by='Total', ascending=False)
+	if n is not None:
+		out = out.head(n)
+	return out.round(2).to_string()
+
+
+def _cifras(tot: pd.Series) -> str:
+	return (
+		f"Ventas: {int(tot['Ventas'])}\n"
+		f"Ingresos: ${tot['Total']:,.2f}\n"
+		f"Unidades vendidas: {int(tot['Cantidad'])}\n"
+		f"Ticket promedio: ${tot['TicketPromedio']:,.2f}"
+	)
+
+
+def _focused_doc(doc_id: str, doc_type: str, text: str, **fields) -> dict:
+	metadata = {'id': doc_id, 'type': doc_type}
+	for k, v in fields.items():
+		# Tipos nativos: la metadata se serializa junto al índice
+		metadata[k] = int(v) if k in ('Año', 'Mes') else str(v)
+	return {'page_content': text, 'metadata': metadata}
+
+
+# Agregados de un documento: totales de su clave y una tabla por sub-dimensión
+# (p. ej. las ventas del año 2023 por mes, por categoría...)
+Tablas = Dict[str, pd.DataFrame]
+
+
+def _doc_anio(anio, tot: pd.Series, t: Tablas) -> dict:
+	por_mes = t['Mes'].copy()
+	por_mes.index = pd.Index([NOMBRES_MES[int(m)] for m in por_mes.index], name='Mes')
+	text = (
+		f"=== VENTAS DEL AÑO {anio} ===\n{_cifras(tot)}\n\n"
+		f"Ventas por mes de {anio}:\n{por_mes[MEDIDAS].round(2).to_string()}\n\n"
+		f"Ventas por categoría en {anio}:\n{_tabla(t['Categoria'], MEDIDAS)}\n\n"
+		f"Top 5 productos {anio}:\n{_tabla(t['NombreProducto'], MEDIDAS, 5)}\n\n"
+		f"Ventas por ciudad en {anio}:\n{_tabla(t['Ciudad'], MEDIDAS)}"
+	)
+	return _focused_doc(f"anio-{anio}", 'year', text, **{'Año': anio})
+
+
+def _doc_mes(key, tot: pd.Series, t: Tablas) -> dict:
+	anio, mes = key
+	nombre = f"{NOMBRES_MES[int(mes)]} de {anio}"
+	text = (
+		f"=== VENTAS DE {nombre.upper()} ({int(anio)}-{int(mes):02d}) ===\n{_cifras(tot)}\n\n"
+		f"Ventas por categoría en {nombre}:\n{_tabla(t['Categoria'], MEDIDAS)}\n\n"
+		f"Productos en {nombre}:\n{_tabla(t['NombreProducto'], MEDIDAS)}\n\n"
+		f"Ventas por ciudad en {nombre}:\n{_tabla(t['Ciudad'], MEDIDAS)}"
+	)
+	return _focused_doc(f"mes-{int(anio)}-{int(mes):02d}", 'month', text, **{'Año': anio, 'Mes': mes})
+
+
+def _doc_producto(key, tot: pd.Series, t: Tablas) -> dict:
+	producto, categoria = key
+	text = (
+		f"=== PRODUCTO {producto} (categoría {categoria}) ===\n{_cifras(tot)}\n\n"
+		f"{producto} por año:\n{t['Año'][MEDIDAS].round(2).to_string()}\n\n"
+		f"{producto} por ciudad:\n{_tabla(t['Ciudad'], MEDIDAS)}\n\n"
+		f"Top 5 clientes de {producto}:\n{_tabla(t['NombreCliente'], MEDIDAS, 5)}"
+	)
+	return _focused_doc(f"producto-{_slug(producto)}", 'product', text,
+		NombreProducto=producto, Categoria=categoria)
+
+
+def _doc_cliente(key, tot: pd.Series, t: Tablas) -> dict:
+	cliente, ciudad = key
+	text = (
+		f"=== CLIENTE {cliente} ({ciudad}) ===\n{_cifras(tot)}\n\n"
+		f"Compras de {cliente} por año:\n{t['Año'][MEDIDAS].round(2).to_string()}\n\n"
+		f"Productos comprados por {cliente}:\n{_tabla(t['NombreProducto'], MEDIDAS)}"
+	)
+	return _focused_doc(f"cliente-{_slug(cliente)}", 'client', text,
+		NombreCliente=cliente, Ciudad=ciudad)
+
+
+def _doc_ciudad(ciudad, tot: pd.Series, t: Tablas) -> dict:
+	text = (
+		f"=== CIUDAD {ciudad} ===\n{_cifras(tot)}\n\n"
+		f"{ciudad} por año:\n{t['Año'][MEDIDAS].round(2).to_string()}\n\n"
+		f"Clientes de {ciudad}:\n{_tabla(t['NombreCliente'], MEDIDAS)}\n\n"
+		f"Top 5 productos en {ciudad}:\n{_tabla(t['NombreProducto'], MEDIDAS, 5)}"
+	)
+	return _focused_doc(f"ciudad-{_slug(ciudad)}", 'city', text, Ciudad=ciudad)
+
+
+def _doc_categoria(categoria, tot: pd.Series, t: Tablas) -> dict:
+	text = (
+		f"=== CATEGORÍA {categoria} ===\n{_cifras(tot)}\n\n"
+		f"{categoria} por año:\n{t['Año'][MEDIDAS].round(2).to_string()}\n\n"
+		f"Productos de {categoria}:\n{_tabla(t['NombreProducto'], MEDIDAS)}\n\n"
+		f"{categoria} por ciudad:\n{_tabla(t['Ciudad'], MEDIDAS)}"
+	)
+	return _focused_doc(f"categoria-{_slug(categoria)}", 'category', text, Categoria=categoria)
+
+
+# Sección -> (claves de los documentos, documento de una clave, dimensiones que
+# identifican a cada documento, sub-dimensiones de sus tablas). Los agregados
+# se calculan una vez por sección (un roll-up por sub-dimensión sobre todo el
+# cubo), no un roll-up por documento.
+FOCUSED_SECTIONS = {
+	'year': (lambda cube: sorted(cube.values('Año')), _doc_anio, ['Año'], ['Mes', 'Categoria', 'NombreProducto', 'Ciudad']),
+	'month': (lambda cube: list(cube.rollup(['Año', 'Mes']).index), _doc_mes, ['Año', 'Mes'], ['Categoria', 'NombreProducto', 'Ciudad']),
+	'product': (lambda cube: list(cube.rollup(['NombreProducto', 'Categoria']).index), _doc_producto, ['NombreProducto'], ['Año', 'Ciudad', 'NombreCliente']),
+	'client': (lambda cube: list(cube.rollup(['NombreCliente', 'Ciudad']).index), _doc_cliente, ['NombreCliente'], ['Año', 'NombreProducto']),
+	'city': (lambda cube: sorted(cube.values('Ciudad')), _doc_ciudad, ['Ciudad'], ['Año', 'NombreCliente', 'NombreProducto']),
+	'category': (lambda cube: sorted(cube.values('Categoria')), _doc_categoria, ['Categoria'], ['Año', 'NombreProducto', 'Ciudad']),
+}
+
+
+def _section_batches(cube: SalesCube, section: str, keys: List, batch_size: int) -> Iterator[Tuple[str, List]]:
+	"""Lotes de la sección con sus agregados ya recortados: (sección, [(clave, totales, tablas)])."""
+	_, _, dims, subs = FOCUSED_SECTIONS[section]
+	totals = cube.rollup(dims)
+	tables = {sub: cube.rollup(dims + [sub]) for sub in subs}
+	for i in range(0, len(keys), batch_size):
+		batch = []
+		for key in keys[i:i + batch_size]:
+			# Clave del documento en los agregados: (Año, Mes) para los meses; si no, la primera dimensión
+			k = key if len(dims) > 1 or not isinstance(key, tuple) else key[0]
+			batch.append((key, totals.loc[k], {sub: table.loc[k] for sub, table in tables.items()}))
+		yield section, batch
+
+
+def _render_batch(task: Tuple[str, List]) -> List[dict]:
+	section, batch = task
+	render = FOCUSED_SECTIONS[section][1]
+	return [render(key, tot, t) for key, tot, t in batch]
+
+
+def _docs_workers(n_keys: int) -> int:
+	# DOCS_WORKERS: 0 = automático (un proceso por CPU si hay suficientes documentos)
+	workers = int(os.getenv("DOCS_WORKERS", "0"))
+	if workers <= 0:
+		workers = (os.cpu_count() or 1) if n_keys >= int(os.getenv("DOCS_PARALLEL_MIN", "2000")) else 1
+	return workers
+
+
+def iter_focused_documents(cube: SalesCube, workers: Optional[int] = None) -> Iterator[dict]:
+	"""Un documento chico por año, mes, producto, cliente, ciudad y categoría.
+
+	Cada uno lleva en la metadata las dimensiones que describe (p. ej.
+	{"Año": 2023, "Mes": 5}) para poder prefiltrar en la recuperación.
+
+	Los agregados se calculan una vez por sección (un roll-up del cubo por
+	sub-dimensión) y se recortan por clave; las claves se reparten en lotes
+	de `DOCS_BATCH_SIZE` que se arman como texto en un pool de procesos
+	(`DOCS_WORKERS`), que recibe sólo los agregados de cada lote. Los
+	documentos salen en orden a medida que terminan los lotes, con a lo sumo
+	dos lotes por worker en vuelo.
+	"""
+	batch_size = max(1, int(os.getenv("DOCS_BATCH_SIZE", "64")))
+	sections = [(section, keys_of(cube)) for section, (keys_of, _, _, _) in FOCUSED_SECTIONS.items()]
+	tasks = (task for section, keys in sections for task in _section_batches(cube, section, keys, batch_size))
+
+	workers = workers or _docs_workers(sum(len(keys) for _, keys in sections))
+	if workers <= 1:
+		for task in tasks:
+			yield from _render_batch(task)
+		return
+
+	# spawn y no fork: el reindex corre en un hilo del servidor, y hacer fork con
+	# otros hilos vivos (uvicorn, embeddings, FAISS) puede dejar locks tomados en el hijo.
+	# A los workers sólo viajan los agregados de cada lote, no el cubo
+	context = multiprocessing.get_context("spawn")
+	with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+		pending: Deque[Future] = deque()
+		for task in tasks:
+			pending.append(pool.submit(_render_batch, task))
+			if len(pending) >= workers * 2:
+				yield from pending.popleft().result()
+		while pending:
+			yield from pending.popleft().result()
+
+
+def create_focused_documents(cube: SalesCube) -> List[dict]:
+	return list(iter_focused_documents(cube))
+
+
 def row_to_text(row: pd.Series, table_name: str) -> str:
 	# Convierte una fila a texto legible
 	parts = [f"Tabla: {table_name}"]
@@ -97,12 +404,26 @@ def row_to_text(row: pd.Series, table_name: str) -> str:
 	return " | ".join(parts)
 
 
+def _column_text(col: pd.Series) -> pd.Series:
+	# Mismo texto que str(valor) en `row_to_text`
+	if pd.api.types.is_datetime64_any_dtype(col):
+		return col.dt.strftime('%Y-%m-%d %H:%M:%S').fillna('NaT')
+	return col.astype(str)
+
+
+def iter_dataframe_documents(df: pd.DataFrame, table_name: str, batch_size: int = 50000) -> Iterator[dict]:
+	"""Un documento por fila, armando el texto por columnas (sin `iterrows`), por lotes."""
+	for start in range(0, len(df), batch_size):
+		part = df.iloc[start:start + batch_size]
+		text = pd.Series(f"Tabla: {table_name}", index=part.index, dtype=object)
+		for c in part.columns:
+			text = text + f" | {c}: " + _column_text(part[c])
+		for t in text.tolist():
+			yield {"page_content": t, "metadata": {"table": table_name, "type": "detail"}}
+
+
 def dataframe_to_documents(df: pd.DataFrame, table_name: str) -> List[dict]:
-	docs = []
-	for _, r in df.iterrows():
-		text = row_to_text(r, table_name)
-		docs.append({"page_content": text, "metadata": {"table": table_name, "type": "detail"}})
-	return docs
+	return list(iter_dataframe_documents(df, table_name))
 
 
 def chunk_text(text: str, size: int = CHUNK_SIZE):
@@ -110,16 +431,44 @@ def chunk_text(text: str, size: int = CHUNK_SIZE):
 		yield text[i:i+size]
 
 
-def build_documents_from_excel(path: str) -> List[dict]:
-	dfs = read_excel(path)
-	
-	# SOLO crear documentos de resumen - NO documentos individuales
-	# Esto hace que el sistema sea mucho más rápido y preciso
+def iter_documents(dfs: Mapping[str, pd.DataFrame], version: Optional[str] = None) -> Iterator[dict]:
+	# Resumen general + documentos chicos por dimensión (no filas individuales):
+	# el retriever trae sólo los que hablan de lo que se pregunta
 	print("[INFO] Generando documentos de resumen optimizados...")
-	summary_docs = create_summary_documents(dfs)
-	print(f"[INFO] Total de documentos: {len(summary_docs)}")
+	cube = build_cube(dfs, version, get_cube_dir())
+	yield from create_summary_documents(dfs, cube)
+	if cube is not None:
+		yield from iter_focused_documents(cube)
+
+
+def build_documents(dfs: Mapping[str, pd.DataFrame], version: Optional[str] = None) -> List[dict]:
+	docs = list(iter_documents(dfs, version))
+	print(f"[INFO] Total de documentos: {len(docs)}")
 	
-	return summary_docs
+	return docs
+
+
+def build_documents_from_excel(path: str) -> List[dict]:
+	return build_documents(read_dataset(path), dataset_version(path))
+
+
+def sheet_fingerprints(dfs: Mapping[str, pd.DataFrame]) -> Dict[str, str]:
+	"""Huella de cada hoja (columnas + contenido), para detectar cambios."""
+	fingerprints = {}
+	for sheet, df in dfs.items():
+		h = hashlib.sha256("|".join(map(str, df.columns)).encode("utf-8"))
+		h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+		fingerprints[sheet] = h.hexdigest()[:16]
+	return fingerprints
+
+
+def document_id(doc: dict) -> str:
+	# Id estable del documento; si no trae uno en la metadata, se deriva del texto
+	return str(doc.get("metadata", {}).get("id") or document_fingerprint(doc.get("page_content", "")))
+
+
+def document_fingerprint(text: str) -> str:
+	return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,119 @@
+"""Caché columnar del Excel de ventas.
+
+Parsear el .xlsx con openpyxl es lo más lento del pipeline. La primera vez
+cada hoja se convierte a Arrow IPC (Feather v2, sin compresión para poder
+mapearla en memoria) dentro de `DATASET_CACHE_DIR/<hash del Excel>/`; las
+columnas de texto repetitivas se guardan como categóricas. Las cargas
+siguientes leen con memory-map y sólo las columnas pedidas.
+
+El Excel sigue siendo la fuente de verdad: si cambia su hash se genera una
+entrada nueva, y ante cualquier error se vuelve a leer el Excel.
+"""
+
+import json
+import os
+import shutil
+from typing import Dict, List, Mapping, Optional
+
+import pandas as pd
+import pyarrow.feather as feather
+
+
+MANIFEST_FILE = "manifest.json"
+
+# Columnas con pocos valores distintos: como categóricas ocupan mucho menos
+CATEGORICAL_COLUMNS = {"NombreProducto", "Categoria", "Ciudad", "NombreCliente"}
+
+
+def get_cache_dir() -> str:
+    return os.getenv("DATASET_CACHE_DIR", "../dataset_cache")
+
+
+def _sheet_file(sheet: str) -> str:
+    safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in sheet)
+    return f"{safe}.arrow"
+
+
+def _entry_dir(cache_dir: str, version: str) -> str:
+    return os.path.join(cache_dir, version)
+
+
+def _read_manifest(entry: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(entry, MANIFEST_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load_sheets(
+    version: str,
+    columns: Optional[Mapping[str, List[str]]] = None,
+    cache_dir: Optional[str] = None,
+) -> Optional[Dict[str, pd.DataFrame]]:
+    """Lee las hojas cacheadas de `version`; None si no hay caché utilizable.
+
+    `columns` limita las hojas y columnas a leer: {"Ventas": ["IdVenta", ...]}.
+    """
+    entry = _entry_dir(cache_dir or get_cache_dir(), version)
+    manifest = _read_manifest(entry)
+    if manifest is None:
+        return None
+
+    sheets = manifest["sheets"]
+    wanted = list(columns) if columns is not None else list(sheets)
+    dfs = {}
+    try:
+        for sheet in wanted:
+            if sheet not in sheets:
+                continue
+            cols = columns.get(sheet) if columns is not None else None
+            table = feather.read_table(
+                os.path.join(entry, sheets[sheet]), columns=cols, memory_map=True,
+            )
+            dfs[sheet] = table.to_pandas()
+    except Exception as e:
+        print(f"[WARN] Caché columnar ilegible ({str(e)[:100]}); se usa el Excel.")
+        return None
+    return dfs
+
+
+def save_sheets(version: str, dfs: Mapping[str, pd.DataFrame], cache_dir: Optional[str] = None, keep: int = 2) -> bool:
+    """Materializa las hojas en Arrow IPC; devuelve False si no se pudo."""
+    cache_dir = cache_dir or get_cache_dir()
+    entry = _entry_dir(cache_dir, version)
+    tmp = entry + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    try:
+        os.makedirs(tmp)
+        sheets = {}
+        for sheet, df in dfs.items():
+            out = df.copy()
+            for col in out.columns:
+                if col in CATEGORICAL_COLUMNS:
+                    out[col] = out[col].astype("category")
+            name = _sheet_file(sheet)
+            feather.write_feather(out, os.path.join(tmp, name), compression="uncompressed")
+            sheets[sheet] = name
+        with open(os.path.join(tmp, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump({"version": version, "sheets": sheets}, f, ensure_ascii=False)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp, entry)
+    except Exception as e:
+        print(f"[WARN] No se pudo escribir el caché columnar: {str(e)[:100]}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        return False
+
+    _prune(cache_dir, keep, current=version)
+    return True
+
+
+def _prune(cache_dir: str, keep: int, current: str) -> None:
+    # Conservar sólo las `keep` entradas más recientes (incluida la actual)
+    entries = [
+        d for d in os.listdir(cache_dir)
+        if d != current and not d.endswith(".tmp") and os.path.isdir(os.path.join(cache_dir, d))
+    ]
+    entries.sort(key=lambda d: os.path.getmtime(os.path.join(cache_dir, d)), reverse=True)
+    for old in entries[max(keep - 1, 0):]:
+        shutil.rmtree(os.path.join(cache_dir, old), ignore_errors=True)
@@ -0,0 +1,377 @@
+"""Registro de datasets: varios Excel (p. ej. uno por región) en un mismo backend.
+
+Cada dataset tiene su propio índice (un VECTORSTORE_DIR con sus versiones),
+motor de analítica, respuestas canónicas, caché de respuestas y reindex. Las
+cachés del Excel (`DATASET_CACHE_DIR`) y del cubo (`CUBE_DIR`) se indexan por
+el hash de cada archivo, así que cada dataset tiene sus propias entradas.
+
+- `default`: `DATASET_PATH` + `VECTORSTORE_DIR`, como siempre. Se carga al
+  arrancar y nunca se descarga.
+- Los demás se declaran en `DATASETS` (`"norte=../data/norte.xlsx,sur=..."`) o
+  en el JSON de `DATASETS_FILE` (`[{"id", "path", "vectorstore_dir"}]`); su
+  índice va en `DATASETS_INDEX_DIR/<id>` salvo que se indique otro.
+
+Los datasets se cargan la primera vez que una consulta los pide (si todavía
+no tienen índice, se construye en ese momento) y quedan en un LRU. Si hay
+más de `DATASETS_MAX_LOADED` cargados, o la memoria estimada supera
+`DATASETS_MEMORY_MB`, se descarga el menos usado. El LLM y el modelo de
+embeddings son uno solo para todos.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from analytics import SalesAnalytics
+from answer_cache import SemanticAnswerCache
+from canonical_answers import CanonicalAnswers
+from data_loader import dataset_version
+from embedding_service import get_embeddings
+from index_store import DOCS_FILE, INDEX_FILE, is_native_index
+from index_versions import resolve_index_dir
+import metrics
+from rag_pipeline import build_qa, load_vectorstore, make_retriever
+from reindex import IndexWatcher, ReindexManager
+from sessions import parse_date_filters
+from shared_cache import get_backend
+
+
+DEFAULT_DATASET = "default"
+
+_RE_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+def _enabled(name: str, default: str = "true") -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
+
+def _elapsed(start: float) -> float:
+    return round(time.perf_counter() - start, 3)
+
+
+def default_dataset_path() -> str:
+    # Usar la ruta configurada en DATASET_PATH o, por defecto,
+    # el archivo de Excel en la raíz del proyecto.
+    default_path = os.path.join(os.path.dirname(__file__), "..", "TrabajoFinalPowerBI_v2 (1).xlsx")
+    return os.getenv("DATASET_PATH", default_path)
+
+
+@dataclass
+class DatasetConfig:
+    id: str
+    path: str
+    vectorstore_dir: str
+
+
+def parse_datasets() -> Dict[str, DatasetConfig]:
+    """`default` más los datasets de `DATASETS` / `DATASETS_FILE`."""
+    configs = {
+        DEFAULT_DATASET: DatasetConfig(
+            DEFAULT_DATASET, default_dataset_path(), os.getenv("VECTORSTORE_DIR", "../vectorstore")
+        )
+    }
+    index_root = os.getenv("DATASETS_INDEX_DIR", "../vectorstore_datasets")
+
+    entries = []
+    for item in os.getenv("DATASETS", "").split(","):
+        if item.strip():
+            dataset_id, sep, path = item.partition("=")
+            if not sep:
+                raise ValueError(f"DATASETS: se espera 'id=ruta', no '{item.strip()}'")
+            entries.append({"id": dataset_id.strip(), "path": path.strip()})
+    path = os.getenv("DATASETS_FILE", "")
+    if path:
+        with open(path, encoding="utf-8") as f:
+            entries.extend(json.load(f))
+
+    for entry in entries:
+        dataset_id = entry.get("id", "")
+        if not _RE_ID.match(dataset_id) or not entry.get("path"):
+            raise ValueError(f"Dataset inválido: {entry!r} (id con letras, números, '-' o '_', y path)")
+        if dataset_id in configs:
+            raise ValueError(f"Dataset repetido: {dataset_id}")
+        configs[dataset_id] = DatasetConfig(
+            dataset_id, entry["path"], entry.get("vectorstore_dir") or os.path.join(index_root, dataset_id)
+        )
+    return configs
+
+
+def load_canonical(index_dir: str, analytics, data_version: Optional[str], embeddings=None) -> Optional[CanonicalAnswers]:
+    # Las guardadas con el índice; si faltan o son de otro dataset se calculan con la analítica
+    if not _enabled("CANONICAL_ANSWERS_ENABLED"):
+        return None
+    try:
+        return CanonicalAnswers.from_env(index_dir, analytics, data_version, embeddings)
+    except Exception as e:
+        print(f"[WARN] No se pudieron cargar las respuestas canónicas: {str(e)[:200]}")
+        return None
+
+
+class Dataset:
+    """Todo lo que depende de un dataset: RAG + índice, analítica, respuestas canónicas, caché y reindex."""
+
+    def __init__(self, config: DatasetConfig):
+        self.config = config
+        self.id = config.id
+        self.qa = None
+        self.analytics: Optional[SalesAnalytics] = None
+        self.canonical: Optional[CanonicalAnswers] = None
+        self.answer_cache: Optional[SemanticAnswerCache] = None
+        self.reindex_manager: Optional[ReindexManager] = None
+        self.watcher: Optional[IndexWatcher] = None
+        self.timings: Dict[str, float] = {}
+        self.memory_mb = 0.0
+        self.loaded_at = time.time()
+        self.last_used = self.loaded_at
+
+    @classmethod
+    def load(cls, config: DatasetConfig, llm=None, embeddings=None, build_missing: bool = False) -> "Dataset":
+        """Carga índice, analítica y respuestas canónicas; con `build_missing`, construye el índice si no existe."""
+        ds = cls(config)
+        embeddings = embeddings or get_embeddings()
+
+        t = time.perf_counter()
+        if build_missing and not is_native_index(resolve_index_dir(config.vectorstore_dir)):
+            print(f"[INFO] Dataset '{config.id}' sin índice: se construye ahora ({config.path})")
+            # Import diferido: el builder trae el stack de FAISS / LangChain completo
+            from embeddings_builder import build_vectorstore
+
+            build_vectorstore(config.path, config.vectorstore_dir, embeddings=embeddings)
+        ds.qa = build_qa(llm=llm, vectorstore_dir=config.vectorstore_dir)
+        ds.timings["index_seconds"] = _elapsed(t)
+        ds.reindex_manager = ReindexManager(ds.activate_index, active_version=ds.qa.version)
+        # Versiones publicadas por otro worker (o por embeddings_builder.py): se activan solas
+        ds.watcher = IndexWatcher.from_env(
+            config.vectorstore_dir, lambda: ds.qa.version, ds.follow_index, busy=lambda: ds.reindex_manager.running,
+        )
+
+        # Caché semántico de respuestas del LLM, con los mismos embeddings del índice
+        if _enabled("ANSWER_CACHE_ENABLED"):
+            ds.answer_cache = SemanticAnswerCache.from_env(embeddings, get_backend())
+            ds.answer_cache.set_version(ds.data_version())
+
+        # Motor de consultas estructuradas: responde sin LLM las preguntas
+        # numéricas habituales. Si falla, todo sigue yendo por el RAG.
+        t = time.perf_counter()
+        ds.analytics = ds._load_analytics()
+        ds.timings["analytics_seconds"] = _elapsed(t)
+        if ds.answer_cache is not None and ds.analytics is not None:
+            ds.answer_cache.set_entities(ds.analytics.entity_values())
+
+        # Respuestas precalculadas de las preguntas canónicas (ver canonical_answers.py)
+        t = time.perf_counter()
+        ds.canonical = load_canonical(resolve_index_dir(config.vectorstore_dir), ds.analytics, ds.data_version(), embeddings)
+        ds.timings["canonical_seconds"] = _elapsed(t)
+        ds.memory_mb = ds._estimate_memory_mb()
+        ds.watcher.start()
+        return ds
+
+    def _load_analytics(self) -> Optional[SalesAnalytics]:
+        try:
+            return SalesAnalytics.from_excel(self.config.path)
+        except Exception as e:
+            print(f"[WARN] No se pudo inicializar el motor de analítica ({self.id}): {str(e)[:200]}")
+            return None
+
+    def _estimate_memory_mb(self) -> float:
+        # Índice y documentos de la versión activa (lo que queda residente al
+        # usarlos, aunque estén mapeados) más el cubo de la analítica
+        total = 0
+        index_dir = os.path.join(self.config.vectorstore_dir, self.qa.version) if self.qa.version else self.config.vectorstore_dir
+        for name in (INDEX_FILE, DOCS_FILE):
+            try:
+                total += os.path.getsize(os.path.join(index_dir, name))
+            except OSError:
+                pass
+        if self.analytics is not None:
+            total += int(self.analytics.cube.table.memory_usage(deep=True).sum())
+        return round(total / (1024 * 1024), 1)
+
+    def data_version(self) -> Optional[str]:
+        try:
+            return dataset_version(self.config.path)
+        except OSError:
+            return None
+
+    def question_filters(self, text: str) -> dict:
+        # Filtros de la pregunta para reescribir repreguntas; con la analítica
+        # cargada también reconoce productos, clientes, ciudades y categorías
+        if self.analytics is not None:
+            return self.analytics.extract_filters(text)
+        return parse_date_filters(text)
+
+    # ------------------------------------------------------------------
+    # Cambio de versión del índice
+    # ------------------------------------------------------------------
+    def activate_index(self, result) -> None:
+        """Callback del reindex (hilo de fondo): activa el índice y los datos nuevos."""
+        self.switch_index(result.vectorstore, result.version)
+
+    def follow_index(self, version: str) -> None:
+        """Callback de `IndexWatcher`: carga del disco la versión que publicó otro proceso."""
+        vectorstore = load_vectorstore(os.path.join(self.config.vectorstore_dir, version), embeddings=get_embeddings())
+        self.switch_index(vectorstore, version)
+        self.reindex_manager.note_active(version)
+        print(f"[OK] Índice {version} de '{self.id}' activado (publicado por otro proceso)")
+
+    def switch_index(self, vectorstore, version: str) -> None:
+        new_analytics = self._load_analytics() or self.analytics
+        # Las respuestas canónicas que el reindex guardó con la versión nueva
+        new_canonical = load_canonical(
+            os.path.join(self.config.vectorstore_dir, version), new_analytics, self.data_version(), get_embeddings()
+        )
+        self.qa.swap_index(vectorstore, make_retriever(vectorstore, self.qa.k), version)
+        self.analytics = new_analytics
+        self.canonical = new_canonical
+        # Nueva versión del dataset: las respuestas cacheadas dejan de valer
+        if self.answer_cache is not None:
+            if new_analytics is not None:
+                self.answer_cache.set_entities(new_analytics.entity_values())
+            self.answer_cache.set_version(self.data_version())
+        self.memory_mb = self._estimate_memory_mb()
+
+    def start_reindex(self, force: bool = False) -> bool:
+        # Reutilizar el modelo de embeddings ya cargado
+        return self.reindex_manager.start(
+            self.config.path, self.config.vectorstore_dir, embeddings=get_embeddings(), force=force,
+        )
+
+    @property
+    def busy(self) -> bool:
+        return self.reindex_manager is not None and self.reindex_manager.running
+
+    def close(self) -> None:
+        if self.watcher is not None:
+            self.watcher.stop()
+
+    def stats(self) -> dict:
+        return {
+            "id": self.id,
+            "path": self.config.path,
+            "version": self.qa.version if self.qa is not None else None,
+            "memory_mb": self.memory_mb,
+            "loaded_at": self.loaded_at,
+            "last_used": self.last_used,
+            "timings": dict(self.timings),
+        }
+
+
+class DatasetRegistry:
+    """Datasets declarados y LRU de los cargados, con tope de cantidad y de memoria estimada."""
+
+    def __init__(
+        self,
+        configs: Dict[str, DatasetConfig],
+        loader: Callable[[DatasetConfig], Dataset],
+        max_loaded: int = 8,
+        memory_mb: float = 0.0,
+    ):
+        self.configs = configs
+        self._loader = loader
+        self.max_loaded = max(1, max_loaded)
+        self.memory_budget_mb = memory_mb
+        self._lock = threading.Lock()
+        self._loaded: "OrderedDict[str, Dataset]" = OrderedDict()
+        # Un lock por dataset: dos consultas al mismo dataset frío lo cargan una sola vez
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self.loads = 0
+        self.evictions = 0
+        self.failures = 0
+
+    @classmethod
+    def from_env(cls, loader: Callable[[DatasetConfig], Dataset]) -> "DatasetRegistry":
+        return cls(
+            parse_datasets(),
+            loader,
+            max_loaded=int(os.getenv("DATASETS_MAX_LOADED", "8")),
+            memory_mb=float(os.getenv("DATASETS_MEMORY_MB", "0")),
+        )
+
+    def ids(self) -> List[str]:
+        return list(self.configs)
+
+    def _resolve(self, dataset_id: Optional[str]) -> str:
+        dataset_id = dataset_id or DEFAULT_DATASET
+        if dataset_id not in self.configs:
+            raise KeyError(dataset_id)
+        return dataset_id
+
+    def get_loaded(self, dataset_id: Optional[str] = None) -> Optional[Dataset]:
+        """El dataset si ya está cargado (sin cargarlo); KeyError si no existe."""
+        dataset_id = self._resolve(dataset_id)
+        with self._lock:
+            ds = self._loaded.get(dataset_id)
+            if ds is not None:
+                self._loaded.move_to_end(dataset_id)
+                ds.last_used = time.time()
+            return ds
+
+    def get(self, dataset_id: Optional[str] = None) -> Dataset:
+        """El dataset, cargándolo si hace falta (puede tardar); KeyError si no existe."""
+        ds = self.get_loaded(dataset_id)
+        if ds is not None:
+            return ds
+        dataset_id = self._resolve(dataset_id)
+        with self._lock:
+            load_lock = self._load_locks.setdefault(dataset_id, threading.Lock())
+        with load_lock:
+            ds = self.get_loaded(dataset_id)
+            if ds is not None:
+                return ds
+            # Fuera del lock general: los demás datasets siguen respondiendo mientras carga
+            t = time.perf_counter()
+            try:
+                ds = self._loader(self.configs[dataset_id])
+            except Exception:
+                self.failures += 1
+                raise
+            print(f"[OK] Dataset '{dataset_id}' cargado en {_elapsed(t)}s (~{ds.memory_mb} MB)")
+            metrics.DATASET_LOADS.inc(dataset=dataset_id)
+            with self._lock:
+                self._loaded[dataset_id] = ds
+                self.loads += 1
+                evicted = self._evict(keep=dataset_id)
+                metrics.DATASETS_LOADED.inc(1 - len(evicted))
+        for old in evicted:
+            old.close()
+            metrics.DATASET_EVICTIONS.inc()
+            print(f"[INFO] Dataset '{old.id}' descargado (LRU)")
+        return ds
+
+    def _memory_mb(self) -> float:
+        return sum(ds.memory_mb for ds in self._loaded.values())
+
+    def _evict(self, keep: str) -> List[Dataset]:
+        # Con self._lock tomado. `default`, el recién cargado y los que están
+        # reindexando no se descargan.
+        evicted = []
+        while len(self._loaded) > self.max_loaded or (
+            self.memory_budget_mb > 0 and self._memory_mb() > self.memory_budget_mb
+        ):
+            victim = next(
+                (i for i, ds in self._loaded.items() if i not in (keep, DEFAULT_DATASET) and not ds.busy), None
+            )
+            if victim is None:
+                break
+            evicted.append(self._loaded.pop(victim))
+            self.evictions += 1
+        return evicted
+
+    def stats(self) -> dict:
+        with self._lock:
+            loaded = [ds.stats() for ds in self._loaded.values()]
+            return {
+                "datasets": self.ids(),
+                "loaded": loaded,
+                "max_loaded": self.max_loaded,
+                "memory_budget_mb": self.memory_budget_mb,
+                "memory_mb": round(self._memory_mb(), 1),
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "failures": self.failures,
+            }
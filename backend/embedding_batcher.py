@@ -0,0 +1,212 @@
+"""Micro-batching de embeddings de consultas.
+
+Con carga concurrente cada `/query` embebía su pregunta por separado: muchas
+pasadas chicas del sentence-transformer en CPU. `MicroBatchEmbedder` se pone
+delante del modelo:
+
+- `embed_query` primero busca en un LRU pregunta -> vector.
+- Si no está, encola la pregunta y espera. Un hilo despachador junta las
+  preguntas que llegan durante `window_ms` (o hasta `max_batch`), las embebe
+  en una sola llamada batched y devuelve cada vector a quien lo pidió.
+- `embed_queries` embebe de una vez las preguntas de `/query/batch`.
+- `embed_documents` (construcción del índice) va directo al modelo: ya es
+  batched.
+
+Con un backend compartido (`shared_cache.py`) el LRU es de dos niveles: lo
+que no está en memoria se busca en el backend, así un worker reutiliza los
+vectores que calculó otro.
+
+Agrupar con `embed_documents` es válido para modelos simétricos como
+all-MiniLM-L6-v2, donde `embed_query(t) == embed_documents([t])[0]`.
+"""
+
+import base64
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class MicroBatchEmbedder(Embeddings):
+    def __init__(self, base: Embeddings, window_ms: float = 5.0, max_batch: int = 32, cache_size: int = 1024,
+                 shared=None, namespace: str = "embeddings"):
+        self.base = base
+        self.window = max(0.0, window_ms) / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.cache_size = cache_size
+        # Backend compartido entre workers; `namespace` separa modelos distintos
+        self.shared = shared
+        self.namespace = namespace
+
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+        self._pending: List[Tuple[str, Future]] = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+        self.requests = 0
+        self.cache_hits = 0
+        self.batches = 0
+        self.batched_items = 0
+        self.max_seen_batch = 0
+        self.shared_hits = 0
+
+    @classmethod
+    def from_env(cls, base: Embeddings, shared=None, namespace: str = "embeddings") -> "MicroBatchEmbedder":
+        return cls(
+            base,
+            window_ms=float(os.getenv("EMBED_BATCH_WINDOW_MS", "5")),
+            max_batch=int(os.getenv("EMBED_BATCH_MAX", "32")),
+            cache_size=int(os.getenv("EMBED_CACHE_SIZE", "1024")),
+            shared=shared,
+            namespace=namespace,
+        )
+
+    # ------------------------------------------------------------------
+    # Interfaz Embeddings
+    # ------------------------------------------------------------------
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.base.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        self.requests += 1
+        cached = self._cache_get(text)
+        if cached is not None:
+            self.cache_hits += 1
+            return cached
+
+        if self.window <= 0 or self.max_batch <= 1:
+            vector = self.base.embed_query(text)
+        else:
+            vector = self._submit(text).result()
+        self._cache_put(text, vector)
+        return vector
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Varias preguntas en una sola pasada del modelo; las que están en el LRU no se recalculan."""
+        self.requests += len(texts)
+        vectors = {}
+        missing = []
+        for text in dict.fromkeys(texts):
+            cached = self._cache_get(text)
+            if cached is None:
+                missing.append(text)
+            else:
+                vectors[text] = cached
+        self.cache_hits += sum(1 for text in texts if text in vectors)
+        if missing:
+            for text, vector in zip(missing, self.base.embed_documents(missing)):
+                vectors[text] = vector
+                self._cache_put(text, vector)
+            self.batches += 1
+            self.batched_items += len(missing)
+            self.max_seen_batch = max(self.max_seen_batch, len(missing))
+        return [vectors[text] for text in texts]
+
+    # ------------------------------------------------------------------
+    # LRU
+    # ------------------------------------------------------------------
+    def _cache_get(self, text: str) -> Optional[List[float]]:
+        if self.cache_size <= 0:
+            return None
+        with self._cache_lock:
+            vector = self._cache.get(text)
+            if vector is not None:
+                self._cache.move_to_end(text)
+                return vector
+        if self.shared is None:
+            return None
+        try:
+            found = self.shared.get(self.namespace, text)
+        except Exception as e:
+            print(f"[WARN] Caché compartido de embeddings no disponible: {str(e)[:100]}")
+            return None
+        if found is None:
+            return None
+        vector = np.frombuffer(base64.b64decode(found[0]), dtype=np.float32).tolist()
+        self.shared_hits += 1
+        self._cache_put(text, vector, share=False)
+        return vector
+
+    def _cache_put(self, text: str, vector: List[float], share: bool = True) -> None:
+        if self.cache_size <= 0:
+            return
+        with self._cache_lock:
+            self._cache[text] = vector
+            self._cache.move_to_end(text)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        if share and self.shared is not None:
+            value = base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+            try:
+                self.shared.put(self.namespace, text, value, max_entries=self.cache_size)
+            except Exception as e:
+                print(f"[WARN] Caché compartido de embeddings no disponible: {str(e)[:100]}")
+
+    # ------------------------------------------------------------------
+    # Despachador
+    # ------------------------------------------------------------------
+    def _submit(self, text: str) -> Future:
+        future: Future = Future()
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="embed-batcher", daemon=True)
+                self._thread.start()
+            self._pending.append((text, future))
+            self._cond.notify()
+        return future
+
+    def _next_batch(self) -> List[Tuple[str, Future]]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            # Llegó la primera: esperar la ventana (o a llenar el batch)
+            deadline = time.monotonic() + self.window
+            while len(self._pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._next_batch()
+            # La misma pregunta repetida dentro del batch se embebe una vez
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                vectors = dict(zip(texts, self.base.embed_documents(texts)))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.batched_items += len(batch)
+            self.max_seen_batch = max(self.max_seen_batch, len(batch))
+            for text, future in batch:
+                future.set_result(vectors[text])
+
+    def stats(self) -> dict:
+        with self._cache_lock:
+            cached = len(self._cache)
+        return {
+            "window_ms": self.window * 1000.0,
+            "max_batch": self.max_batch,
+            "requests": self.requests,
+            "cache_entries": cached,
+            "cache_size": self.cache_size,
+            "cache_hits": self.cache_hits,
+            "shared": self.shared.name if self.shared is not None else None,
+            "shared_hits": self.shared_hits,
+            "batches": self.batches,
+            "avg_batch_size": round(self.batched_items / self.batches, 2) if self.batches else 0.0,
+            "max_batch_seen": self.max_seen_batch,
+        }
@@ -0,0 +1,117 @@
+"""Modelo de embeddings único para todo el proceso.
+
+Antes cada consumidor (carga del índice, builder, caché semántico) armaba su
+propio `HuggingFaceEmbeddings`, y cada uno pagaba la carga de torch y del
+modelo. Acá se carga una sola vez, de forma perezosa y thread-safe, y todos
+usan la misma instancia.
+
+- `EMBEDDING_MODEL`: modelo de sentence-transformers (por defecto all-MiniLM-L6-v2;
+  si se cambia hay que reindexar).
+- `EMBEDDING_BACKEND`: `torch` (por defecto), `onnx` u `openvino`. ONNX en CPU
+  suele ser bastante más rápido; requiere `optimum[onnxruntime]`.
+- `EMBEDDING_ONNX_FILE`: archivo ONNX dentro del repo del modelo, p. ej. una
+  variante cuantizada como `onnx/model_qint8_avx2.onnx`.
+- `EMBEDDING_DEVICE`: `cpu`, `cuda`... (vacío = lo que elija sentence-transformers).
+
+Si el backend pedido no se puede cargar, se cae a torch con un aviso.
+
+La instancia compartida va envuelta en un `MicroBatchEmbedder`: las consultas
+concurrentes se embeben juntas y las repetidas salen de un LRU
+(`EMBED_BATCH_WINDOW_MS`, `EMBED_BATCH_MAX`, `EMBED_CACHE_SIZE`). Con varios
+workers ese LRU se comparte por el backend de `shared_cache.py`.
+"""
+
+import os
+import threading
+import time
+from typing import Optional
+
+from embedding_batcher import MicroBatchEmbedder
+from shared_cache import get_backend
+
+
+DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+_lock = threading.Lock()
+_embeddings = None
+_info = {"model": None, "backend": None, "load_seconds": None, "warmup_seconds": None}
+
+
+def _model_kwargs(backend: str) -> dict:
+    kwargs = {}
+    device = os.getenv("EMBEDDING_DEVICE", "")
+    if device:
+        kwargs["device"] = device
+    if backend != "torch":
+        kwargs["backend"] = backend
+        file_name = os.getenv("EMBEDDING_ONNX_FILE", "")
+        if file_name:
+            kwargs["model_kwargs"] = {"file_name": file_name}
+    return kwargs
+
+
+def embedding_model_name() -> str:
+    return os.getenv("EMBEDDING_MODEL", DEFAULT_MODEL)
+
+
+def load_embeddings(model_name: Optional[str] = None, backend: Optional[str] = None):
+    """Crea una instancia nueva (sin compartir). Normalmente usar `get_embeddings`."""
+    # Import diferido: trae torch / sentence-transformers, que tardan en cargar
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    model_name = model_name or embedding_model_name()
+    backend = (backend or os.getenv("EMBEDDING_BACKEND", "torch")).lower()
+
+    start = time.perf_counter()
+    try:
+        embeddings = HuggingFaceEmbeddings(model_name=model_name, model_kwargs=_model_kwargs(backend))
+    except Exception as e:
+        if backend == "torch":
+            raise
+        print(f"[WARN] Backend de embeddings '{backend}' no disponible ({str(e)[:100]}); se usa torch.")
+        backend = "torch"
+        embeddings = HuggingFaceEmbeddings(model_name=model_name, model_kwargs=_model_kwargs(backend))
+
+    _info.update(model=model_name, backend=backend, load_seconds=round(time.perf_counter() - start, 3))
+    print(f"[INFO] Embeddings cargados: {model_name} ({backend}) en {_info['load_seconds']}s")
+    return embeddings
+
+
+def get_embeddings():
+    """Instancia compartida (con micro-batching); la primera llamada carga el modelo."""
+    global _embeddings
+    if _embeddings is None:
+        with _lock:
+            if _embeddings is None:
+                base = load_embeddings()
+                _embeddings = MicroBatchEmbedder.from_env(base, get_backend(), f"emb:{_info['model']}")
+    return _embeddings
+
+
+def use_embeddings(base) -> None:
+    """Reemplaza el modelo compartido (p. ej. uno simulado para correr benchmark.py sin red)."""
+    global _embeddings
+    with _lock:
+        _info.update(model=type(base).__name__, backend="custom", load_seconds=0.0)
+        _embeddings = MicroBatchEmbedder.from_env(base, get_backend(), f"emb:{_info['model']}")
+
+
+def is_loaded() -> bool:
+    return _embeddings is not None
+
+
+def warm_up(embeddings=None) -> float:
+    """Corre una inferencia para que la primera consulta no pague la inicialización."""
+    embeddings = embeddings or get_embeddings()
+    start = time.perf_counter()
+    embeddings.embed_query("¿Cuántas ventas hubo en 2023?")
+    seconds = round(time.perf_counter() - start, 3)
+    _info["warmup_seconds"] = seconds
+    return seconds
+
+
+def info() -> dict:
+    out = dict(_info, loaded=is_loaded())
+    if isinstance(_embeddings, MicroBatchEmbedder):
+        out["batching"] = _embeddings.stats()
+    return out
@@ -1,56 +1,278 @@
+import json
 import os
+import shutil
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import faiss
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
-from data_loader import build_documents_from_excel
+from data_loader import (
+    dataset_version,
+    document_fingerprint,
+    document_id,
+    iter_documents,
+    read_dataset,
+    sheet_fingerprints,
+)
 from dotenv import load_dotenv
-from langchain_core.documents import Document
+from embedding_service import embedding_model_name, get_embeddings
+from index_pipeline import EmbedPipeline
+from index_store import ReadOnlyIndexError, load_index, save_index
+import ann_index
+from canonical_answers import precompute as precompute_canonical
+from index_versions import (
+    activate_version,
+    new_version_name,
+    prune_versions,
+    read_current_version,
+)
 
 load_dotenv()
 
+# Huellas del dataset, de cada hoja y de cada documento, guardadas con el índice
+FINGERPRINTS_FILE = "fingerprints.json"
 
-def build_vectorstore():
-    dataset_path = os.getenv("DATASET_PATH", "dataset.xlsx")
-    output_dir = os.getenv("VECTORSTORE_DIR", "./vectorstore")
+ProgressFn = Callable[[str, float], None]
+
+
+def _no_progress(stage: str, fraction: float) -> None:
+    pass
 
-    print(f"[INFO] Cargando dataset desde: {dataset_path}")
-    print(f"[INFO] Guardando vectorstore en: {output_dir}")
 
+def find_dataset(dataset_path: str) -> str:
     # Si el archivo no existe en la ruta indicada, intentar búsqueda automática
-    if not os.path.exists(dataset_path):
-        print(f"[WARN] Dataset no encontrado en '{dataset_path}'. Buscando archivos .xlsx/.xls en el proyecto...")
-        found = None
-        for root, _, files in os.walk("."):
-            for fname in files:
-                if fname.lower().endswith((".xlsx", ".xls")):
-                    found = os.path.join(root, fname)
-                    break
-            if found:
-                break
+    if os.path.exists(dataset_path):
+        return dataset_path
 
+    print(f"[WARN] Dataset no encontrado en '{dataset_path}'. Buscando archivos .xlsx/.xls en el proyecto...")
+    found = None
+    for root, _, files in os.walk("."):
+        for fname in files:
+            if fname.lower().endswith((".xlsx", ".xls")):
+                found = os.path.join(root, fname)
+                break
         if found:
-            dataset_path = found
-            print(f"[INFO] Usando dataset encontrado: {dataset_path}")
-        else:
-            raise FileNotFoundError(
-                f"Dataset no encontrado. Poner el archivo .xlsx en el proyecto o fijar la variable de entorno DATASET_PATH. Buscadas: '{os.getcwd()}'"
+            break
+
+    if found:
+        print(f"[INFO] Usando dataset encontrado: {found}")
+        return found
+    raise FileNotFoundError(
+        f"Dataset no encontrado. Poner el archivo .xlsx en el proyecto o fijar la variable de entorno DATASET_PATH. Buscadas: '{os.getcwd()}'"
+    )
+
+
+@dataclass
+class BuildResult:
+    vectorstore: object
+    version: str
+    docs_total: int
+    added: int = 0
+    updated: int = 0
+    removed: int = 0
+    skipped: bool = False
+    ann: Optional[dict] = None
+    pipeline: Optional[dict] = None     # throughput y memoria del pipeline de embeddings
+
+
+def read_fingerprints(index_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(index_dir, FINGERPRINTS_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_fingerprints(index_dir: str, fingerprints: dict) -> None:
+    with open(os.path.join(index_dir, FINGERPRINTS_FILE), "w", encoding="utf-8") as f:
+        json.dump(fingerprints, f, ensure_ascii=False, indent=1)
+
+
+def _empty_vectorstore(embeddings, dimension: int) -> FAISS:
+    # Mismo tipo de índice y métrica que `FAISS.from_documents`
+    return FAISS(embeddings, faiss.IndexFlatL2(dimension), InMemoryDocstore(), {})
+
+
+def _load_previous(index_dir: str, embeddings):
+    # Se carga entero en memoria (no mmap) porque se va a modificar
+    vectorstore = load_index(index_dir, embeddings, model=embedding_model_name(), in_memory=True)
+    if not isinstance(vectorstore.docstore, InMemoryDocstore):
+        raise ReadOnlyIndexError("El índice anterior no quedó en memoria; no se puede actualizar")
+    # Las actualizaciones se hacen sobre un índice plano (exacto); el ANN se rehace al guardar
+    vectorstore.index = ann_index.to_flat(vectorstore.index)
+    return vectorstore
+
+
+def build_vectorstore(
+    dataset_path: Optional[str] = None,
+    output_dir: Optional[str] = None,
+    embeddings=None,
+    progress: Optional[ProgressFn] = None,
+    activate: bool = True,
+    force: bool = False,
+) -> BuildResult:
+    """Genera los documentos y el índice FAISS en un directorio versionado.
+
+    El índice se escribe en `output_dir/<versión>/` y, si `activate` es True,
+    se apunta `output_dir/CURRENT` a esa versión.
+
+    Salvo con `force`, la reconstrucción es incremental: junto al índice se
+    guardan huellas del archivo, de cada hoja y de cada documento. Si nada
+    cambió no se genera versión nueva (`skipped`); si cambió algo, se parte
+    del índice activo y sólo se re-embeben los documentos nuevos o
+    modificados y se quitan los que ya no existen.
+
+    Los documentos no se juntan en memoria: van del generador de
+    `data_loader` al índice por lotes (`index_pipeline.EmbedPipeline`).
+    """
+    dataset_path = dataset_path or os.getenv("DATASET_PATH", "dataset.xlsx")
+    output_dir = output_dir or os.getenv("VECTORSTORE_DIR", "./vectorstore")
+    progress = progress or _no_progress
+
+    print(f"[INFO] Cargando dataset desde: {dataset_path}")
+    print(f"[INFO] Guardando vectorstore en: {output_dir}")
+
+    dataset_path = find_dataset(dataset_path)
+    data_version = dataset_version(dataset_path)
+
+    current = read_current_version(output_dir)
+    previous_dir = os.path.join(output_dir, current) if current else None
+    previous = None if force or previous_dir is None else read_fingerprints(previous_dir)
+
+    # Mismo archivo byte a byte: ni siquiera hace falta parsear el Excel
+    if previous is not None and previous.get("dataset") == data_version:
+        print(f"[OK] Sin cambios en el dataset; se mantiene la versión {current}.")
+        progress("sin cambios", 1.0)
+        return BuildResult(None, current, len(previous.get("documents", {})), skipped=True)
+
+    progress("leyendo datos", 0.05)
+    dfs = read_dataset(dataset_path)
+    sheets = sheet_fingerprints(dfs)
+    if previous is not None and previous.get("sheets") == sheets:
+        print(f"[OK] Las hojas no cambiaron; se mantiene la versión {current}.")
+        progress("sin cambios", 1.0)
+        return BuildResult(None, current, len(previous.get("documents", {})), skipped=True)
+
+    progress("cargando modelo de embeddings", 0.1)
+    if embeddings is None:
+        embeddings = get_embeddings()
+
+    vectorstore = None
+    old_prints: Dict[str, str] = {}
+    if previous is not None and previous.get("documents"):
+        try:
+            vectorstore = _load_previous(previous_dir, embeddings)
+            old_prints = previous["documents"]
+        except Exception as e:
+            print(f"[WARN] No se pudo cargar el índice anterior ({str(e)[:100]}); reconstrucción completa.")
+    incremental = vectorstore is not None
+    # Se parte de los ids que realmente tiene el índice (no sólo de las huellas)
+    existing = set(vectorstore.index_to_docstore_id.values()) if incremental else set()
+
+    result = BuildResult(None, "", 0)
+    doc_prints: Dict[str, str] = {}
+
+    def changed_documents():
+        # Los documentos salen del generador de data_loader de a uno; sólo se
+        # retienen id y huella. Los que no cambiaron no se vuelven a embeber.
+        for d in iter_documents(dfs, data_version):
+            doc_id = document_id(d)
+            text = d.get("page_content", "")
+            doc_prints[doc_id] = document_fingerprint(text)
+            if doc_id in existing and old_prints.get(doc_id) == doc_prints[doc_id]:
+                continue
+            yield doc_id, text, d.get("metadata", {})
+
+    # Documentos modificados: se guardan hasta el final para borrar sus versiones
+    # viejas en un solo `delete` (cada uno recorre todo el índice FAISS)
+    modified: List[Tuple[str, str, dict, List[float]]] = []
+
+    def add_batch(ids, texts, metadatas, vectors):
+        nonlocal vectorstore
+        if vectorstore is None:
+            vectorstore = _empty_vectorstore(embeddings, len(vectors[0]))
+        new = [j for j, i in enumerate(ids) if i not in existing]
+        modified.extend((ids[j], texts[j], metadatas[j], vectors[j]) for j in range(len(ids)) if ids[j] in existing)
+        if new:
+            vectorstore.add_embeddings(
+                [(texts[j], vectors[j]) for j in new], metadatas=[metadatas[j] for j in new], ids=[ids[j] for j in new]
             )
+        existing.update(ids)
+        updated = sum(1 for i in ids if i in old_prints)
+        result.updated += updated
+        result.added += len(ids) - updated
+
+    def on_progress(docs_done: int) -> None:
+        # Sin el total de antemano: se estima con la versión anterior
+        expected = max(len(old_prints), docs_done, 1)
+        progress(f"calculando embeddings ({docs_done} documentos)", 0.15 + 0.6 * min(1.0, docs_done / expected))
 
-    docs = build_documents_from_excel(dataset_path)
-    print(f"[INFO] Documentos generados: {len(docs)}")
+    progress("generando documentos y embeddings", 0.15)
+    pipeline = EmbedPipeline.from_env(embeddings)
+    stats = pipeline.run(changed_documents(), add_batch, on_progress)
 
-    # convertir dicts a Document de LangChain
-    lc_docs = [Document(page_content=d.get("page_content", ""), metadata=d.get("metadata", {})) for d in docs]
+    if vectorstore is None:
+        raise ValueError("No se generaron documentos a partir del dataset")
+    gone = [i for i in existing if i not in doc_prints]
+    if gone or modified:
+        vectorstore.delete(gone + [m[0] for m in modified])
+    if modified:
+        ids, texts, metadatas, vectors = zip(*modified)
+        vectorstore.add_embeddings(list(zip(texts, vectors)), metadatas=list(metadatas), ids=list(ids))
+    result.removed = len(gone)
+    result.docs_total = len(doc_prints)
+    result.pipeline = stats.report()
+    print(f"[INFO] Documentos generados: {len(doc_prints)}")
+    if incremental:
+        print(f"[INFO] Incremental: {result.added} nuevos, {result.updated} modificados, {result.removed} eliminados, "
+              f"{len(doc_prints) - result.added - result.updated} sin cambios")
+    print(f"[INFO] Embeddings: {stats.docs} documentos en {stats.seconds:.1f}s ({stats.docs_per_second} docs/s, "
+          f"{pipeline.workers} workers, lotes de {pipeline.batch_size})"
+          + (f", RSS pico del proceso {stats.process_peak_rss_mb} MB (+{stats.rss_growth_mb} MB en este build)"
+             if stats.rss_growth_mb is not None else ""))
 
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    # Índice aproximado (HNSW / IVF-PQ) si el corpus es grande, con recall medido
+    progress("construyendo índice ANN", 0.8)
+    ann = ann_index.build_ann(vectorstore.index)
+    result.ann = ann.report()
 
-    # Crear FAISS correctamente a partir de Documents
-    vectorstore = FAISS.from_documents(lc_docs, embeddings)
+    # Guardar en un directorio nuevo: el índice activo no se toca hasta el final
+    progress("guardando índice", 0.9)
+    os.makedirs(output_dir, exist_ok=True)
+    version = new_version_name(output_dir, data_version)
+    version_dir = os.path.join(output_dir, version)
+    tmp_dir = version_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    try:
+        save_index(vectorstore, tmp_dir, dataset=data_version, model=embedding_model_name(),
+                   index=ann.index, extra={"ann": result.ann})
+        _write_fingerprints(tmp_dir, {"dataset": data_version, "sheets": sheets, "documents": doc_prints})
+        # Respuestas de las preguntas canónicas, guardadas con la versión del índice
+        progress("precalculando respuestas canónicas", 0.95)
+        try:
+            precompute_canonical(dataset_path, tmp_dir, data_version)
+        except Exception as e:
+            print(f"[WARN] No se pudieron precalcular las respuestas canónicas: {str(e)[:200]}")
+        os.replace(tmp_dir, version_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
 
-    # Guardar FAISS correctamente
-    vectorstore.save_local(output_dir)
+    if activate:
+        activate_version(output_dir, version)
+        prune_versions(output_dir, int(os.getenv("VECTORSTORE_KEEP_VERSIONS", "3")))
 
-    print("[OK] Vectorstore generado correctamente.")
+    progress("listo", 1.0)
+    print(f"[OK] Vectorstore generado correctamente (versión {version}).")
+    # Lo que se activa en caliente debe buscar igual que lo que se carga del disco
+    vectorstore.index = ann.index
+    ann_index.configure(vectorstore.index, ann.search_params)
+    result.vectorstore = vectorstore
+    result.version = version
+    return result
 
 
 if __name__ == "__main__":
-    build_vectorstore()
+    import sys
+    # --force: ignorar las huellas y reconstruir todo
+    build_vectorstore(force="--force" in sys.argv[1:])
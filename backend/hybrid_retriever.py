@@ -0,0 +1,378 @@
+"""Recuperación híbrida: índice léxico BM25 + vectores FAISS, fusionados por RRF.
+
+- BM25: índice invertido en arrays de numpy (CSR). El peso BM25 de cada
+  posting se precalcula al construir, así que buscar es sólo sumar los
+  postings de los términos de la pregunta.
+- Vectores: el índice FAISS del vectorstore, consultado por posición.
+- Fusión: Reciprocal Rank Fusion, 1 / (rrf_k + rank) sumado en las listas;
+  no hace falta que las escalas de puntaje sean comparables. Con filtros se
+  suma una tercera lista: los documentos cuya metadata coincide con ellos.
+- Prefiltro por metadata (p. ej. {"Año": [2023]}): máscara booleana por
+  documento que se aplica antes de rankear, en BM25 y en FAISS. Un documento
+  que no tiene el campo no queda excluido (el resumen general aplica a
+  cualquier año). Si no se pasan filtros, se infieren de la pregunta con el
+  vocabulario de la propia metadata (años, meses, productos, ciudades...).
+
+Ambos índices comparten la posición del documento en el índice FAISS, por lo
+que la fusión es sobre enteros y no hay que cruzar ids.
+"""
+
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence
+
+import numpy as np
+
+from text_utils import MESES, normalize, tokenize
+
+
+# Campos de la metadata que se pueden usar como prefiltro
+FILTER_FIELDS = ("Año", "Mes", "Categoria", "NombreProducto", "Ciudad", "NombreCliente")
+
+_RE_ANO = re.compile(r"\b(20\d{2})\b")
+
+Filters = Mapping[str, Sequence]
+
+
+def _top(scores: np.ndarray, candidates: np.ndarray, n: int) -> np.ndarray:
+    """Posiciones de `candidates` con mayor puntaje, ordenadas (argpartition + sort)."""
+    if len(candidates) > n:
+        part = np.argpartition(-scores[candidates], n - 1)[:n]
+        candidates = candidates[part]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class BM25Index:
+    def __init__(self, texts: Iterable[str], k1: float = 1.5, b: float = 0.75):
+        vocab: Dict[str, int] = {}
+        term_ids: List[int] = []
+        doc_ids: List[int] = []
+        tfs: List[int] = []
+        lengths: List[int] = []
+        for doc, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                doc_ids.append(doc)
+                tfs.append(tf)
+
+        self.vocab = vocab
+        self.n_docs = len(lengths)
+        doc_len = np.asarray(lengths, dtype=np.float32)
+        avgdl = float(doc_len.mean()) if self.n_docs else 1.0
+
+        terms = np.asarray(term_ids, dtype=np.int64)
+        docs = np.asarray(doc_ids, dtype=np.int32)
+        tf = np.asarray(tfs, dtype=np.float32)
+        order = np.argsort(terms, kind="stable")
+        terms, docs, tf = terms[order], docs[order], tf[order]
+
+        # CSR: los postings del término t están en [indptr[t], indptr[t+1])
+        df = np.bincount(terms, minlength=len(vocab))
+        self._indptr = np.concatenate([[0], np.cumsum(df)])
+        self._docs = docs
+        idf = np.log1p((self.n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = k1 * (1 - b + b * doc_len[docs] / max(avgdl, 1e-9))
+        self._weights = idf[terms] * tf * (k1 + 1) / (tf + norm)
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            t = self.vocab.get(term)
+            if t is None:
+                continue
+            start, end = self._indptr[t], self._indptr[t + 1]
+            # Un término aparece una sola vez por documento: índices únicos
+            scores[self._docs[start:end]] += self._weights[start:end]
+        return scores
+
+    def search(self, query: str, n: int, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        return self.top(self.scores(query), n, mask)
+
+    @staticmethod
+    def top(scores: np.ndarray, n: int, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        hit = scores > 0
+        if mask is not None:
+            hit &= mask
+        return _top(scores, np.flatnonzero(hit), n)
+
+
+class MetadataIndex:
+    """Posiciones de documentos por (campo, valor) para armar máscaras de filtro."""
+
+    def __init__(self, metadatas: Sequence[Mapping], fields: Sequence[str] = FILTER_FIELDS):
+        self.n_docs = len(metadatas)
+        self._present: Dict[str, np.ndarray] = {}
+        self._values: Dict[str, Dict[object, np.ndarray]] = {}
+        for name in fields:
+            present = np.zeros(self.n_docs, dtype=bool)
+            groups: Dict[object, List[int]] = {}
+            for i, metadata in enumerate(metadatas):
+                if name in metadata and metadata[name] is not None:
+                    present[i] = True
+                    groups.setdefault(metadata[name], []).append(i)
+            if groups:
+                self._present[name] = present
+                self._values[name] = {v: np.asarray(ix, dtype=np.int64) for v, ix in groups.items()}
+
+        # Vocabulario para inferir filtros: valor normalizado -> (campo, valor),
+        # más largos primero ("ciudad del este" antes que coincidencias parciales)
+        self._vocab = sorted(
+            ((normalize(str(v)), name, v) for name, groups in self._values.items()
+             if name not in ("Año", "Mes") for v in groups),
+            key=lambda t: len(t[0]), reverse=True,
+        )
+
+    def mask(self, filters: Optional[Filters]) -> Optional[np.ndarray]:
+        """Máscara de documentos que cumplen `filters` (None = sin restricción)."""
+        if not filters:
+            return None
+        mask = np.ones(self.n_docs, dtype=bool)
+        for name, values in filters.items():
+            if name not in self._values:
+                continue
+            allowed = ~self._present[name]
+            for value in values:
+                ix = self._values[name].get(value)
+                if ix is not None:
+                    allowed[ix] = True
+            mask &= allowed
+        return mask
+
+    def matches(self, filters: Optional[Filters]) -> np.ndarray:
+        """Cantidad de campos de `filters` que cada documento cumple explícitamente."""
+        counts = np.zeros(self.n_docs, dtype=np.float32)
+        for name, values in (filters or {}).items():
+            for value in values:
+                ix = self._values.get(name, {}).get(value)
+                if ix is not None:
+                    counts[ix] += 1
+        return counts
+
+    def infer_filters(self, query: str) -> Dict[str, List]:
+        text = normalize(query)
+        filters: Dict[str, List] = {}
+        anios = [int(a) for a in _RE_ANO.findall(text) if int(a) in self._values.get("Año", {})]
+        if anios:
+            filters["Año"] = anios
+        meses = [num for nombre, num in MESES.items() if re.search(rf"\b{nombre}\b", text)]
+        if meses and "Mes" in self._values:
+            filters["Mes"] = meses
+        for norm, name, value in self._vocab:
+            if re.search(rf"\b{re.escape(norm)}\b", text):
+                filters.setdefault(name, []).append(value)
+                text = text.replace(norm, " ")
+        return filters
+
+
+def _iter_documents(vectorstore):
+    docstore = vectorstore.docstore
+    if hasattr(docstore, "iter_documents"):
+        # Docstore en SQLite: lectura secuencial con cursor
+        for _, doc in docstore.iter_documents():
+            yield doc
+        return
+    mapping = vectorstore.index_to_docstore_id
+    for i in range(len(mapping)):
+        yield docstore.search(mapping[i])
+
+
+@dataclass
+class ScoredDocument:
+    document: object
+    score: Optional[float]              # ver `score_kind`
+    position: Optional[int]             # posición en el índice FAISS (None = desconocida)
+    bm25_rank: Optional[int] = None     # 1 = mejor; None = no apareció
+    vector_rank: Optional[int] = None
+    metadata_rank: Optional[int] = None
+    # rrf: fusión del retriever híbrido (mayor = mejor); distance: distancia de
+    # FAISS (menor = mejor); vectorstore: lo que informe otro vectorstore
+    score_kind: Optional[str] = "rrf"
+
+
+def document_at(vectorstore, position: int):
+    """Documento en la posición `position` del índice FAISS."""
+    docstore = vectorstore.docstore
+    if hasattr(docstore, "by_position"):
+        return docstore.by_position(position)
+    return docstore.search(vectorstore.index_to_docstore_id[position])
+
+
+def embed_query(vectorstore, query: str) -> np.ndarray:
+    """Vector (1 x d) de la pregunta, normalizado si el índice lo espera."""
+    embeddings = vectorstore.embeddings
+    if embeddings is not None:
+        vec = embeddings.embed_query(query)
+    else:
+        vec = vectorstore.embedding_function(query)
+    vec = np.asarray([vec], dtype=np.float32)
+    if getattr(vectorstore, "_normalize_L2", False):
+        vec /= np.linalg.norm(vec, axis=1, keepdims=True)
+    return vec
+
+
+class HybridRetriever:
+    """Retriever con la interfaz que usa `SimpleRAG` (`get_relevant_documents`)."""
+
+    def __init__(
+        self,
+        vectorstore,
+        k: int = 4,
+        fetch_k: int = 50,
+        rrf_k: int = 60,
+        infer_filters: bool = True,
+    ):
+        self.vectorstore = vectorstore
+        self.k = k
+        self.fetch_k = fetch_k
+        self.rrf_k = rrf_k
+        self.auto_filters = infer_filters
+
+        # Una pasada por los documentos, en el orden de las posiciones del
+        # índice FAISS: sólo se retienen los índices BM25 y de metadata. Los
+        # documentos se leen del docstore recién cuando se recuperan.
+        self._n_docs = 0
+        metadatas: List[Mapping] = []
+
+        def texts():
+            for doc in _iter_documents(vectorstore):
+                self._n_docs += 1
+                metadatas.append(doc.metadata or {})
+                yield doc.page_content
+
+        self.bm25 = BM25Index(texts())
+        self.metadata = MetadataIndex(metadatas)
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore, k: int = 4, **kwargs) -> "HybridRetriever":
+        return cls(vectorstore, k=k, **kwargs)
+
+    def __len__(self) -> int:
+        return self._n_docs
+
+    def _document(self, position: int):
+        return document_at(self.vectorstore, position)
+
+    def _embed_many(self, queries: Sequence[str]) -> np.ndarray:
+        embeddings = self.vectorstore.embeddings
+        if embeddings is not None and hasattr(embeddings, "embed_queries"):
+            vectors = embeddings.embed_queries(list(queries))
+        elif embeddings is not None:
+            vectors = [embeddings.embed_query(q) for q in queries]
+        else:
+            vectors = [self.vectorstore.embedding_function(q) for q in queries]
+        vec = np.asarray(vectors, dtype=np.float32)
+        if getattr(self.vectorstore, "_normalize_L2", False):
+            vec /= np.linalg.norm(vec, axis=1, keepdims=True)
+        return vec
+
+    def _embed(self, query: str) -> np.ndarray:
+        return embed_query(self.vectorstore, query)
+
+    def _vector_search_many(self, vecs: np.ndarray, n: int) -> List[np.ndarray]:
+        """Búsqueda sin filtros de varias preguntas en una sola llamada a FAISS."""
+        index = self.vectorstore.index
+        n = min(n, index.ntotal)
+        if n <= 0:
+            return [np.empty(0, dtype=np.int64) for _ in range(len(vecs))]
+        _, ix = index.search(vecs, n)
+        return [row[row >= 0] for row in ix]
+
+    def _vector_search(self, vec: np.ndarray, n: int, mask: Optional[np.ndarray]) -> np.ndarray:
+        index = self.vectorstore.index
+        n = min(n, index.ntotal)
+        if n <= 0:
+            return np.empty(0, dtype=np.int64)
+        if mask is None:
+            return self._vector_search_many(vec, n)[0]
+
+        allowed = np.flatnonzero(mask)
+        if len(allowed) == 0:
+            return np.empty(0, dtype=np.int64)
+        try:
+            import faiss
+            from ann_index import filtered_search_params
+            # Prefiltro dentro de FAISS: sólo se evalúan las posiciones permitidas
+            params = filtered_search_params(index, faiss.IDSelectorBatch(allowed))
+            _, ix = index.search(vec, min(n, len(allowed)), params=params)
+            ix = ix[0]
+        except Exception:
+            # Índices sin soporte de selectores: buscar de más y filtrar después
+            _, ix = index.search(vec, index.ntotal if len(allowed) < n else min(index.ntotal, n * 4))
+            ix = ix[0]
+            ix = ix[(ix >= 0) & mask[np.clip(ix, 0, None)]]
+        ix = ix[ix >= 0]
+        return ix[:n]
+
+    def _prefilter(self, query: str, filters: Optional[Filters]):
+        if filters is None and self.auto_filters:
+            filters = self.metadata.infer_filters(query)
+        mask = self.metadata.mask(filters)
+        if mask is not None and not mask.any():
+            mask = None
+        return filters, mask
+
+    def _fuse(
+        self, query: str, k: int, filters: Optional[Filters], mask: Optional[np.ndarray], vector_hits: np.ndarray
+    ) -> List[ScoredDocument]:
+        n = max(self.fetch_k, k)
+        scores = self.bm25.scores(query)
+        rankings = {
+            "bm25_rank": BM25Index.top(scores, n, mask),
+            "vector_rank": vector_hits,
+        }
+        if filters:
+            # Tercera lista: documentos que describen justo lo filtrado (p. ej. el
+            # del mes pedido), por cantidad de campos que coinciden y luego BM25
+            counts = self.metadata.matches(filters)
+            key = np.where(counts > 0, counts + 0.5 * scores / (scores.max() + 1e-9), 0)
+            rankings["metadata_rank"] = BM25Index.top(key, n, mask)
+
+        fused: Dict[int, ScoredDocument] = {}
+        for field, positions in rankings.items():
+            for rank, pos in enumerate(positions, start=1):
+                hit = fused.setdefault(int(pos), ScoredDocument(None, 0.0, int(pos)))
+                hit.score += 1.0 / (self.rrf_k + rank)
+                setattr(hit, field, rank)
+
+        best = sorted(fused.values(), key=lambda h: (-h.score, h.position))[:k]
+        for hit in best:
+            hit.document = self._document(hit.position)
+        return best
+
+    def search(self, query: str, k: Optional[int] = None, filters: Optional[Filters] = None) -> List[ScoredDocument]:
+        """Top-k documentos por RRF. `filters` = {campo: [valores]}; si es None se infiere."""
+        k = k or self.k
+        filters, mask = self._prefilter(query, filters)
+        vector_hits = self._vector_search(self._embed(query), max(self.fetch_k, k), mask)
+        return self._fuse(query, k, filters, mask, vector_hits)
+
+    def search_many(self, queries: Sequence[str], k: Optional[int] = None) -> List[List[ScoredDocument]]:
+        """`search` para varias preguntas con un solo embedding batched.
+
+        Las preguntas sin prefiltro comparten además una única búsqueda en
+        FAISS; las filtradas usan su selector de posiciones.
+        """
+        k = k or self.k
+        n = max(self.fetch_k, k)
+        if not queries:
+            return []
+        vecs = self._embed_many(queries)
+        prefilters = [self._prefilter(query, None) for query in queries]
+        vector_hits: List[Optional[np.ndarray]] = [None] * len(queries)
+        plain = [i for i, (_, mask) in enumerate(prefilters) if mask is None]
+        if plain:
+            for i, hits in zip(plain, self._vector_search_many(vecs[plain], n)):
+                vector_hits[i] = hits
+        for i, (_, mask) in enumerate(prefilters):
+            if mask is not None:
+                vector_hits[i] = self._vector_search(vecs[i:i + 1], n, mask)
+        return [
+            self._fuse(query, k, filters, mask, hits)
+            for query, (filters, mask), hits in zip(queries, prefilters, vector_hits)
+        ]
+
+    def get_relevant_documents(self, query: str, k: Optional[int] = None) -> list:
+        return [hit.document for hit in self.search(query, k)]
@@ -0,0 +1,161 @@
+"""Pipeline de indexado en streaming: documentos -> embeddings -> índice.
+
+Antes el builder juntaba todos los documentos como dicts, después como
+`Document` y recién ahí embebía todo en un solo `FAISS.from_documents`: tres
+copias del corpus en memoria. Acá los documentos fluyen por etapas:
+
+1. El generador de `data_loader` produce documentos de a uno; se agrupan en
+   lotes de `EMBED_BUILD_BATCH`.
+2. Un pool de `EMBED_BUILD_WORKERS` hilos embebe los lotes (sentence-
+   transformers libera el GIL durante la inferencia).
+3. Un único consumidor agrega cada lote al índice en orden, así las
+   posiciones son deterministas y FAISS no se toca desde varios hilos.
+
+Entre etapas hay backpressure: con `max_pending` lotes en vuelo no se lee el
+siguiente documento hasta que el consumidor libera uno. La memoria queda
+acotada por el índice y unos pocos lotes, no por el corpus.
+"""
+
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Deque, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# Un lote: ids, textos y metadata de los documentos
+Batch = Tuple[List[str], List[str], List[dict]]
+Sink = Callable[[List[str], List[str], List[dict], List[List[float]]], None]
+ProgressFn = Callable[[int], None]
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Memoria residente pico del proceso desde que arrancó, en MB (None si no se puede medir)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa KB; macOS, bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+@dataclass
+class PipelineStats:
+    docs: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+    embed_seconds: float = 0.0    # suma de los tiempos de los workers
+    add_seconds: float = 0.0
+    # ru_maxrss es el pico de toda la vida del proceso (en el servidor incluye
+    # consultas y builds anteriores); `rss_growth_mb` es lo que este build lo subió
+    process_peak_rss_mb: Optional[float] = None
+    rss_growth_mb: Optional[float] = None
+
+    @property
+    def docs_per_second(self) -> float:
+        return round(self.docs / self.seconds, 1) if self.seconds else 0.0
+
+    def report(self) -> dict:
+        return {
+            "docs": self.docs,
+            "batches": self.batches,
+            "seconds": round(self.seconds, 3),
+            "docs_per_second": self.docs_per_second,
+            "embed_seconds": round(self.embed_seconds, 3),
+            "add_seconds": round(self.add_seconds, 3),
+            "process_peak_rss_mb": self.process_peak_rss_mb,
+            "rss_growth_mb": self.rss_growth_mb,
+        }
+
+
+class EmbedPipeline:
+    def __init__(
+        self,
+        embeddings,
+        batch_size: int = 128,
+        workers: int = 2,
+        max_pending: Optional[int] = None,
+        log_every: float = 5.0,
+    ):
+        self.embeddings = embeddings
+        self.batch_size = max(1, batch_size)
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending or self.workers * 2)
+        self.log_every = log_every
+
+    @classmethod
+    def from_env(cls, embeddings) -> "EmbedPipeline":
+        return cls(
+            embeddings,
+            batch_size=int(os.getenv("EMBED_BUILD_BATCH", "128")),
+            workers=int(os.getenv("EMBED_BUILD_WORKERS", "2")),
+        )
+
+    def batches(self, items: Iterable[Tuple[str, str, dict]]) -> Iterable[Batch]:
+        """Agrupa (id, texto, metadata) en lotes de `batch_size`."""
+        ids: List[str] = []
+        texts: List[str] = []
+        metadatas: List[dict] = []
+        for doc_id, text, metadata in items:
+            ids.append(doc_id)
+            texts.append(text)
+            metadatas.append(metadata)
+            if len(ids) >= self.batch_size:
+                yield ids, texts, metadatas
+                ids, texts, metadatas = [], [], []
+        if ids:
+            yield ids, texts, metadatas
+
+    def _embed(self, texts: Sequence[str]) -> Tuple[List[List[float]], float]:
+        start = time.perf_counter()
+        vectors = self.embeddings.embed_documents(list(texts))
+        return vectors, time.perf_counter() - start
+
+    def run(self, items: Iterable[Tuple[str, str, dict]], sink: Sink, progress: Optional[ProgressFn] = None) -> PipelineStats:
+        """Embebe `items` por lotes y entrega cada lote a `sink` en orden."""
+        stats = PipelineStats()
+        peak_before = peak_rss_mb()
+        start = last_log = time.perf_counter()
+        pending: Deque[Tuple[Batch, Future]] = deque()
+
+        def drain_one() -> None:
+            nonlocal last_log
+            (ids, texts, metadatas), future = pending.popleft()
+            vectors, seconds = future.result()
+            stats.embed_seconds += seconds
+            t = time.perf_counter()
+            sink(ids, texts, metadatas, vectors)
+            stats.add_seconds += time.perf_counter() - t
+            stats.docs += len(ids)
+            stats.batches += 1
+            if progress is not None:
+                progress(stats.docs)
+            now = time.perf_counter()
+            if now - last_log >= self.log_every:
+                last_log = now
+                print(f"[INFO] Indexados {stats.docs} documentos ({stats.docs / (now - start):.0f} docs/s)")
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="embed-build") as pool:
+            try:
+                for batch in self.batches(items):
+                    # Backpressure: no leer más documentos con la cola llena
+                    while len(pending) >= self.max_pending:
+                        drain_one()
+                    pending.append((batch, pool.submit(self._embed, batch[1])))
+                while pending:
+                    drain_one()
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+        stats.seconds = time.perf_counter() - start
+        stats.process_peak_rss_mb = peak_rss_mb()
+        if peak_before is not None and stats.process_peak_rss_mb is not None:
+            stats.rss_growth_mb = round(stats.process_peak_rss_mb - peak_before, 1)
+        return stats
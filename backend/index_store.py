@@ -0,0 +1,266 @@
+"""Formato nativo del índice (sin pickle).
+
+Cada versión del índice es un directorio con:
+
+- `index.faiss`: el índice FAISS (`faiss.write_index`). Al servir se abre con
+  `IO_FLAG_MMAP`, así varios workers de uvicorn comparten las páginas del
+  archivo en lugar de tener cada uno su copia.
+- `docs.sqlite`: documentos y metadata (JSON), por posición en el índice y por
+  id. Se leen bajo demanda: sólo se traen los documentos recuperados.
+- `manifest.json`: formato, hash del dataset, modelo de embeddings, dimensión,
+  cantidad de vectores y métrica. Se valida al cargar.
+
+Reemplaza a `FAISS.save_local`, cuyo `index.pkl` obligaba a cargar con
+`allow_dangerous_deserialization=True`.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Mapping
+from typing import Iterator, Optional, Tuple
+
+import faiss
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+
+
+FORMAT_VERSION = 1
+INDEX_FILE = "index.faiss"
+DOCS_FILE = "docs.sqlite"
+MANIFEST_FILE = "manifest.json"
+
+
+class IndexFormatError(ValueError):
+    """El directorio no tiene un índice válido (o no coincide con la configuración)."""
+
+
+class ReadOnlyIndexError(IndexFormatError, PermissionError):
+    """Se intentó modificar un índice publicado (se abre desde disco, sólo lectura)."""
+
+
+def is_native_index(directory: str) -> bool:
+    return os.path.exists(os.path.join(directory, MANIFEST_FILE))
+
+
+def read_manifest(directory: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# ----------------------------------------------------------------------
+# Escritura
+# ----------------------------------------------------------------------
+def save_index(
+    vectorstore: FAISS,
+    directory: str,
+    dataset: Optional[str],
+    model: str,
+    index=None,
+    extra: Optional[dict] = None,
+) -> dict:
+    """Guarda `vectorstore` en `directory` (que no debe existir o estar vacío).
+
+    `index` reemplaza al índice del vectorstore (p. ej. uno ANN construido a
+    partir de él, con las mismas posiciones) y `extra` se agrega al manifest.
+    """
+    os.makedirs(directory, exist_ok=True)
+    index = index if index is not None else vectorstore.index
+    faiss.write_index(index, os.path.join(directory, INDEX_FILE))
+
+    conn = sqlite3.connect(os.path.join(directory, DOCS_FILE))
+    try:
+        conn.execute(
+            "CREATE TABLE documents (pos INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, "
+            "content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        mapping = vectorstore.index_to_docstore_id
+
+        def rows():
+            for pos in range(index.ntotal):
+                doc_id = mapping[pos]
+                doc = vectorstore.docstore.search(doc_id)
+                yield pos, doc_id, doc.page_content, json.dumps(doc.metadata or {}, ensure_ascii=False)
+
+        conn.executemany("INSERT INTO documents VALUES (?, ?, ?, ?)", rows())
+        conn.commit()
+    finally:
+        conn.close()
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        "dataset": dataset,
+        "model": model,
+        "dimension": index.d,
+        "count": index.ntotal,
+        "index_type": type(index).__name__,
+        "distance_strategy": str(getattr(vectorstore.distance_strategy, "value", vectorstore.distance_strategy)),
+        "normalize_L2": bool(getattr(vectorstore, "_normalize_L2", False)),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    manifest.update(extra or {})
+    with open(os.path.join(directory, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    return manifest
+
+
+# ----------------------------------------------------------------------
+# Lectura perezosa
+# ----------------------------------------------------------------------
+class SQLiteDocstore:
+    """Docstore de sólo lectura sobre `docs.sqlite` (una conexión por hilo).
+
+    Implementa lo que usan `FAISS` y `HybridRetriever`: `search(id)`,
+    `by_position(pos)` e `iter_documents()`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # Las versiones del índice no se modifican una vez publicadas
+        self._uri = f"file:{os.path.abspath(path)}?mode=ro&immutable=1"
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._uri, uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _to_document(row) -> Document:
+        doc_id, content, metadata = row
+        return Document(id=doc_id, page_content=content, metadata=json.loads(metadata))
+
+    def search(self, search: str):
+        row = self._conn().execute(
+            "SELECT id, content, metadata FROM documents WHERE id = ?", (search,)
+        ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return self._to_document(row)
+
+    def by_position(self, pos: int) -> Optional[Document]:
+        row = self._conn().execute(
+            "SELECT id, content, metadata FROM documents WHERE pos = ?", (int(pos),)
+        ).fetchone()
+        return self._to_document(row) if row is not None else None
+
+    def iter_documents(self) -> Iterator[Tuple[int, Document]]:
+        # Cursor propio: no retiene todos los documentos en memoria
+        cursor = self._conn().execute("SELECT pos, id, content, metadata FROM documents ORDER BY pos")
+        for pos, doc_id, content, metadata in cursor:
+            yield pos, self._to_document((doc_id, content, metadata))
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def add(self, texts) -> None:
+        raise ReadOnlyIndexError("El índice publicado es de sólo lectura; reindexar para modificarlo")
+
+    def delete(self, ids) -> None:
+        raise ReadOnlyIndexError("El índice publicado es de sólo lectura; reindexar para modificarlo")
+
+
+class PositionIds(Mapping):
+    """posición -> id del documento, leído de SQLite (reemplaza al dict en memoria)."""
+
+    def __init__(self, docstore: SQLiteDocstore, count: int):
+        self._docstore = docstore
+        self._count = count
+
+    def __getitem__(self, pos):
+        row = self._docstore._conn().execute("SELECT id FROM documents WHERE pos = ?", (int(pos),)).fetchone()
+        if row is None:
+            raise KeyError(pos)
+        return row[0]
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self):
+        return iter(range(self._count))
+
+
+def _validate(manifest: Optional[dict], index, count: int, model: Optional[str], dimension: Optional[int]) -> None:
+    if manifest is None:
+        raise IndexFormatError("Falta manifest.json")
+    if manifest.get("format") != FORMAT_VERSION:
+        raise IndexFormatError(f"Formato de índice {manifest.get('format')} no soportado (se espera {FORMAT_VERSION})")
+    if model is not None and manifest.get("model") != model:
+        raise IndexFormatError(
+            f"El índice se generó con '{manifest.get('model')}' pero el modelo configurado es '{model}'; "
+            "ejecutar `python embeddings_builder.py --force`"
+        )
+    if manifest.get("dimension") != index.d or (dimension is not None and dimension != index.d):
+        raise IndexFormatError(
+            f"Dimensión inconsistente: manifest {manifest.get('dimension')}, índice {index.d}, modelo {dimension}"
+        )
+    if not (manifest.get("count") == index.ntotal == count):
+        raise IndexFormatError(
+            f"Cantidad de vectores inconsistente: manifest {manifest.get('count')}, índice {index.ntotal}, documentos {count}"
+        )
+
+
+def load_index(
+    directory: str,
+    embeddings,
+    model: Optional[str] = None,
+    dimension: Optional[int] = None,
+    mmap: bool = True,
+    in_memory: bool = False,
+) -> FAISS:
+    """Abre un índice nativo como vectorstore `FAISS` de LangChain.
+
+    - Por defecto el índice se mapea en memoria y los documentos quedan en
+      SQLite (sólo lectura).
+    - Con `in_memory=True` se carga todo (índice y docstore) para poder
+      modificarlo, como hace el builder incremental.
+    `model` y `dimension`, si se pasan, se comparan con el manifest.
+    """
+    if not is_native_index(directory):
+        raise IndexFormatError(
+            f"'{directory}' no tiene un índice en formato nativo; ejecutar `python embeddings_builder.py`"
+        )
+    manifest = read_manifest(directory)
+    index_path = os.path.join(directory, INDEX_FILE)
+    if mmap and not in_memory:
+        try:
+            index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP)
+        except RuntimeError:
+            # Tipos de índice sin soporte de mmap: lectura normal
+            index = faiss.read_index(index_path)
+    else:
+        index = faiss.read_index(index_path)
+
+    store = SQLiteDocstore(os.path.join(directory, DOCS_FILE))
+    count = store.count()
+    _validate(manifest, index, count, model, dimension)
+
+    if in_memory:
+        docs = {}
+        ids = {}
+        for pos, doc in store.iter_documents():
+            docs[doc.id] = doc
+            ids[pos] = doc.id
+        docstore, index_to_docstore_id = InMemoryDocstore(docs), ids
+    else:
+        docstore, index_to_docstore_id = store, PositionIds(store, count)
+
+    vectorstore = FAISS(
+        embeddings,
+        index,
+        docstore,
+        index_to_docstore_id,
+        normalize_L2=manifest.get("normalize_L2", False),
+        distance_strategy=DistanceStrategy(manifest.get("distance_strategy", "EUCLIDEAN_DISTANCE")),
+    )
+    vectorstore.manifest = manifest
+    return vectorstore
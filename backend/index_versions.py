@@ -0,0 +1,64 @@
+"""Versiones del índice dentro de VECTORSTORE_DIR.
+
+Cada build se guarda en `VECTORSTORE_DIR/<versión>/` y el archivo `CURRENT`
+indica cuál está activa. Módulo liviano (sólo stdlib): lo usan tanto el
+builder como la carga del índice al arrancar, sin importar el stack de
+embeddings.
+"""
+
+import os
+import shutil
+import time
+from typing import Optional
+
+
+# Archivo dentro de VECTORSTORE_DIR con el nombre de la versión activa
+CURRENT_POINTER = "CURRENT"
+
+
+def read_current_version(output_dir: str) -> Optional[str]:
+    """Nombre de la versión activa del índice, o None si no hay puntero."""
+    try:
+        with open(os.path.join(output_dir, CURRENT_POINTER), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def resolve_index_dir(output_dir: str) -> str:
+    """Directorio del índice activo; si no hay versiones, el propio `output_dir` (formato anterior)."""
+    version = read_current_version(output_dir)
+    if version and os.path.isdir(os.path.join(output_dir, version)):
+        return os.path.join(output_dir, version)
+    return output_dir
+
+
+def new_version_name(output_dir: str, data_version: str) -> str:
+    """Nombre ordenable por fecha (vAAAAMMDDhhmmss-<hash del dataset>) que no exista aún."""
+    base = f"v{time.strftime('%Y%m%d%H%M%S')}-{data_version}"
+    version, n = base, 1
+    while os.path.exists(os.path.join(output_dir, version)):
+        n += 1
+        version = f"{base}-{n}"
+    return version
+
+
+def activate_version(output_dir: str, version: str) -> None:
+    # Escribir el puntero en un temporal y reemplazarlo: el cambio es atómico
+    tmp = os.path.join(output_dir, CURRENT_POINTER + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp, os.path.join(output_dir, CURRENT_POINTER))
+
+
+def prune_versions(output_dir: str, keep: int) -> None:
+    """Borra las versiones más viejas, conservando la activa y las `keep` más recientes."""
+    current = read_current_version(output_dir)
+    versions = sorted(
+        d for d in os.listdir(output_dir)
+        if d.startswith("v") and not d.endswith(".tmp") and os.path.isdir(os.path.join(output_dir, d))
+    )
+    for old in versions[:-keep] if keep > 0 else versions:
+        if old == current:
+            continue
+        shutil.rmtree(os.path.join(output_dir, old), ignore_errors=True)
@@ -0,0 +1,480 @@
+"""Pool de backends del LLM con balanceo, circuit breaker y failover.
+
+Antes `build_qa` elegía un único ChatOllama (o ChatOpenAI) y ese servidor era
+el techo de throughput; si se caía, todas las respuestas pasaban a modo demo.
+`LLMGateway` es un chat model de LangChain (lo usa `SimpleRAG` sin cambios)
+que reparte cada llamada entre varios backends:
+
+- `LLM_BACKENDS`: lista separada por comas de `tipo:url`, p. ej.
+  `ollama:http://10.0.0.2:11434,ollama:http://10.0.0.3:11434,openai:http://10.0.0.4:8000/v1`
+  (`openai` = cualquier servidor compatible con la API de OpenAI: vLLM,
+  llama.cpp, la propia OpenAI). Una URL sin tipo usa `LLM_PROVIDER`. Vacío =
+  un solo backend con `OLLAMA_BASE_URL` / `OPENAI_BASE_URL`, como antes.
+- Cada backend es un chat model propio, creado una vez, con un cliente HTTP
+  keep-alive de hasta `LLM_POOL_SIZE` conexiones: no se paga un handshake por
+  consulta.
+- Ruteo: el backend disponible con menos llamadas en curso; a igualdad, el
+  de menor latencia media (EWMA).
+- Circuit breaker: tras `LLM_BREAKER_FAILURES` errores seguidos el backend
+  queda fuera `LLM_BREAKER_COOLDOWN` segundos; después se deja pasar una
+  llamada de prueba (half-open) y, si sale bien, vuelve a la rotación.
+- Failover: si una llamada falla se reintenta en el siguiente backend (en
+  streaming, sólo si todavía no salió ningún token). Recién cuando fallan
+  todos, `SimpleRAG` responde en modo demo.
+- Health checks: cada `LLM_HEALTH_INTERVAL` segundos un hilo consulta
+  `/api/tags` (Ollama) o `/models` (OpenAI); un backend caído se saca de la
+  rotación sin esperar a que falle una consulta real.
+
+`stats()` (expuesto en `GET /llm/stats`) da estado, llamadas en curso,
+errores y latencias p50/p95 por backend; `/metrics` suma los histogramas.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Deque, Iterator, List, Optional
+
+import httpx
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict, PrivateAttr
+
+import metrics
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+OLLAMA = "ollama"
+OPENAI = "openai"
+
+DEFAULT_OPENAI_URL = "https://api.openai.com/v1"
+
+# Latencias recientes por backend para p50 / p95
+LATENCY_WINDOW = 256
+
+
+class LLMUnavailable(RuntimeError):
+    """Ningún backend del LLM está disponible (todos con el circuito abierto)."""
+
+
+@dataclass
+class BackendSpec:
+    kind: str
+    url: str
+    model: str
+
+
+def parse_backends(value: Optional[str] = None, provider: Optional[str] = None) -> List[BackendSpec]:
+    """Backends de `LLM_BACKENDS` (o el único de `LLM_PROVIDER` si está vacío)."""
+    provider = (provider or os.getenv("LLM_PROVIDER", "ollama")).lower()
+    value = os.getenv("LLM_BACKENDS", "") if value is None else value
+    specs = []
+    for entry in (e.strip() for e in value.split(",")):
+        if not entry:
+            continue
+        kind, _, url = entry.partition(":")
+        if url.startswith("//"):
+            # Sin tipo: "http://host:11434"
+            kind, url = provider, entry
+        specs.append(BackendSpec(kind.lower(), url.rstrip("/"), _model_for(kind.lower())))
+    if not specs:
+        if provider == OLLAMA:
+            url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+        else:
+            url = os.getenv("OPENAI_BASE_URL") or DEFAULT_OPENAI_URL
+        specs.append(BackendSpec(provider, url.rstrip("/"), _model_for(provider)))
+    for spec in specs:
+        if spec.kind not in (OLLAMA, OPENAI):
+            raise ValueError(f"Tipo de backend LLM no válido: {spec.kind}. Usa 'ollama' u 'openai'")
+    return specs
+
+
+def _model_for(kind: str) -> str:
+    if kind == OPENAI:
+        return os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+    return os.getenv("OLLAMA_MODEL", "llama3.2")
+
+
+def _limits() -> httpx.Limits:
+    size = int(os.getenv("LLM_POOL_SIZE", "8"))
+    return httpx.Limits(
+        max_connections=size,
+        max_keepalive_connections=size,
+        keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_SECONDS", "60")),
+    )
+
+
+def _timeout() -> float:
+    return float(os.getenv("LLM_TIMEOUT", "120"))
+
+
+def make_chat_model(spec: BackendSpec):
+    """Chat model de LangChain para un backend, con su pool de conexiones."""
+    if spec.kind == OLLAMA:
+        from langchain_ollama import ChatOllama
+
+        return ChatOllama(
+            model=spec.model,
+            base_url=spec.url,
+            temperature=0.1,  # Un poco de creatividad para mejor razonamiento
+            num_ctx=4096,     # Más contexto para procesar más datos
+            # Mantener el modelo cargado en Ollama entre consultas (sin recarga en frío)
+            keep_alive=os.getenv("OLLAMA_KEEP_ALIVE", "30m"),
+            client_kwargs={"limits": _limits(), "timeout": _timeout()},
+        )
+
+    try:
+        from langchain_openai import ChatOpenAI
+    except ImportError:
+        raise ValueError("Para backends 'openai' hay que instalar langchain-openai (pip install langchain-openai)")
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        if spec.url == DEFAULT_OPENAI_URL:
+            raise ValueError("Falta la variable OPENAI_API_KEY en el archivo env")
+        # Servidores compatibles locales (vLLM, llama.cpp) no piden clave
+        api_key = "sin-clave"
+    return ChatOpenAI(
+        temperature=0,
+        api_key=api_key,
+        model=spec.model,
+        base_url=spec.url,
+        timeout=_timeout(),
+        max_retries=0,  # los reintentos los hace el gateway, en otro backend
+        http_client=httpx.Client(limits=_limits(), timeout=_timeout()),
+        http_async_client=httpx.AsyncClient(limits=_limits(), timeout=_timeout()),
+    )
+
+
+class Backend:
+    """Un servidor del LLM: su chat model, su circuit breaker y sus estadísticas."""
+
+    def __init__(self, name: str, llm, kind: str = "custom", url: Optional[str] = None):
+        self.name = name
+        self.llm = llm
+        self.kind = kind
+        self.url = url
+
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.trial_running = False
+        self.healthy: Optional[bool] = None    # None = sin health check todavía
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_error: Optional[str] = None
+        self.ewma_seconds: Optional[float] = None
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    @classmethod
+    def from_spec(cls, spec: BackendSpec) -> "Backend":
+        host = spec.url.split("://", 1)[-1]
+        return cls(f"{spec.kind}@{host}", make_chat_model(spec), spec.kind, spec.url)
+
+    @property
+    def health_url(self) -> Optional[str]:
+        if self.url is None:
+            return None
+        return f"{self.url}/api/tags" if self.kind == OLLAMA else f"{self.url}/models"
+
+    def stats(self) -> dict:
+        window = np.asarray(self.latencies) * 1000.0
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "url": self.url,
+            "state": self.state,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+            "ewma_ms": round(self.ewma_seconds * 1000.0, 1) if self.ewma_seconds is not None else None,
+            "p50_ms": round(float(np.percentile(window, 50)), 1) if len(window) else None,
+            "p95_ms": round(float(np.percentile(window, 95)), 1) if len(window) else None,
+        }
+
+
+class LLMGateway(BaseChatModel):
+    """Chat model que balancea entre varios `Backend` con failover."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    backends: List[Any]
+    max_attempts: int = 0                  # 0 = probar todos los backends
+    breaker_failures: int = 3
+    breaker_cooldown: float = 30.0
+    health_interval: float = 15.0          # 0 = sin health checks
+
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _health_thread: Optional[threading.Thread] = PrivateAttr(default=None)
+    _health_client: Optional[httpx.Client] = PrivateAttr(default=None)
+    _failovers: int = PrivateAttr(default=0)
+
+    @classmethod
+    def from_env(cls) -> "LLMGateway":
+        backends = [Backend.from_spec(spec) for spec in parse_backends()]
+        for backend in backends:
+            print(f"[INFO] Backend LLM: {backend.name} (modelo {getattr(backend.llm, 'model', '?')})")
+        return cls(
+            backends=backends,
+            max_attempts=int(os.getenv("LLM_MAX_ATTEMPTS", "0")),
+            breaker_failures=int(os.getenv("LLM_BREAKER_FAILURES", "3")),
+            breaker_cooldown=float(os.getenv("LLM_BREAKER_COOLDOWN", "30")),
+            health_interval=float(os.getenv("LLM_HEALTH_INTERVAL", "15")),
+        )
+
+    @property
+    def _llm_type(self) -> str:
+        return "llm-gateway"
+
+    # ------------------------------------------------------------------
+    # Ruteo y circuit breaker
+    # ------------------------------------------------------------------
+    def _available(self, backend: Backend, now: float) -> bool:
+        if backend.state == OPEN and now - backend.opened_at >= self.breaker_cooldown:
+            backend.state = HALF_OPEN
+        if backend.state == HALF_OPEN:
+            # Una sola llamada de prueba a la vez
+            return not backend.trial_running
+        return backend.state == CLOSED and backend.healthy is not False
+
+    def _acquire(self, tried: List[Backend]) -> Optional[Backend]:
+        now = time.monotonic()
+        with self._lock:
+            candidates = [b for b in self.backends if b not in tried and self._available(b, now)]
+            if not candidates:
+                return None
+            backend = min(
+                candidates,
+                key=lambda b: (b.outstanding, b.ewma_seconds if b.ewma_seconds is not None else 0.0),
+            )
+            backend.outstanding += 1
+            backend.requests += 1
+            if backend.state == HALF_OPEN:
+                backend.trial_running = True
+            return backend
+
+    def _release(self, backend: Backend, start: float, error: Optional[BaseException] = None) -> None:
+        self._free(backend)
+        self._record(backend, time.perf_counter() - start, error)
+
+    def _free(self, backend: Backend) -> None:
+        """Libera el turno sin registrar latencia ni resultado (llamada cancelada)."""
+        with self._lock:
+            backend.outstanding -= 1
+            backend.trial_running = False
+
+    def _record(self, backend: Backend, seconds: float, error: Optional[BaseException] = None) -> None:
+        """Latencia o error de una llamada; los errores seguidos abren el circuito."""
+        with self._lock:
+            if error is None:
+                backend.consecutive_failures = 0
+                backend.state = CLOSED
+                backend.latencies.append(seconds)
+                backend.ewma_seconds = seconds if backend.ewma_seconds is None else 0.8 * backend.ewma_seconds + 0.2 * seconds
+            else:
+                backend.failures += 1
+                backend.consecutive_failures += 1
+                backend.last_error = str(error)[:200]
+                if backend.state == HALF_OPEN or backend.consecutive_failures >= self.breaker_failures:
+                    if backend.state != OPEN:
+                        print(f"[WARN] LLM {backend.name}: circuito abierto por {self.breaker_cooldown:.0f}s "
+                              f"({backend.consecutive_failures} errores seguidos)")
+                    backend.state = OPEN
+                    backend.opened_at = time.monotonic()
+        if error is None:
+            metrics.LLM_BACKEND_SECONDS.observe(seconds, backend=backend.name)
+        else:
+            metrics.LLM_BACKEND_ERRORS.inc(backend=backend.name)
+
+    def _attempts(self) -> int:
+        return self.max_attempts or len(self.backends)
+
+    def _next(self, tried: List[Backend], error: Optional[BaseException]) -> Backend:
+        self._ensure_health_checks()
+        if len(tried) < self._attempts():
+            backend = self._acquire(tried)
+            if backend is not None:
+                if tried:
+                    self._failovers += 1
+                    metrics.LLM_FAILOVERS.inc()
+                    print(f"[WARN] LLM {tried[-1].name} falló ({str(error)[:100]}); se reintenta en {backend.name}")
+                return backend
+        if error is not None:
+            raise error
+        raise LLMUnavailable("Ningún backend del LLM disponible (circuitos abiertos o sin salud)")
+
+    # ------------------------------------------------------------------
+    # Interfaz BaseChatModel
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _result(message) -> ChatResult:
+        if not isinstance(message, AIMessage):
+            message = AIMessage(content=str(getattr(message, "content", message)))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        tried: List[Backend] = []
+        error: Optional[BaseException] = None
+        while True:
+            backend = self._next(tried, error)
+            tried.append(backend)
+            start = time.perf_counter()
+            try:
+                message = backend.llm.invoke(messages, stop=stop, **kwargs)
+            except Exception as e:
+                self._release(backend, start, e)
+                error = e
+                continue
+            except BaseException:
+                self._free(backend)
+                raise
+            self._release(backend, start)
+            return self._result(message)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        tried: List[Backend] = []
+        error: Optional[BaseException] = None
+        while True:
+            backend = self._next(tried, error)
+            tried.append(backend)
+            start = time.perf_counter()
+            try:
+                message = await backend.llm.ainvoke(messages, stop=stop, **kwargs)
+            except Exception as e:
+                self._release(backend, start, e)
+                error = e
+                continue
+            except BaseException:
+                # Consulta cancelada (CancelledError): ni éxito ni falla del backend
+                self._free(backend)
+                raise
+            self._release(backend, start)
+            return self._result(message)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        tried: List[Backend] = []
+        error: Optional[BaseException] = None
+        while True:
+            backend = self._next(tried, error)
+            tried.append(backend)
+            start = time.perf_counter()
+            started = False
+            try:
+                for chunk in backend.llm.stream(messages, stop=stop, **kwargs):
+                    started = True
+                    yield ChatGenerationChunk(message=chunk)
+            except Exception as e:
+                self._release(backend, start, e)
+                # Con tokens ya enviados no se puede cambiar de backend
+                if started:
+                    raise
+                error = e
+                continue
+            except BaseException:
+                # El consumidor cortó el stream (GeneratorExit): ni éxito ni falla del backend
+                self._free(backend)
+                raise
+            self._release(backend, start)
+            return
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        tried: List[Backend] = []
+        error: Optional[BaseException] = None
+        while True:
+            backend = self._next(tried, error)
+            tried.append(backend)
+            start = time.perf_counter()
+            started = False
+            try:
+                async for chunk in backend.llm.astream(messages, stop=stop, **kwargs):
+                    started = True
+                    yield ChatGenerationChunk(message=chunk)
+            except Exception as e:
+                self._release(backend, start, e)
+                if started:
+                    raise
+                error = e
+                continue
+            except BaseException:
+                self._free(backend)
+                raise
+            self._release(backend, start)
+            return
+
+    # ------------------------------------------------------------------
+    # Health checks, precalentado y estadísticas
+    # ------------------------------------------------------------------
+    def _ensure_health_checks(self) -> None:
+        if self.health_interval <= 0 or not any(b.health_url for b in self.backends):
+            return
+        if self._health_thread is not None and self._health_thread.is_alive():
+            return
+        with self._lock:
+            if self._health_thread is None or not self._health_thread.is_alive():
+                self._health_client = httpx.Client(timeout=min(5.0, self.health_interval), limits=_limits())
+                self._health_thread = threading.Thread(target=self._health_loop, name="llm-health", daemon=True)
+                self._health_thread.start()
+
+    def check_health(self) -> None:
+        """Consulta el endpoint liviano de cada backend y actualiza su estado."""
+        client = self._health_client or httpx.Client(timeout=5.0)
+        for backend in self.backends:
+            if backend.health_url is None:
+                continue
+            try:
+                ok = client.get(backend.health_url).status_code < 500
+            except httpx.HTTPError:
+                ok = False
+            with self._lock:
+                if ok and backend.healthy is False:
+                    print(f"[INFO] LLM {backend.name} respondió al health check; vuelve a la rotación")
+                    # Si estaba con el circuito abierto, la próxima llamada es de prueba
+                    if backend.state == OPEN:
+                        backend.state = HALF_OPEN
+                elif not ok and backend.healthy is not False:
+                    print(f"[WARN] LLM {backend.name} no responde al health check; se saca de la rotación")
+                backend.healthy = ok
+
+    def _health_loop(self) -> None:
+        while True:
+            self.check_health()
+            time.sleep(self.health_interval)
+
+    def warm_up(self, prompt: str) -> None:
+        """Precalienta cada backend (Ollama carga el modelo con la primera generación)."""
+        errors = []
+        for backend in self.backends:
+            start = time.perf_counter()
+            try:
+                backend.llm.invoke(prompt)
+            except Exception as e:
+                self._record(backend, time.perf_counter() - start, e)
+                errors.append(f"{backend.name}: {str(e)[:100]}")
+                continue
+            self._record(backend, time.perf_counter() - start)
+        if len(errors) == len(self.backends):
+            raise LLMUnavailable("; ".join(errors))
+        for error in errors:
+            print(f"[WARN] LLM sin precalentar: {error}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            backends = [b.stats() for b in self.backends]
+        return {
+            "backends": backends,
+            "available": sum(1 for b in backends if b["state"] != OPEN and b["healthy"] is not False),
+            "failovers": self._failovers,
+            "breaker_failures": self.breaker_failures,
+            "breaker_cooldown": self.breaker_cooldown,
+            "health_interval": self.health_interval,
+        }
+
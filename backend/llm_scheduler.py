@@ -0,0 +1,186 @@
+"""Planificador de llamadas al LLM para el camino async de `/query`.
+
+- Limita cuántas generaciones corren a la vez contra Ollama (`max_concurrency`).
+- Las demás esperan en una cola acotada y en orden de llegada (FIFO).
+- Si la cola está llena, o la espera supera `queue_timeout`, se rechaza con
+  `SchedulerSaturated` (que la API traduce a 503 + Retry-After).
+- Preguntas idénticas en vuelo se agrupan en una sola generación.
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+
+class SchedulerSaturated(Exception):
+    """No hay lugar en la cola del LLM; reintentar dentro de `retry_after` segundos."""
+
+    def __init__(self, retry_after: int, reason: str = "cola llena"):
+        super().__init__(f"LLM saturado ({reason})")
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class SlotLease:
+    """Turno del LLM ya concedido. `release` es idempotente."""
+
+    def __init__(self, scheduler: "LLMScheduler"):
+        self._scheduler = scheduler
+        self._start = time.perf_counter()
+        self._released = False
+
+    def release(self, failed: bool = False) -> None:
+        if self._released:
+            return
+        self._released = True
+        scheduler = self._scheduler
+        if failed:
+            scheduler.failed += 1
+        else:
+            scheduler.completed += 1
+        scheduler._observe(time.perf_counter() - self._start)
+        scheduler._release()
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency: int = 2, max_queue: int = 32, queue_timeout: float = 30.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+
+        self._active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # Latencia media (EWMA) de una generación, para estimar Retry-After
+        self._avg_latency = 5.0
+
+        self.completed = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    @classmethod
+    def from_env(cls) -> "LLMScheduler":
+        return cls(
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "2")),
+            max_queue=int(os.getenv("LLM_MAX_QUEUE", "32")),
+            queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", "30")),
+        )
+
+    # ------------------------------------------------------------------
+    def retry_after(self) -> int:
+        pending = len(self._waiters) + 1
+        return max(1, math.ceil(self._avg_latency * pending / self.max_concurrency))
+
+    async def acquire(self) -> SlotLease:
+        """Espera un turno (FIFO) o lanza `SchedulerSaturated`."""
+        await self._acquire()
+        return SlotLease(self)
+
+    async def _acquire(self) -> None:
+        if self._active < self.max_concurrency and not self._waiters:
+            self._active += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise SchedulerSaturated(self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            timeout = self.queue_timeout if self.queue_timeout > 0 else None
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            self.timeouts += 1
+            raise SchedulerSaturated(self.retry_after(), "tiempo de espera agotado")
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+
+    def _abandon(self, waiter: asyncio.Future) -> None:
+        if waiter.done() and not waiter.cancelled():
+            # Ya se le había pasado el turno: devolverlo
+            self._release()
+        else:
+            waiter.cancel()
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+
+    def _release(self) -> None:
+        # El turno pasa directamente al siguiente en la cola (orden FIFO)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
+    @asynccontextmanager
+    async def slot(self):
+        """Reserva un turno del LLM durante el bloque (p. ej. un stream)."""
+        lease = await self.acquire()
+        try:
+            yield
+        except BaseException:
+            lease.release(failed=True)
+            raise
+        lease.release()
+
+    def _observe(self, seconds: float) -> None:
+        self._avg_latency = 0.8 * self._avg_latency + 0.2 * seconds
+
+    async def _execute(self, factory: Callable[[], Awaitable]):
+        async with self.slot():
+            return await factory()
+
+    async def submit(self, key: Optional[str], factory: Callable[[], Awaitable]):
+        """Ejecuta `factory()` respetando el límite de concurrencia.
+
+        Si ya hay una generación en vuelo con la misma `key`, se espera su
+        resultado en lugar de lanzar otra. La generación corre en su propia
+        tarea, así que termina aunque el cliente que la originó se desconecte.
+        """
+        if key is not None and key in self._inflight:
+            self.coalesced += 1
+            return await asyncio.shield(self._inflight[key])
+
+        # Rechazo rápido, antes de crear la tarea
+        if self._active >= self.max_concurrency and len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise SchedulerSaturated(self.retry_after())
+
+        task = asyncio.ensure_future(self._execute(factory))
+        task.add_done_callback(lambda t, k=key: self._forget(k, t))
+        if key is not None:
+            self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Optional[str], task: asyncio.Task) -> None:
+        if key is not None and self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Marcar la excepción como leída aunque ya no quede nadie esperando
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self._active,
+            "queued": len(self._waiters),
+            "inflight_keys": len(self._inflight),
+            "avg_latency_seconds": round(self._avg_latency, 3),
+            "completed": self.completed,
+            "failed": self.failed,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "queue_timeouts": self.timeouts,
+        }
@@ -0,0 +1,280 @@
+"""Métricas de latencia por etapa en formato Prometheus.
+
+Cada consulta abre una traza (`request_trace` / `RequestTrace`) y cada etapa
+del pipeline se mide con `span`:
+
+- `session`: reescritura de la repregunta e historial de la sesión.
+- `greeting`, `canonical`, `analytics`, `cache`: atajos que responden sin LLM.
+- `retrieve`: búsqueda en el índice (BM25 + FAISS).
+- `extract`: textos de los documentos empaquetados en el presupuesto de tokens.
+- `prompt`: armado del prompt y conteo de sus tokens.
+- `llm`: llamada al LLM (en streaming, hasta el último token).
+- `fallback`: respuesta en modo demo cuando el LLM falla.
+
+La traza activa viaja en una `ContextVar`, así `SimpleRAG` registra sus
+etapas sin cambiar de firma (`asyncio.to_thread` copia el contexto al hilo).
+Todo se acumula en histogramas y contadores que `GET /metrics` expone en el
+formato de texto de Prometheus, sin dependencias externas.
+
+Con `SLOW_QUERY_MS` > 0, las consultas que tardan más se loguean con el
+desglose completo por etapa.
+"""
+
+import bisect
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+# Segundos; cubre desde un saludo (<1 ms) hasta generaciones largas en CPU
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """Líneas de muestras en el formato de texto de Prometheus."""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Por combinación de labels: cuentas por bucket (no acumuladas), suma y total
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, totals = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0, 0]))
+            counts[i] += 1
+            totals[0] += value
+            totals[1] += 1
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return int(entry[1][1]) if entry else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), list(totals))) for key, (counts, totals) in self._values.items())
+        lines = []
+        for key, (counts, (total, n)) in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                cumulative += c
+                le = ("le", _format_value(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {round(total, 6)}")
+            lines.append(f"{self.name}_count{labels} {int(n)}")
+        return lines
+
+
+# ----------------------------------------------------------------------
+# Métricas del chatbot
+# ----------------------------------------------------------------------
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Latencia de cada etapa de la consulta.", ["stage"])
+REQUEST_SECONDS = Histogram(
+    "rag_request_seconds", "Latencia total de la consulta, por endpoint y por cómo se respondió.", ["endpoint", "route"]
+)
+REQUESTS = Counter("rag_requests_total", "Consultas atendidas, por endpoint y por cómo se respondió.", ["endpoint", "route"])
+IN_FLIGHT = Gauge("rag_requests_in_flight", "Consultas en curso.", ["endpoint"])
+TOKENS = Counter("rag_llm_tokens_total", "Tokens enviados al LLM (prompt) y generados (completion).", ["kind"])
+LLM_ERRORS = Counter("rag_llm_errors_total", "Llamadas al LLM que fallaron.", ["mode"])
+FALLBACKS = Counter("rag_fallbacks_total", "Respuestas en modo demo (contexto sin LLM) por falla del LLM.")
+FIRST_TOKEN_SECONDS = Histogram("rag_stream_first_token_seconds", "Tiempo hasta el primer fragmento del LLM en streaming.")
+LLM_BACKEND_SECONDS = Histogram("rag_llm_backend_seconds", "Latencia de las llamadas exitosas a cada backend del LLM.", ["backend"])
+LLM_BACKEND_ERRORS = Counter("rag_llm_backend_errors_total", "Llamadas fallidas por backend del LLM.", ["backend"])
+LLM_FAILOVERS = Counter("rag_llm_failovers_total", "Reintentos de una llamada al LLM en otro backend.")
+DATASETS_LOADED = Gauge("rag_datasets_loaded", "Datasets cargados en memoria.")
+DATASET_LOADS = Counter("rag_dataset_loads_total", "Cargas de un dataset (la primera consulta o tras descargarlo).", ["dataset"])
+DATASET_EVICTIONS = Counter("rag_dataset_evictions_total", "Datasets descargados por el LRU.")
+
+REGISTRY: List[_Metric] = [
+    REQUEST_SECONDS, REQUESTS, IN_FLIGHT, STAGE_SECONDS, FIRST_TOKEN_SECONDS, TOKENS, LLM_ERRORS, FALLBACKS,
+    LLM_BACKEND_SECONDS, LLM_BACKEND_ERRORS, LLM_FAILOVERS, DATASETS_LOADED, DATASET_LOADS, DATASET_EVICTIONS,
+]
+
+
+def render() -> str:
+    """Todas las métricas en el formato de texto de Prometheus."""
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+# ----------------------------------------------------------------------
+# Trazas por consulta
+# ----------------------------------------------------------------------
+_current: ContextVar[Optional["RequestTrace"]] = ContextVar("rag_request_trace", default=None)
+
+
+def slow_query_ms() -> float:
+    return float(os.getenv("SLOW_QUERY_MS", "0") or 0)
+
+
+class RequestTrace:
+    """Desglose de una consulta: segundos por etapa y cómo se respondió (`route`)."""
+
+    def __init__(self, endpoint: str, question: str = ""):
+        self.endpoint = endpoint
+        self.question = question
+        self.route: Optional[str] = None
+        self.stages: Dict[str, float] = {}
+        self._start = time.perf_counter()
+        self._finished = False
+        self._lock = threading.Lock()
+        IN_FLIGHT.inc(endpoint=endpoint)
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def activate(self) -> Iterator["RequestTrace"]:
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def elapsed(self) -> float:
+        """Segundos desde que empezó la consulta."""
+        return time.perf_counter() - self._start
+
+    def breakdown(self) -> Dict[str, float]:
+        with self._lock:
+            return {stage: round(seconds * 1000.0, 1) for stage, seconds in self.stages.items()}
+
+    def finish(self, route: Optional[str] = None) -> float:
+        """Cierra la traza (una sola vez) y devuelve la latencia total en segundos."""
+        seconds = self.elapsed()
+        with self._lock:
+            if self._finished:
+                return seconds
+            self._finished = True
+        # Sin ruta asignada (p. ej. terminó con una excepción) cuenta como error
+        self.route = route or self.route or "error"
+        IN_FLIGHT.dec(endpoint=self.endpoint)
+        REQUEST_SECONDS.observe(seconds, endpoint=self.endpoint, route=self.route)
+        REQUESTS.inc(endpoint=self.endpoint, route=self.route)
+
+        threshold = slow_query_ms()
+        if threshold and seconds * 1000.0 >= threshold:
+            stages = " ".join(f"{stage}={ms}ms" for stage, ms in self.breakdown().items()) or "-"
+            print(f"[WARN] Consulta lenta ({seconds * 1000.0:.0f} ms, {self.endpoint}, {self.route}): "
+                  f"{stages} | {self.question[:120]!r}")
+        return seconds
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current.get()
+
+
+@contextmanager
+def request_trace(endpoint: str, question: str = "") -> Iterator[RequestTrace]:
+    """Traza activa durante el bloque; el código asigna `trace.route` según cómo respondió."""
+    trace = RequestTrace(endpoint, question)
+    try:
+        with trace.activate():
+            yield trace
+    finally:
+        trace.finish()
+
+
+def observe_stage(stage: str, seconds: float, trace: Optional[RequestTrace] = None) -> None:
+    """Registra `seconds` en la etapa; por defecto en la traza activa."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    trace = trace or _current.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def span(stage: str, trace: Optional[RequestTrace] = None) -> Iterator[None]:
+    """Mide el bloque como la etapa `stage` (aunque termine con excepción)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start, trace)
+
+
+def record_tokens(prompt: Optional[int] = None, completion: Optional[int] = None) -> None:
+    if prompt:
+        TOKENS.inc(prompt, kind="prompt")
+    if completion:
+        TOKENS.inc(completion, kind="completion")
@@ -1,24 +1,113 @@
+import asyncio
 import os
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
 from dotenv import load_dotenv
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_ollama import ChatOllama
+from embedding_service import embedding_model_name, get_embeddings
+from index_store import load_index
+from index_versions import read_current_version, resolve_index_dir
+from context_budget import TokenCounter, get_context_budget, pack_context
+from hybrid_retriever import HybridRetriever, ScoredDocument, document_at, embed_query
+import ann_index
+from llm_gateway import LLMGateway
+import metrics
+from metrics import span
 
 # Cargar variables de entorno
 load_dotenv(os.path.join(os.path.dirname(__file__), "env"))
 
 
+@dataclass
+class Source:
+    """Documento que entró en el contexto, con los puntajes con que se recuperó."""
+    id: str
+    rank: int                               # 1 = el más relevante del retrieval
+    # Qué es `score`: rrf (retriever híbrido, mayor = mejor), distance (distancia
+    # L2 de FAISS, menor = mejor) o vectorstore (lo que informe otro vectorstore)
+    score: Optional[float] = None
+    score_kind: Optional[str] = None
+    # Posición del documento en el índice FAISS (None si el retriever no la informa)
+    position: Optional[int] = None
+    bm25_rank: Optional[int] = None
+    vector_rank: Optional[int] = None
+    metadata_rank: Optional[int] = None
+    metadata: dict = field(default_factory=dict)
+
+
+@dataclass
+class RAGResult:
+    """Respuesta del pipeline; `fallback` indica que el LLM falló (modo demo)."""
+    answer: str
+    fallback: bool = False
+    sources: List[str] = field(default_factory=list)
+    prompt_tokens: Optional[int] = None
+    # Detalle de `sources`: id, metadatos y puntajes de cada documento
+    documents: List[Source] = field(default_factory=list)
+
+
+def _metadata(doc) -> dict:
+    metadata = getattr(doc, "metadata", None)
+    if metadata is None and isinstance(doc, dict):
+        metadata = doc.get("metadata")
+    return metadata or {}
+
+
+def as_hits(docs) -> List[ScoredDocument]:
+    """Documentos como `ScoredDocument`; los que llegan sin puntaje quedan con `score` None."""
+    return [d if isinstance(d, ScoredDocument) else ScoredDocument(d, None, None, score_kind=None) for d in docs]
+
+
+def source_details(hits: List[ScoredDocument]) -> List[Source]:
+    details = []
+    for rank, hit in enumerate(hits, start=1):
+        metadata = _metadata(hit.document)
+        details.append(Source(
+            id=str(metadata.get("id") or metadata.get("type") or "documento"),
+            rank=rank,
+            score=None if hit.score is None else round(float(hit.score), 6),
+            score_kind=hit.score_kind if hit.score is not None else None,
+            position=hit.position,
+            bm25_rank=hit.bm25_rank,
+            vector_rank=hit.vector_rank,
+            metadata_rank=hit.metadata_rank,
+            metadata=dict(metadata),
+        ))
+    return details
+
+
 class SimpleRAG:
     """Pequeña implementación RAG: recupera documentos y consulta el LLM con el contexto.
 
     Soporta tanto un `retriever` (si el vectorstore expone uno) como un `vectorstore`
     directo (usa `similarity_search` como fallback).
+
+    El contexto se arma con `context_budget.pack_context`: tablas compactadas y
+    sólo los documentos (en orden de relevancia) que entran en `token_budget`.
     """
-    def __init__(self, llm, retriever=None, vectorstore=None, k: int = 1):
+    def __init__(self, llm, retriever=None, vectorstore=None, k: int = 1, version=None,
+                 token_budget: Optional[int] = None, token_counter: Optional[TokenCounter] = None):
         self.llm = llm
-        self.retriever = retriever
-        self.vectorstore = vectorstore
+        self.token_budget = token_budget
+        self.token_counter = token_counter or TokenCounter(llm)
+        # retriever y vectorstore viajan juntos en una tupla para poder
+        # reemplazarlos de una sola asignación (atómica) al reindexar
+        self._index = (retriever, vectorstore)
         self.k = k
+        self.version = version
+
+    @property
+    def retriever(self):
+        return self._index[0]
+
+    @property
+    def vectorstore(self):
+        return self._index[1]
+
+    def swap_index(self, vectorstore, retriever=None, version=None):
+        """Activa un índice nuevo. Las consultas en curso terminan con el anterior."""
+        self._index = (retriever, vectorstore)
+        self.version = version
 
     def _extract_texts(self, docs):
         parts = []
@@ -32,39 +121,78 @@ class SimpleRAG:
                 parts.append(str(d))
         return parts
 
-    def _retrieve(self, query: str):
-        # Recuperación simple - solo los k documentos más relevantes
-        if self.retriever is not None:
+    def _retrieve(self, query: str) -> List[ScoredDocument]:
+        with span("retrieve"):
+            return self._search(query)
+
+    def _search(self, query: str) -> List[ScoredDocument]:
+        """Los k documentos más relevantes, con sus puntajes si el retriever los da."""
+        # Tomar una sola vez el índice activo (puede cambiar durante un reindex)
+        retriever, vectorstore = self._index
+
+        # Retriever híbrido: puntaje RRF y posición en cada ranking (BM25, vectores, metadatos)
+        if isinstance(retriever, HybridRetriever):
+            return retriever.search(query, self.k)
+
+        # Otros retrievers (p. ej. el de LangChain) no informan puntajes
+        if retriever is not None:
             for fn in ("get_relevant_documents", "get_relevant_results", "get_relevant_items"):
-                if hasattr(self.retriever, fn):
+                if hasattr(retriever, fn):
                     try:
-                        return getattr(self.retriever, fn)(query)
+                        return as_hits(getattr(retriever, fn)(query))
                     except TypeError:
-                        return getattr(self.retriever, fn)(query, k=self.k)
+                        return as_hits(getattr(retriever, fn)(query, k=self.k))
 
-        # Fallback: usar vectorstore directamente
-        if self.vectorstore is not None:
-            if hasattr(self.vectorstore, "similarity_search"):
-                return self.vectorstore.similarity_search(query, k=self.k)
-            if hasattr(self.vectorstore, "similarity_search_with_score"):
-                pairs = self.vectorstore.similarity_search_with_score(query, k=self.k)
-                return [p[0] for p in pairs]
+        # Fallback: usar vectorstore directamente, con puntaje si lo expone
+        if vectorstore is not None:
+            if hasattr(vectorstore, "index") and hasattr(vectorstore, "docstore"):
+                # FAISS: se busca directo para tener la posición real de cada documento
+                n = min(self.k, vectorstore.index.ntotal)
+                if n <= 0:
+                    return []
+                distances, positions = vectorstore.index.search(embed_query(vectorstore, query), n)
+                return [
+                    ScoredDocument(document_at(vectorstore, int(pos)), float(dist), int(pos), vector_rank=rank, score_kind="distance")
+                    for rank, (dist, pos) in enumerate(zip(distances[0], positions[0]), start=1) if pos >= 0
+                ]
+            if hasattr(vectorstore, "similarity_search_with_score"):
+                pairs = vectorstore.similarity_search_with_score(query, k=self.k)
+                return [ScoredDocument(doc, float(score), None, score_kind="vectorstore") for doc, score in pairs]
+            if hasattr(vectorstore, "similarity_search"):
+                return as_hits(vectorstore.similarity_search(query, k=self.k))
 
         raise AttributeError("No hay método de recuperación disponible en retriever ni en vectorstore")
 
-    def run(self, query: str) -> str:
-        docs = self._retrieve(query)
-        texts = self._extract_texts(docs)
-        context = "\n\n".join(texts)
+    def retrieve_many(self, queries: List[str]) -> List[List[ScoredDocument]]:
+        """Documentos para varias preguntas; con el retriever híbrido, en una pasada batched."""
+        retriever, _ = self._index
+        with span("retrieve"):
+            if hasattr(retriever, "search_many"):
+                return retriever.search_many(queries, self.k)
+            return [self._search(query) for query in queries]
 
+    def _source_labels(self, hits: List[ScoredDocument]) -> List[str]:
+        # Identificador legible de cada documento recuperado
+        labels = []
+        for hit in hits:
+            metadata = _metadata(hit.document)
+            labels.append(str(metadata.get("id") or metadata.get("type") or "documento"))
+        return labels
+
+    def _build_prompt(self, query: str, context: str, history: str = "") -> str:
         # Prompt para respuestas muy breves (una sola oración) pero amigables.
         # El modelo debe apoyarse en las tablas; si no encuentra el dato exacto,
         # puede hacer una estimación razonable y decirlo explícitamente.
-        prompt = f"""Eres un asistente de análisis de datos de ventas.
+        # `history`: resumen acotado de la conversación (ver sessions.py)
+        conversation = f"""
+CONVERSACIÓN PREVIA (resumen, sólo como referencia):
+{history}
+""" if history else ""
+        return f"""Eres un asistente de análisis de datos de ventas.
 
 DATOS (tablas y resúmenes derivados del Excel):
 {context}
-
+{conversation}
 PREGUNTA DEL USUARIO:
 {query}
 
@@ -81,80 +209,235 @@ INSTRUCCIONES:
 
 RESPUESTA (una única oración, tono cordial):"""
 
+    @staticmethod
+    def _fallback_answer(context: str) -> str:
+        return f"Basandome en los datos disponibles, encontre la siguiente informacion relevante:\n\n{context[:1000]}..."
+
+    def _fallback_result(self, context: str, hits, prompt_tokens, error: Exception, mode: str) -> RAGResult:
+        # Si hay error con el LLM, devolver contexto directamente (DEMO MODE)
+        print(f"[WARN] Error LLM (usando modo demo): {str(error)[:100]}")
+        metrics.LLM_ERRORS.inc(mode=mode)
+        metrics.FALLBACKS.inc()
+        with span("fallback"):
+            answer = self._fallback_answer(context)
+        return RAGResult(answer, fallback=True, sources=self._source_labels(hits), prompt_tokens=prompt_tokens,
+                         documents=source_details(hits))
+
+    def _completion_tokens(self, response, text: str) -> int:
+        # Lo que informe el proveedor (Ollama / OpenAI); si no, contarlos
+        usage = getattr(response, "usage_metadata", None) or {}
+        return usage.get("output_tokens") or self.token_counter.count(text)
+
+    def _result(self, response, hits, prompt_tokens) -> RAGResult:
+        # ChatOpenAI / ChatOllama devuelven un AIMessage, extraemos el contenido
+        answer = response.content if hasattr(response, "content") else str(response)
+        metrics.record_tokens(prompt_tokens, self._completion_tokens(response, answer))
+        return RAGResult(answer, sources=self._source_labels(hits), prompt_tokens=prompt_tokens,
+                         documents=source_details(hits))
+
+    def _assemble(self, query: str, docs, history: str = ""):
+        # Devuelve sólo los documentos (`ScoredDocument`) que entraron en el presupuesto
+        hits = as_hits(docs)
+        with span("extract"):
+            packed = pack_context(self._extract_texts([hit.document for hit in hits]), self.token_budget,
+                                  self.token_counter)
+            hits = [hits[i] for i in packed.used]
+        with span("prompt"):
+            prompt = self._build_prompt(query, packed.text, history)
+            prompt_tokens = self.token_counter.count(prompt)
+        return hits, packed.text, prompt, prompt_tokens
+
+    def _prepare(self, query: str, history: str = "", docs=None):
+        # `docs`: documentos ya recuperados (p. ej. con `retrieve_many`)
+        return self._assemble(query, self._retrieve(query) if docs is None else docs, history)
+
+    def run(self, query: str) -> str:
+        return self.generate(query).answer
+
+    def generate(self, query: str, history: str = "", docs=None) -> RAGResult:
+        hits, context, prompt, prompt_tokens = self._prepare(query, history, docs)
+
         # Llamar al LLM - ChatOpenAI usa invoke()
         try:
-            response = self.llm.invoke(prompt)
-            # ChatOpenAI devuelve un AIMessage, extraemos el contenido
-            if hasattr(response, 'content'):
-                return response.content
-            return str(response)
+            with span("llm"):
+                response = self.llm.invoke(prompt)
         except Exception as e:
-            # Si hay error con OpenAI, devolver contexto directamente (DEMO MODE)
-            print(f"[WARN] Error LLM (usando modo demo): {str(e)[:100]}")
-            return f"Basandome en los datos disponibles, encontre la siguiente informacion relevante:\n\n{context[:1000]}..."
-
-def load_vectorstore(path: str):
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    # Intentar cargar el índice permitiendo la deserialización peligrosa
-    # (necesario si el vectorstore usa pickle para los metadatos).
-    # Esto es seguro sólo si confías en el origen de `path` (p. ej. lo generaste tú).
+            return self._fallback_result(context, hits, prompt_tokens, e, "invoke")
+        return self._result(response, hits, prompt_tokens)
+
+    async def _aretrieve(self, query: str):
+        # La búsqueda en FAISS es CPU; se corre en un hilo para no bloquear el loop
+        return await asyncio.to_thread(self._retrieve, query)
+
+    async def _aprepare(self, query: str, history: str = "", docs=None):
+        return self._assemble(query, await self._aretrieve(query) if docs is None else docs, history)
+
+    async def arun(self, query: str) -> str:
+        return (await self.agenerate(query)).answer
+
+    async def agenerate(self, query: str, history: str = "", docs=None) -> RAGResult:
+        """Versión async de `generate`: retrieval en un hilo + `ainvoke` del LLM."""
+        hits, context, prompt, prompt_tokens = await self._aprepare(query, history, docs)
+        try:
+            with span("llm"):
+                response = await self.llm.ainvoke(prompt)
+        except Exception as e:
+            return self._fallback_result(context, hits, prompt_tokens, e, "invoke")
+        return self._result(response, hits, prompt_tokens)
+
+    async def astream(self, query: str, history: str = "") -> "RAGStream":
+        hits, context, prompt, prompt_tokens = await self._aprepare(query, history)
+        return RAGStream(self, prompt, context, hits, prompt_tokens)
+
+    def stream(self, query: str, history: str = "") -> "RAGStream":
+        """Recupera el contexto y devuelve un iterador de fragmentos del LLM."""
+        hits, context, prompt, prompt_tokens = self._prepare(query, history)
+        return RAGStream(self, prompt, context, hits, prompt_tokens)
+
+
+class RAGStream:
+    """Iterador de tokens del LLM; al terminar deja el resultado en `result`.
+
+    Las fuentes (`sources` y su detalle en `documents`) están disponibles
+    antes de empezar a iterar, para poder enviarlas en el primer evento. Se puede recorrer con `for` (usa
+    `llm.stream`) o con `async for` (usa `llm.astream`).
+    """
+    def __init__(self, rag: SimpleRAG, prompt: str, context: str, hits, prompt_tokens: Optional[int] = None):
+        self._rag = rag
+        self._prompt = prompt
+        self._context = context
+        self.sources = rag._source_labels(hits)
+        self.documents = source_details(hits)
+        self.prompt_tokens = prompt_tokens
+        self.result = None
+        # El stream se consume fuera del handler que lo creó: la traza se fija acá
+        self._trace = metrics.current_trace()
+
+    def _chunk_text(self, chunk) -> str:
+        return chunk.content if hasattr(chunk, "content") else str(chunk)
+
+    def _first_chunk(self, start: float) -> None:
+        metrics.FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start)
+
+    def _fail(self, error: Exception, parts: List[str]) -> Optional[str]:
+        print(f"[WARN] Error LLM en streaming (usando modo demo): {str(error)[:100]}")
+        metrics.LLM_ERRORS.inc(mode="stream")
+        # Si todavía no salió ningún token, mandar el contexto como en `generate`
+        if parts:
+            return None
+        metrics.FALLBACKS.inc()
+        with span("fallback", self._trace):
+            return self._rag._fallback_answer(self._context)
+
+    def _finish(self, parts: List[str], fallback: bool, start: float) -> None:
+        metrics.observe_stage("llm", time.perf_counter() - start, self._trace)
+        answer = "".join(parts)
+        metrics.record_tokens(self.prompt_tokens, None if fallback else self._rag.token_counter.count(answer))
+        self.result = RAGResult(answer, fallback=fallback, sources=self.sources,
+                                prompt_tokens=self.prompt_tokens, documents=self.documents)
+
+    def __iter__(self):
+        parts = []
+        fallback = False
+        start = time.perf_counter()
+        try:
+            for chunk in self._rag.llm.stream(self._prompt):
+                text = self._chunk_text(chunk)
+                if text:
+                    if not parts:
+                        self._first_chunk(start)
+                    parts.append(text)
+                    yield text
+        except Exception as e:
+            fallback = True
+            text = self._fail(e, parts)
+            if text is not None:
+                parts.append(text)
+                yield text
+        self._finish(parts, fallback, start)
+
+    async def __aiter__(self):
+        parts = []
+        fallback = False
+        start = time.perf_counter()
+        try:
+            async for chunk in self._rag.llm.astream(self._prompt):
+                text = self._chunk_text(chunk)
+                if text:
+                    if not parts:
+                        self._first_chunk(start)
+                    parts.append(text)
+                    yield text
+        except Exception as e:
+            fallback = True
+            text = self._fail(e, parts)
+            if text is not None:
+                parts.append(text)
+                yield text
+        self._finish(parts, fallback, start)
+
+def get_retrieval_k() -> int:
+    return int(os.getenv("RETRIEVAL_K", "4"))
+
+
+def make_retriever(vectorstore, k: int = 4):
+    # Retriever híbrido (BM25 + vectores); si no se puede armar, el de LangChain
     try:
-        return FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
-    except TypeError:
-        # Versiones antiguas de la librería no aceptan ese argumento; caer
-        # al comportamiento anterior (más estricto) y dejar que el error
-        # posterior indique si es inseguro.
-        return FAISS.load_local(path, embeddings)
-    except ValueError as e:
-        # Reenviar con mensaje más claro
-        raise ValueError(
-            str(e)
-            + "\nSi confías en el origen del vectorstore, puedes permitir la deserialización estableciendo `allow_dangerous_deserialization=True`."
-        )
-
-def build_qa():
-    # cargar vectorstore
-    vectorstore = load_vectorstore(os.getenv("VECTORSTORE_DIR", "../vectorstore"))
-    # Intentar generar un retriever; si falla, pasamos el vectorstore a SimpleRAG
+        return HybridRetriever.from_vectorstore(vectorstore, k=k)
+    except Exception as e:
+        print(f"[WARN] Retriever híbrido no disponible ({str(e)[:100]}); se usa sólo FAISS.")
+    # Intentar generar un retriever; si falla, SimpleRAG usa el vectorstore
     try:
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 1})  # Solo EL documento más relevante
+        return vectorstore.as_retriever(search_kwargs={"k": k})
     except Exception:
-        retriever = None
-
-    # Determinar qué proveedor de LLM usar
-    llm_provider = os.getenv("LLM_PROVIDER", "ollama").lower()
-    
-    if llm_provider == "ollama":
-        # Usar Ollama (modelo local)
-        base_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
-        model = os.getenv("OLLAMA_MODEL", "llama3.2")
-        
-        print(f"[INFO] Usando Ollama con modelo: {model}")
-        print(f"[INFO] URL del servidor Ollama: {base_url}")
-        
-        llm = ChatOllama(
-            model=model,
-            base_url=base_url,
-            temperature=0.1,  # Un poco de creatividad para mejor razonamiento
-            num_ctx=4096      # Más contexto para procesar más datos
-        )
-    
-    elif llm_provider == "openai":
-        # Usar OpenAI (API externa)
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("Falta la variable OPENAI_API_KEY en el archivo env")
-        
-        print(f"[INFO] Usando OpenAI con modelo: {os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')}")
-        
-        llm = ChatOpenAI(
-            temperature=0,
-            openai_api_key=api_key,
-            model_name=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
-        )
-    
+        return None
+
+
+def load_vectorstore(path: str, embeddings=None, ef_search: Optional[int] = None, nprobe: Optional[int] = None):
+    # `path` puede ser VECTORSTORE_DIR con versiones: se carga la activa
+    path = resolve_index_dir(path)
+    if embeddings is None:
+        embeddings = get_embeddings()
+    # Formato nativo (index.faiss mapeado en memoria + docs.sqlite): sin pickle.
+    # El manifest se valida contra el modelo de embeddings configurado.
+    vectorstore = load_index(
+        path,
+        embeddings,
+        model=embedding_model_name(),
+        dimension=len(embeddings.embed_query("dimension")),
+        mmap=os.getenv("VECTORSTORE_MMAP", "true").lower() in ("1", "true", "yes"),
+    )
+    # Índices ANN: efSearch / nprobe calibrados al construir, salvo que se pidan otros
+    ann = vectorstore.manifest.get("ann") or {}
+    params = ann_index.configure(vectorstore.index, ann.get("search_params"), ef_search=ef_search, nprobe=nprobe)
+    print(f"[INFO] Índice cargado: {vectorstore.manifest['count']} vectores "
+          f"({vectorstore.manifest['index_type']}, dataset {vectorstore.manifest['dataset']})"
+          + (f", búsqueda {params}, recall@{ann.get('recall_k')} {ann.get('recall')}" if params else ""))
+    return vectorstore
+
+
+def build_qa(ef_search: Optional[int] = None, nprobe: Optional[int] = None, llm=None,
+             vectorstore_dir: Optional[str] = None):
+    # cargar vectorstore (la versión activa). ef_search / nprobe: recall vs.
+    # latencia de índices HNSW / IVF (por defecto ANN_EF_SEARCH / ANN_NPROBE o
+    # lo calibrado al construir). `llm` reemplaza a los backends de
+    # LLM_BACKENDS / LLM_PROVIDER (p. ej. el LLM simulado de benchmark.py, o
+    # el gateway ya creado que comparten todos los datasets)
+    vectorstore_dir = vectorstore_dir or os.getenv("VECTORSTORE_DIR", "../vectorstore")
+    vectorstore = load_vectorstore(vectorstore_dir, ef_search=ef_search, nprobe=nprobe)
+    k = get_retrieval_k()
+    retriever = make_retriever(vectorstore, k=k)  # Los k documentos más relevantes
+
+    if llm is not None:
+        print(f"[INFO] Usando LLM provisto: {type(llm).__name__}")
     else:
-        raise ValueError(f"LLM_PROVIDER no válido: {llm_provider}. Usa 'ollama' o 'openai'")
+        # Uno o varios servidores (LLM_BACKENDS / LLM_PROVIDER), con balanceo y failover
+        llm = LLMGateway.from_env()
 
     # Usar nuestra implementación simple RAG
-    return SimpleRAG(llm=llm, retriever=retriever, vectorstore=vectorstore, k=1)
+    qa = SimpleRAG(llm=llm, retriever=retriever, vectorstore=vectorstore, k=k,
+                   version=read_current_version(vectorstore_dir),
+                   token_budget=get_context_budget())
+    print(f"[INFO] Presupuesto de contexto: {qa.token_budget or 'sin límite'} tokens "
+          f"(conteo: {qa.token_counter.method})")
+    return qa
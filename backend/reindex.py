@@ -0,0 +1,212 @@
+"""Reindexado en caliente.
+
+El índice nuevo se construye en un hilo de fondo (fuera del request) dentro
+de un directorio versionado de VECTORSTORE_DIR. Al terminar se llama a
+`on_ready`, que activa el índice en el `SimpleRAG` en uso con una sola
+asignación: las consultas que ya estaban en curso terminan con el índice
+anterior y las nuevas usan el nuevo, sin reiniciar el backend.
+
+Con varios workers:
+
+- `ReindexLock` (un lock de archivo en VECTORSTORE_DIR) garantiza que sólo un
+  proceso reconstruya a la vez; los demás responden 409.
+- `IndexWatcher` revisa el puntero `CURRENT` cada `INDEX_WATCH_SECONDS`: cuando
+  otro proceso (u otro worker, o `python embeddings_builder.py`) publica una
+  versión nueva, este worker la carga y la activa. Así todos pasan a la misma
+  versión a los pocos segundos de publicarse.
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+from index_versions import read_current_version
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+LOCK_FILE = ".reindex.lock"
+
+
+class ReindexLock:
+    """Lock exclusivo entre procesos sobre `directory/.reindex.lock` (no bloqueante)."""
+
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, LOCK_FILE)
+        self._fd: Optional[int] = None
+
+    def acquire(self) -> bool:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+
+class ReindexManager:
+    def __init__(self, on_ready: Callable[[object], None], active_version: Optional[str] = None):
+        # on_ready(BuildResult) se llama desde el hilo de fondo
+        self._on_ready = on_ready
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._status = {
+            "state": "idle",        # idle | running | done | failed
+            "stage": None,
+            "progress": 0.0,
+            "started_at": None,
+            "finished_at": None,
+            "duration_seconds": None,
+            "docs_indexed": None,
+            "changes": None,
+            "pipeline": None,       # docs/s y memoria del último build
+            "building_version": None,
+            "active_version": active_version,
+            "error": None,
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def status(self) -> dict:
+        with self._lock:
+            return dict(self._status)
+
+    def _update(self, **fields) -> None:
+        with self._lock:
+            self._status.update(fields)
+
+    def _progress(self, stage: str, fraction: float) -> None:
+        self._update(stage=stage, progress=round(fraction, 3))
+
+    def note_active(self, version: Optional[str]) -> None:
+        """Versión activada por fuera de este manager (p. ej. publicada por otro worker)."""
+        self._update(active_version=version)
+
+    def start(self, dataset_path: str, vectorstore_dir: str, embeddings=None, force: bool = False) -> bool:
+        """Lanza la reconstrucción; devuelve False si ya hay una en curso (en este u otro proceso)."""
+        with self._lock:
+            if self.running:
+                return False
+            process_lock = ReindexLock(vectorstore_dir)
+            if not process_lock.acquire():
+                return False
+            self._status.update(
+                state="running", stage="iniciando", progress=0.0, started_at=time.time(),
+                finished_at=None, duration_seconds=None, docs_indexed=None, pipeline=None,
+                changes=None, building_version=None, error=None,
+            )
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(dataset_path, vectorstore_dir, embeddings, force, process_lock),
+                name="reindex",
+                daemon=True,
+            )
+            self._thread.start()
+        return True
+
+    def _run(self, dataset_path: str, vectorstore_dir: str, embeddings, force: bool, process_lock: ReindexLock) -> None:
+        start = time.time()
+        try:
+            # Import diferido: el stack de embeddings sólo se necesita al reindexar
+            from embeddings_builder import build_vectorstore
+
+            result = build_vectorstore(
+                dataset_path, vectorstore_dir, embeddings=embeddings, progress=self._progress, force=force,
+            )
+            changes = {"added": result.added, "updated": result.updated, "removed": result.removed}
+            if result.skipped:
+                # Nada cambió: el índice activo sigue siendo válido
+                self._update(state="done", stage="sin cambios", progress=1.0,
+                             docs_indexed=result.docs_total, changes=changes)
+                return
+            self._update(stage="activando índice", building_version=result.version,
+                         docs_indexed=result.docs_total, changes=changes, pipeline=result.pipeline)
+            self._on_ready(result)
+            self._update(state="done", stage="listo", progress=1.0, active_version=result.version)
+            print(f"[OK] Reindex completo: versión {result.version} activa ({result.docs_total} documentos)")
+        except Exception as e:
+            print(f"[ERROR] Reindex falló: {str(e)}")
+            self._update(state="failed", error=str(e)[:500])
+        finally:
+            process_lock.release()
+            now = time.time()
+            self._update(finished_at=now, duration_seconds=round(now - start, 3))
+
+
+class IndexWatcher:
+    """Hilo que sigue el puntero `CURRENT` y activa las versiones que publican otros procesos."""
+
+    def __init__(
+        self,
+        vectorstore_dir: str,
+        active_version: Callable[[], Optional[str]],
+        on_change: Callable[[str], None],
+        interval: float = 2.0,
+        busy: Optional[Callable[[], bool]] = None,
+    ):
+        self.vectorstore_dir = vectorstore_dir
+        self._active_version = active_version
+        self._on_change = on_change
+        self.interval = interval
+        # Mientras este proceso reindexa, la versión nueva la activa su propio callback
+        self._busy = busy or (lambda: False)
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._failed: Optional[str] = None
+
+    @classmethod
+    def from_env(cls, vectorstore_dir: str, active_version, on_change, busy=None) -> "IndexWatcher":
+        return cls(vectorstore_dir, active_version, on_change,
+                   interval=float(os.getenv("INDEX_WATCH_SECONDS", "2")), busy=busy)
+
+    def start(self) -> None:
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="index-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def check(self) -> bool:
+        """Activa la versión publicada si difiere de la activa; True si cambió."""
+        version = read_current_version(self.vectorstore_dir)
+        if not version or version == self._active_version() or version == self._failed or self._busy():
+            return False
+        try:
+            self._on_change(version)
+        except Exception as e:
+            # No reintentar en cada vuelta la misma versión rota
+            self._failed = version
+            print(f"[ERROR] No se pudo activar la versión {version} del índice: {str(e)[:200]}")
+            return False
+        return True
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.check()
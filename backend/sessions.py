@@ -0,0 +1,383 @@
+"""Sesiones de conversación con historial compacto del lado del servidor.
+
+Con `session_id` en la consulta, el backend recuerda la conversación y
+resuelve las repreguntas:
+
+1. **Reescritura**: una repregunta ("¿y en 2024?", "¿y en Córdoba?", "en
+   marzo") se convierte en una pregunta autónoma reemplazando los filtros
+   (año, mes, producto, cliente, ciudad, categoría) de la pregunta anterior.
+   Se hace con reglas, sin llamar al LLM, así que no agrega latencia; la
+   pregunta reescrita es la que va a la analítica, al caché y al retrieval.
+2. **Historial acotado**: se guardan textuales los últimos
+   `SESSION_HISTORY_TURNS` turnos; los anteriores pasan a un resumen de una
+   línea por turno (pregunta + primera oración de la respuesta) del que se
+   conservan `SESSION_SUMMARY_TURNS`. El bloque que va al prompt se recorta a
+   `SESSION_HISTORY_TOKENS`, así el tamaño del prompt y la latencia por turno
+   no crecen con el largo de la conversación.
+
+Las sesiones viven en memoria en un LRU de `SESSION_MAX` entradas y expiran
+tras `SESSION_TTL` segundos sin uso. Con un backend compartido
+(`shared_cache.py`, varios workers) cada turno se guarda también ahí y al
+recibir una consulta se lee lo último, así la repregunta puede caer en
+cualquier worker.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+from text_utils import MESES, NOMBRES_MES, RAICES_NEGOCIO, normalize
+
+
+FilterParser = Callable[[str], Dict[str, object]]
+
+_RE_ANO = re.compile(r"\b(20\d{2})\b")
+_RE_MES = re.compile(r"\b(" + "|".join(MESES) + r")\b")
+
+# Comienzos típicos de una repregunta: "¿y en 2024?", "¿qué tal en marzo?"
+_RE_CONECTOR = re.compile(
+    r"^(?:y|e|tambien|ahora|entonces|lo mismo|idem|(?:y )?que (?:tal|hay|pasa)|(?:y )?como (?:fue|es))\b\s*"
+)
+# Palabras que pueden acompañar a un filtro sin cambiar la pregunta
+_RELLENO = frozenset("a al de del el en la las lo los para por con sobre durante".split())
+# Piden el total sin filtros: "¿y en total?" no hereda el año de la anterior
+_TOTALES = frozenset("total totales todo toda todos todas general global completo historico siempre".split())
+# Medidas y dimensiones sin raíz en RAICES_NEGOCIO
+_NEGOCIO = frozenset("promedio media top mes meses ano anos".split())
+
+# Largo máximo de cada parte de una línea del resumen
+SUMMARY_QUESTION_CHARS = 120
+SUMMARY_ANSWER_CHARS = 160
+_RE_ORACION = re.compile(r"(?<=[.!?])\s")
+
+
+def parse_date_filters(text: str) -> Dict[str, object]:
+    """Año y mes mencionados en `text` (ya normalizado)."""
+    filters: Dict[str, object] = {}
+    m = _RE_ANO.search(text)
+    if m:
+        filters["Año"] = int(m.group(1))
+    m = _RE_MES.search(text)
+    if m:
+        filters["Mes"] = MESES[m.group(1)]
+    return filters
+
+
+def _value_text(column: str, value) -> str:
+    if column == "Mes":
+        return NOMBRES_MES[int(value)]
+    return normalize(str(value))
+
+
+def _value_pattern(column: str, value) -> str:
+    if column == "Mes":
+        return _RE_MES.pattern
+    return rf"\b{re.escape(_value_text(column, value))}\b"
+
+
+def _names_business(text: str) -> bool:
+    # "¿y los clientes?", "¿y el promedio?" sí; "¿qué me recomiendas?" no
+    return any(w in _NEGOCIO or w.startswith(RAICES_NEGOCIO) for w in text.split())
+
+
+def _filters_phrase(filters: Dict[str, object]) -> str:
+    # "en marzo de 2023 para cordoba"
+    parts = []
+    fecha = " de ".join(_value_text(col, filters[col]) for col in ("Mes", "Año") if col in filters)
+    if fecha:
+        parts.append(f"en {fecha}")
+    parts.extend(f"para {_value_text(col, v)}" for col, v in filters.items() if col not in ("Mes", "Año"))
+    return " ".join(parts)
+
+
+class FollowUpRewriter:
+    """Convierte repreguntas en preguntas autónomas a partir de la anterior.
+
+    `filter_parser` recibe texto normalizado y devuelve `{columna: valor}`
+    (por defecto sólo año y mes; el backend usa el de `SalesAnalytics`, que
+    además reconoce productos, clientes, ciudades y categorías).
+    """
+
+    def __init__(self, filter_parser: Optional[FilterParser] = None):
+        self.filter_parser = filter_parser or parse_date_filters
+
+    def _only_filters(self, text: str, filters: Dict[str, object]) -> bool:
+        # "en 2024", "cordoba": todas las palabras son filtros o relleno
+        if not filters:
+            return False
+        covered = set()
+        for col, value in filters.items():
+            covered.update(_value_text(col, value).split())
+        covered.update(MESES)
+        return all(word in covered or word in _RELLENO for word in text.split())
+
+    @staticmethod
+    def _multi_valued(text: str, filters: Dict[str, object], parse: FilterParser) -> bool:
+        # "en 2023 y 2024": sin el valor encontrado, la columna vuelve a aparecer
+        for col, value in filters.items():
+            if col == "Mes":
+                pattern = r"\b(?:" + "|".join(n for n, num in MESES.items() if num == value) + r")\b"
+            else:
+                pattern = _value_pattern(col, value)
+            if col in parse(re.sub(pattern, " ", text)):
+                return True
+        return False
+
+    def rewrite(self, question: str, previous: Optional[str], filter_parser: Optional[FilterParser] = None) -> str:
+        """Pregunta autónoma equivalente a `question` dada la pregunta anterior.
+
+        `filter_parser` reemplaza al del constructor (p. ej. el del dataset de la consulta).
+        Queda como está si pide varios valores de una columna ("¿y en 2023 y
+        2024?"), el total ("¿y en total?") o no nombra ninguna medida ni
+        dimensión ("entonces, ¿qué me recomiendas?").
+        """
+        if not previous:
+            return question
+        parse = filter_parser or self.filter_parser
+        text = normalize(question)
+        rest = _RE_CONECTOR.sub("", text, count=1)
+        follow_up = rest != text
+        filters = parse(rest)
+        if not (follow_up or self._only_filters(rest, filters)):
+            return question
+        if _TOTALES.intersection(rest.split()) or self._multi_valued(rest, filters, parse):
+            return question
+
+        base = normalize(previous)
+        if filters:
+            # Reemplazar en la pregunta anterior los filtros que cambian y agregar los nuevos
+            previous_filters = parse(base)
+            extra = {}
+            for col, value in filters.items():
+                if col in previous_filters:
+                    base = re.sub(_value_pattern(col, previous_filters[col]), _value_text(col, value), base, count=1)
+                elif col in ("Mes", "Año") and ({"Mes", "Año"} - {col}) & previous_filters.keys():
+                    # Completar la fecha: "en 2023" + "¿y en marzo?" -> "en marzo de 2023"
+                    other = "Año" if col == "Mes" else "Mes"
+                    fecha = _filters_phrase({col: value, other: previous_filters[other]})[3:]
+                    base = re.sub(_value_pattern(other, previous_filters[other]), fecha, base, count=1)
+                else:
+                    extra[col] = value
+            if extra:
+                base = f"{base} {_filters_phrase(extra)}"
+            # Si además de filtros hay otra cosa ("y los clientes en 2024"), va adelante
+            if not self._only_filters(rest, filters):
+                return f"{rest} ({base})"
+            return base
+
+        # Repregunta sin filtros ("¿y los clientes?"): hereda los de la anterior,
+        # sólo si pregunta por algo del dataset
+        if not _names_business(rest):
+            return question
+        previous_filters = parse(base)
+        if previous_filters and rest:
+            return f"{rest} {_filters_phrase(previous_filters)}"
+        return f"{rest} ({base})" if rest else base
+
+
+@dataclass
+class Turn:
+    question: str      # pregunta autónoma (ya reescrita)
+    answer: str
+
+
+def _first_sentence(text: str, limit: int) -> str:
+    text = " ".join((text or "").split())
+    sentence = _RE_ORACION.split(text, maxsplit=1)[0]
+    return sentence if len(sentence) <= limit else sentence[: limit - 1].rstrip() + "…"
+
+
+@dataclass
+class Session:
+    history_turns: int = 3
+    summary_turns: int = 6
+    turns: Deque[Turn] = field(default_factory=deque)
+    summary: Deque[str] = field(default_factory=deque)
+    last_used: float = field(default_factory=time.monotonic)
+    count: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    session_id: str = ""
+
+    @property
+    def last_question(self) -> Optional[str]:
+        with self.lock:
+            return self.turns[-1].question if self.turns else None
+
+    def add(self, question: str, answer: str) -> None:
+        with self.lock:
+            self.turns.append(Turn(question, answer))
+            self.count += 1
+            # Los turnos viejos se resumen en una línea; el resumen también es acotado
+            while len(self.turns) > self.history_turns:
+                old = self.turns.popleft()
+                self.summary.append(
+                    f"- {_first_sentence(old.question, SUMMARY_QUESTION_CHARS)} → "
+                    f"{_first_sentence(old.answer, SUMMARY_ANSWER_CHARS)}"
+                )
+            while len(self.summary) > self.summary_turns:
+                self.summary.popleft()
+
+    def to_json(self) -> str:
+        with self.lock:
+            return json.dumps({
+                "turns": [[t.question, t.answer] for t in self.turns],
+                "summary": list(self.summary),
+                "count": self.count,
+            }, ensure_ascii=False)
+
+    def load_json(self, value: str) -> None:
+        """Reemplaza turnos y resumen por los guardados en el backend compartido."""
+        data = json.loads(value)
+        with self.lock:
+            self.turns = deque(Turn(q, a) for q, a in data["turns"])
+            self.summary = deque(data["summary"])
+            self.count = data["count"]
+
+    def history(self, max_tokens: int, count_tokens: Optional[Callable[[str], int]] = None) -> str:
+        """Resumen + últimos turnos, recortando lo más viejo hasta entrar en `max_tokens`."""
+        with self.lock:
+            lines = list(self.summary)
+            for turn in self.turns:
+                lines.append(f"Usuario: {turn.question}")
+                lines.append(f"Asistente: {_first_sentence(turn.answer, 2 * SUMMARY_ANSWER_CHARS)}")
+        count_tokens = count_tokens or (lambda text: math.ceil(len(text) / 4))
+        while lines and count_tokens("\n".join(lines)) > max_tokens:
+            lines.pop(0)
+        return "\n".join(lines)
+
+
+class SessionStore:
+    """Sesiones en memoria: LRU de `max_sessions` con expiración por inactividad."""
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        ttl_seconds: float = 1800.0,
+        history_turns: int = 3,
+        summary_turns: int = 6,
+        history_tokens: int = 300,
+        rewriter: Optional[FollowUpRewriter] = None,
+        shared=None,
+    ):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.history_turns = history_turns
+        self.summary_turns = summary_turns
+        self.history_tokens = history_tokens
+        self.rewriter = rewriter or FollowUpRewriter()
+        self.shared = shared
+
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.created = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.rewrites = 0
+
+    @classmethod
+    def from_env(cls, rewriter: Optional[FollowUpRewriter] = None, shared=None) -> "SessionStore":
+        return cls(
+            max_sessions=int(os.getenv("SESSION_MAX", "1000")),
+            ttl_seconds=float(os.getenv("SESSION_TTL", "1800")),
+            history_turns=int(os.getenv("SESSION_HISTORY_TURNS", "3")),
+            summary_turns=int(os.getenv("SESSION_SUMMARY_TURNS", "6")),
+            history_tokens=int(os.getenv("SESSION_HISTORY_TOKENS", "300")),
+            rewriter=rewriter,
+            shared=shared,
+        )
+
+    def _expire(self, now: float) -> None:
+        # Las menos usadas están al principio
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_used < self.ttl_seconds:
+                break
+            del self._sessions[session_id]
+            self.expirations += 1
+
+    def _shared_get(self, session_id: str) -> Optional[str]:
+        try:
+            found = self.shared.get("sessions", session_id)
+        except Exception as e:
+            print(f"[WARN] Sesiones compartidas no disponibles: {str(e)[:100]}")
+            return None
+        if found is None or time.time() - found[1] >= self.ttl_seconds:
+            return None
+        return found[0]
+
+    def get(self, session_id: str) -> Session:
+        """Sesión `session_id`; se crea si no existe (o expiró)."""
+        now = time.monotonic()
+        stored = self._shared_get(session_id) if self.shared is not None else None
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = Session(self.history_turns, self.summary_turns, session_id=session_id)
+                self._sessions[session_id] = session
+                self.created += 1
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self._sessions.move_to_end(session_id)
+            session.last_used = now
+        # El último turno pudo haberlo respondido otro worker
+        if stored is not None:
+            session.load_json(stored)
+        return session
+
+    def add_turn(self, session: Session, question: str, answer: str) -> None:
+        session.add(question, answer)
+        if self.shared is not None:
+            try:
+                self.shared.put("sessions", session.session_id, session.to_json(), max_entries=self.max_sessions)
+            except Exception as e:
+                print(f"[WARN] Sesiones compartidas no disponibles: {str(e)[:100]}")
+
+    def drop(self, session_id: str) -> bool:
+        with self._lock:
+            dropped = self._sessions.pop(session_id, None) is not None
+        if self.shared is not None:
+            try:
+                dropped = self.shared.delete("sessions", session_id) or dropped
+            except Exception as e:
+                print(f"[WARN] Sesiones compartidas no disponibles: {str(e)[:100]}")
+        return dropped
+
+    def prepare(
+        self,
+        session_id: str,
+        question: str,
+        count_tokens: Optional[Callable[[str], int]] = None,
+        filter_parser: Optional[FilterParser] = None,
+    ) -> Tuple[Session, str, str]:
+        """Sesión, pregunta autónoma e historial compacto para el prompt."""
+        session = self.get(session_id)
+        standalone = self.rewriter.rewrite(question, session.last_question, filter_parser)
+        if standalone != question:
+            with self._lock:
+                self.rewrites += 1
+        return session, standalone, session.history(self.history_tokens, count_tokens)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl_seconds,
+                "history_turns": self.history_turns,
+                "summary_turns": self.summary_turns,
+                "history_tokens": self.history_tokens,
+                "created": self.created,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "rewrites": self.rewrites,
+                "shared": self.shared.name if self.shared is not None else None,
+            }
@@ -0,0 +1,224 @@
+"""Almacén clave-valor compartido entre workers.
+
+Con `uvicorn --workers N` cada proceso tenía su propio caché de respuestas,
+de embeddings y de sesiones: N cachés fríos y la repregunta de una sesión
+podía caer en un worker que no la conocía. Los consumidores (caché semántico,
+LRU de embeddings, sesiones) guardan además en un backend compartido:
+
+- `sqlite`: un archivo SQLite en modo WAL (`SHARED_CACHE_PATH`); todos los
+  workers de la máquina leen y escriben el mismo archivo.
+- `memory`: diccionarios en memoria con la misma interfaz; sirve para un solo
+  proceso y para probar el modo compartido sin disco.
+
+`SHARED_CACHE` elige el backend; vacío o `auto` usa `sqlite` si
+`WEB_CONCURRENCY` (lo que lee uvicorn para `--workers`) es mayor que 1 y, si
+no, ninguno (cada consumidor sólo con su estructura en memoria, como antes).
+Otros backends (p. ej. Redis) se agregan registrando una fábrica en `BACKENDS`.
+
+Los valores son texto (JSON) agrupados por `namespace`; cada entrada lleva la
+hora de su última escritura para expirar, recortar y sincronizar lo nuevo.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+Entry = Tuple[str, str, float]      # (clave, valor, hora de escritura)
+
+# Cada cuántas escrituras se recorta un namespace a su máximo
+TRIM_EVERY = 64
+
+
+class CacheBackend(ABC):
+    """Interfaz de los backends compartidos."""
+
+    name = ""
+
+    @abstractmethod
+    def get(self, namespace: str, key: str) -> Optional[Tuple[str, float]]:
+        """`(valor, hora de escritura)` o None."""
+
+    @abstractmethod
+    def put(self, namespace: str, key: str, value: str, max_entries: int = 0) -> None:
+        """Guarda `value`; con `max_entries` se descartan las entradas más viejas del namespace."""
+
+    @abstractmethod
+    def since(self, namespace: str, after: float) -> List[Entry]:
+        """Entradas escritas después de `after`, de la más vieja a la más nueva."""
+
+    @abstractmethod
+    def delete(self, namespace: str, key: str) -> bool:
+        """Borra la entrada; True si existía."""
+
+    @abstractmethod
+    def clear(self, namespace: str) -> None:
+        """Borra todas las entradas del namespace."""
+
+    @abstractmethod
+    def count(self, namespace: str) -> int:
+        """Entradas guardadas en el namespace."""
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+class MemoryBackend(CacheBackend):
+    """Sustituto en memoria (un solo proceso)."""
+
+    name = "memory"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data: Dict[str, "OrderedDict[str, Tuple[str, float]]"] = {}
+
+    def get(self, namespace: str, key: str) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            return self._data.get(namespace, {}).get(key)
+
+    def put(self, namespace: str, key: str, value: str, max_entries: int = 0) -> None:
+        with self._lock:
+            entries = self._data.setdefault(namespace, OrderedDict())
+            entries.pop(key, None)
+            entries[key] = (value, time.time())
+            while max_entries > 0 and len(entries) > max_entries:
+                entries.popitem(last=False)
+
+    def since(self, namespace: str, after: float) -> List[Entry]:
+        with self._lock:
+            return [(k, v, t) for k, (v, t) in self._data.get(namespace, {}).items() if t > after]
+
+    def delete(self, namespace: str, key: str) -> bool:
+        with self._lock:
+            return self._data.get(namespace, {}).pop(key, None) is not None
+
+    def clear(self, namespace: str) -> None:
+        with self._lock:
+            self._data.pop(namespace, None)
+
+    def count(self, namespace: str) -> int:
+        with self._lock:
+            return len(self._data.get(namespace, {}))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"backend": self.name, "namespaces": {ns: len(e) for ns, e in self._data.items()}}
+
+
+class SQLiteBackend(CacheBackend):
+    """Archivo SQLite (WAL) compartido por todos los procesos de la máquina."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str, timeout: float = 5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._puts = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries (namespace TEXT NOT NULL, key TEXT NOT NULL, "
+            "value TEXT NOT NULL, updated REAL NOT NULL, PRIMARY KEY (namespace, key))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_updated ON entries (namespace, updated)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # Una conexión por hilo; autocommit y WAL: lectores y escritor no se bloquean
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace: str, key: str) -> Optional[Tuple[str, float]]:
+        row = self._conn().execute(
+            "SELECT value, updated FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        return (row[0], row[1]) if row is not None else None
+
+    def put(self, namespace: str, key: str, value: str, max_entries: int = 0) -> None:
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (namespace, key, value, updated) VALUES (?, ?, ?, ?)",
+            (namespace, key, value, time.time()),
+        )
+        self._puts += 1
+        if max_entries > 0 and self._puts % TRIM_EVERY == 0:
+            conn.execute(
+                "DELETE FROM entries WHERE namespace = ? AND key IN (SELECT key FROM entries "
+                "WHERE namespace = ? ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+                (namespace, namespace, max_entries),
+            )
+
+    def since(self, namespace: str, after: float) -> List[Entry]:
+        return self._conn().execute(
+            "SELECT key, value, updated FROM entries WHERE namespace = ? AND updated > ? ORDER BY updated",
+            (namespace, after),
+        ).fetchall()
+
+    def delete(self, namespace: str, key: str) -> bool:
+        cur = self._conn().execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+        return cur.rowcount > 0
+
+    def clear(self, namespace: str) -> None:
+        self._conn().execute("DELETE FROM entries WHERE namespace = ?", (namespace,))
+
+    def count(self, namespace: str) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM entries WHERE namespace = ?", (namespace,)).fetchone()[0]
+
+    def stats(self) -> dict:
+        rows = self._conn().execute("SELECT namespace, COUNT(*) FROM entries GROUP BY namespace").fetchall()
+        return {"backend": self.name, "path": self.path, "namespaces": dict(rows)}
+
+
+def _sqlite_from_env() -> CacheBackend:
+    return SQLiteBackend(os.getenv("SHARED_CACHE_PATH", "../shared_cache/cache.sqlite"))
+
+
+BACKENDS: Dict[str, Callable[[], CacheBackend]] = {
+    "memory": MemoryBackend,
+    "sqlite": _sqlite_from_env,
+}
+
+_lock = threading.Lock()
+_backend: Optional[CacheBackend] = None
+_resolved = False
+
+
+def backend_name() -> Optional[str]:
+    name = os.getenv("SHARED_CACHE", "auto").strip().lower()
+    if name in ("", "auto"):
+        return "sqlite" if int(os.getenv("WEB_CONCURRENCY", "1") or 1) > 1 else None
+    if name in ("none", "off", "false"):
+        return None
+    return name
+
+
+def get_backend() -> Optional[CacheBackend]:
+    """Backend compartido del proceso (según `SHARED_CACHE`), o None si no hay."""
+    global _backend, _resolved
+    if not _resolved:
+        with _lock:
+            if not _resolved:
+                name = backend_name()
+                if name is not None:
+                    if name not in BACKENDS:
+                        raise ValueError(f"SHARED_CACHE no válido: {name}. Usa {', '.join(BACKENDS)} o none")
+                    _backend = BACKENDS[name]()
+                    print(f"[INFO] Caché compartido entre workers: {name}")
+                _resolved = True
+    return _backend
+
+
+def use_backend(backend: Optional[CacheBackend]) -> None:
+    """Reemplaza el backend del proceso (p. ej. uno en memoria para pruebas)."""
+    global _backend, _resolved
+    with _lock:
+        _backend, _resolved = backend, True
@@ -7,6 +7,7 @@ import os
 from dotenv import load_dotenv
 from data_loader import build_documents_from_excel
 from rag_pipeline import build_qa
+import index_store
 
 # Cargar variables de entorno
 load_dotenv("env")
@@ -56,18 +57,67 @@ def test_vectorstore():
         print(f"   Ejecuta primero: python embeddings_builder.py")
         return False
     
-    faiss_file = os.path.join(vectorstore_dir, "index.faiss")
-    pkl_file = os.path.join(vectorstore_dir, "index.pkl")
+    # Con índices versionados, revisar la versión activa
+    from index_versions import resolve_index_dir
+    index_dir = resolve_index_dir(vectorstore_dir)
+    # Formato propio (index.faiss + docs.sqlite + manifest.json) o el pickle de LangChain
+    if index_store.is_native_index(index_dir):
+        files = [index_store.INDEX_FILE, index_store.DOCS_FILE, index_store.MANIFEST_FILE]
+    else:
+        files = ["index.faiss", "index.pkl"]
+    paths = [os.path.join(index_dir, name) for name in files]
     
-    if os.path.exists(faiss_file) and os.path.exists(pkl_file):
-        print(f"✅ Vectorstore encontrado en {vectorstore_dir}")
-        print(f"   - index.faiss: {os.path.getsize(faiss_file):,} bytes")
-        print(f"   - index.pkl: {os.path.getsize(pkl_file):,} bytes")
+    if all(os.path.exists(path) for path in paths):
+        print(f"✅ Vectorstore encontrado en {index_dir}")
+        for name, path in zip(files, paths):
+            print(f"   - {name}: {os.path.getsize(path):,} bytes")
         return True
     else:
         print(f"❌ ERROR: Archivos del vectorstore incompletos")
         return False
 
+# (pregunta, fragmento esperado de la respuesta directa; None = debe ir al RAG)
+ANALYTICS_CASES = [
+    ("¿Cuántas ventas hubo en 2023?", "En 2023 hubo"),
+    ("¿Cuál es el producto más vendido?", "con más unidades vendidas"),
+    ("¿Qué ciudad tiene más ventas?", "con más ventas"),
+    ("¿Qué ciudad tiene el mayor ticket promedio?", "Encarnación es la ciudad con mayor ticket promedio"),
+    ("¿Cuál es el cliente con menor ticket promedio?", "con menor ticket promedio"),
+    ("¿Cuántos clientes diferentes compraron?", "clientes distintos"),
+    ("¿Cuántos productos se vendieron en 2023?", "unidades"),
+    ("¿Cuántas ventas hubo por canal online?", None),
+    ("¿Qué producto tiene el mayor precio?", None),
+    ("media de unidades por venta", None),
+    ("ticket promedio por ciudad", None),
+    ("¿Cuántas ventas hubo en 2023 y 2024?", None),
+    ("¿Cuántas ventas hubo entre 2023 y 2024?", None),
+    ("¿Cuántas ventas hubo en enero y febrero de 2023?", None),
+]
+
+
+def test_analytics():
+    """Prueba 5: Respuestas directas de la analítica (o derivación al RAG)"""
+    print("\n" + "="*60)
+    print("PRUEBA 5: Analítica directa")
+    print("="*60)
+
+    from analytics import SalesAnalytics
+
+    default_path = os.path.join(os.path.dirname(__file__), "..", "TrabajoFinalPowerBI_v2 (1).xlsx")
+    analytics = SalesAnalytics.from_excel(os.getenv("DATASET_PATH", default_path))
+    if analytics is None:
+        print("❌ ERROR: No se pudo inicializar el motor de analítica")
+        return False
+
+    ok = True
+    for question, expected in ANALYTICS_CASES:
+        answer = analytics.answer(question)
+        passed = answer is None if expected is None else (answer is not None and expected in answer)
+        ok = ok and passed
+        print(f"{'✅' if passed else '❌'} {question!r} -> {answer!r}")
+    return ok
+
+
 def test_openai_key():
     """Prueba 3: Verificar que la API key de OpenAI está configurada"""
     print("\n" + "="*60)
@@ -129,6 +179,7 @@ def main():
     # Ejecutar pruebas
     results.append(("Carga de datos", test_data_loading()))
     results.append(("Vectorstore FAISS", test_vectorstore()))
+    results.append(("Analítica directa", test_analytics()))
     results.append(("Configuración OpenAI", test_openai_key()))
     
     # Solo probar RAG si las pruebas anteriores pasaron
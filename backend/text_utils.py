@@ -0,0 +1,48 @@
+import re
+import unicodedata
+from typing import List
+
+
+MESES = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6,
+    "julio": 7, "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10,
+    "noviembre": 11, "diciembre": 12,
+}
+NOMBRES_MES = {v: k for k, v in MESES.items() if k != "setiembre"}
+
+# Raíces de las medidas y dimensiones del dataset ("ventas", "vendidos", "clientes"...)
+RAICES_NEGOCIO = (
+    "vent", "vend", "compr", "pedid", "transacc", "ingres", "factur", "recaud", "monto", "dinero", "gananci",
+    "unidad", "ticket", "categor", "product", "ciudad", "client",
+)
+
+_PUNCTUATION = re.compile(r"[¡!¿?\.,;:]")
+_SPACES = re.compile(r"\s+")
+
+
+def clean_question(text: str) -> str:
+    """Quita signos de puntuación, espacios sobrantes y pasa a minúsculas."""
+    text_clean = _PUNCTUATION.sub("", text or "")
+    return _SPACES.sub(" ", text_clean).strip().lower()
+
+
+def normalize(text: str) -> str:
+    """Minúsculas, sin tildes ni signos de puntuación."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[¡!¿?\.,;:()\"']", " ", text.lower())
+    return _SPACES.sub(" ", text).strip()
+
+
+_TOKEN = re.compile(r"\w+")
+
+# Palabras vacías frecuentes; no aportan a la búsqueda léxica
+STOPWORDS = frozenset(
+    "a al con cual cuales cuanto cuantos cuantas cuanta de del el en es fue fueron hay hubo "
+    "la las le lo los me mi mas o para por que se su sus un una uno y".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Términos para el índice léxico: `normalize` + palabras, sin palabras vacías."""
+    return [t for t in _TOKEN.findall(normalize(text)) if t not in STOPWORDS]
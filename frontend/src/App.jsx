@@ -1,11 +1,12 @@
 import React, { useState } from 'react';
 import ChatWindow from './components/ChatWindow';
 import MessageInput from './components/MessageInput';
-import { askBot } from './api/api';
+import { askBotStream } from './api/api';
 
 function App() {
   const [messages, setMessages] = useState([]);
   const [isTyping, setIsTyping] = useState(false);
+  const [isStreaming, setIsStreaming] = useState(false);
 
   const handleSendMessage = async (text) => {
     const userMessage = {
@@ -18,31 +19,55 @@ function App() {
     setMessages((prev) => [...prev, userMessage]);
 
     setIsTyping(true);
+    setIsStreaming(true);
 
-    try {
-      const response = await askBot(text);
+    const botId = Date.now() + 1;
+    let started = false;
 
-      const botMessage = {
-        id: Date.now() + 1,
-        text: response.answer,
-        isUser: false,
-        timestamp: new Date(),
-      };
+    // Crea la burbuja del bot con el primer fragmento y la va completando
+    const updateBotMessage = (answer) => {
+      if (!started) {
+        started = true;
+        setIsTyping(false);
+        setMessages((prev) => [
+          ...prev,
+          { id: botId, text: answer, isUser: false, timestamp: new Date() },
+        ]);
+        return;
+      }
+      setMessages((prev) =>
+        prev.map((m) => (m.id === botId ? { ...m, text: answer } : m))
+      );
+    };
 
-      setMessages((prev) => [...prev, botMessage]);
+    try {
+      const response = await askBotStream(text, {
+        onToken: (_chunk, answer) => updateBotMessage(answer),
+      });
+      updateBotMessage(response.answer);
     } catch (error) {
       console.error('Error al obtener respuesta:', error);
 
-      const errorMessage = {
-        id: Date.now() + 1,
-        text: 'Lo siento, hubo un error al procesar tu pregunta. Por favor intenta de nuevo.',
-        isUser: false,
-        timestamp: new Date(),
-      };
+      const errorText =
+        'Lo siento, hubo un error al procesar tu pregunta. Por favor intenta de nuevo.';
+
+      if (started) {
+        setMessages((prev) =>
+          prev.map((m) => (m.id === botId ? { ...m, text: errorText } : m))
+        );
+      } else {
+        const errorMessage = {
+          id: botId,
+          text: errorText,
+          isUser: false,
+          timestamp: new Date(),
+        };
 
-      setMessages((prev) => [...prev, errorMessage]);
+        setMessages((prev) => [...prev, errorMessage]);
+      }
     } finally {
       setIsTyping(false);
+      setIsStreaming(false);
     }
   };
 
@@ -107,7 +132,7 @@ function App() {
       <main className="flex-1 flex items-center justify-center px-3 py-5 sm:px-4 sm:py-8">
         <section className="chat-shell animate-shell-in">
           <ChatWindow messages={messages} isTyping={isTyping} />
-          <MessageInput onSend={handleSendMessage} disabled={isTyping} />
+          <MessageInput onSend={handleSendMessage} disabled={isTyping || isStreaming} />
         </section>
       </main>
 
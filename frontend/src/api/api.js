@@ -3,6 +3,20 @@
  * El proxy de Vite redirige /api/query -> http://localhost:8000/query
  */
 
+/**
+ * Identificador de la conversación: el backend guarda el historial de cada
+ * sesión para entender repreguntas como "¿y en 2024?". Uno por pestaña.
+ */
+function getSessionId() {
+  const key = 'chatbot-session-id';
+  let id = sessionStorage.getItem(key);
+  if (!id) {
+    id = crypto.randomUUID ? crypto.randomUUID() : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    sessionStorage.setItem(key, id);
+  }
+  return id;
+}
+
 export async function askBot(question) {
   try {
     const response = await fetch('/api/query', {
@@ -10,7 +24,7 @@ export async function askBot(question) {
       headers: {
         'Content-Type': 'application/json',
       },
-      body: JSON.stringify({ question }),
+      body: JSON.stringify({ question, session_id: getSessionId() }),
     });
 
     if (!response.ok) {
@@ -18,10 +32,81 @@ export async function askBot(question) {
     }
 
     const data = await response.json();
-    return data; // { answer: "...", sources: [...] }
+    return data; // { answer, sources, documents, engine, timings, ... }
   } catch (error) {
     console.error('Error al consultar el backend:', error);
     throw error;
   }
 }
 
+
+/**
+ * Versión en streaming de askBot: consume los Server-Sent Events de
+ * /api/query/stream y va entregando los fragmentos a medida que llegan.
+ *
+ * Eventos: `sources` (primero), `token` (uno por fragmento), `done` o `error`.
+ */
+export async function askBotStream(question, { onSources, onToken } = {}) {
+  const response = await fetch('/api/query/stream', {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      Accept: 'text/event-stream',
+    },
+    body: JSON.stringify({ question, session_id: getSessionId() }),
+  });
+
+  if (!response.ok || !response.body) {
+    throw new Error(`Error: ${response.status} ${response.statusText}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let answer = '';
+  let sources = [];
+  let documents = [];
+  let details = {};
+
+  const handleEvent = (rawEvent) => {
+    let event = 'message';
+    const dataLines = [];
+    for (const line of rawEvent.split('\n')) {
+      if (line.startsWith('event:')) event = line.slice(6).trim();
+      else if (line.startsWith('data:')) dataLines.push(line.slice(5).trimStart());
+    }
+    if (dataLines.length === 0) return;
+    const data = JSON.parse(dataLines.join('\n'));
+
+    if (event === 'sources') {
+      sources = data.sources || [];
+      documents = data.documents || [];
+      onSources?.(sources, documents);
+    } else if (event === 'token') {
+      answer += data.text;
+      onToken?.(data.text, answer);
+    } else if (event === 'done') {
+      answer = data.answer ?? answer;
+      // engine, timings, cache_match, index_version...: por qué y cómo se respondió
+      details = data;
+    } else if (event === 'error') {
+      throw new Error(data.detail || 'Error en el stream');
+    }
+  };
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true }).replace(/\r\n/g, '\n');
+
+    let separator;
+    while ((separator = buffer.indexOf('\n\n')) !== -1) {
+      const rawEvent = buffer.slice(0, separator);
+      buffer = buffer.slice(separator + 2);
+      handleEvent(rawEvent);
+    }
+  }
+  if (buffer.trim()) handleEvent(buffer);
+
+  return { ...details, answer, sources, documents };
+}